@@ -1,14 +1,17 @@
+import os
 import json
-import io
 import logging
 from typing import Dict, Any
 
-from services.chat_service import ChatService
-from services.knowledge_base_service import KnowledgeBaseService
-from utils.response import create_response, error_response
+from botocore.exceptions import ClientError
+
+from services.registry import get_chat_service, get_knowledge_base_service, get_admin_service
+from utils.response import create_response, error_response, DecimalEncoder
 from utils.errors import APIError
-import cgi
-import base64
+from utils.clients import get_client
+from utils.multipart import get_file_field
+from utils.pagination import parse_limit
+from utils.auth import require_group
 from aws_xray_sdk.core import patcher
 from aws_xray_sdk.core import xray_recorder
 
@@ -20,10 +23,16 @@ patcher.patch_all()
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Upper bound for the ``limit`` query parameter of list endpoints
+MAX_PAGE_SIZE = 100
+MAX_ADMIN_PAGE_SIZE = 1000
+
 def get_user_id(event: Dict[str, Any]) -> str:
     """Extract user ID from the event"""
-    claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
-    user_id = claims.get('sub')
+    authorizer = event.get('requestContext', {}).get('authorizer', {})
+    claims = authorizer.get('claims', {})
+    # WebSocket routes use a Lambda authorizer, which only exposes principalId
+    user_id = claims.get('sub') or authorizer.get('principalId')
     if not user_id:
         raise APIError('Unauthorized', 401)
     return user_id
@@ -36,10 +45,88 @@ def get_user_email(event: Dict[str, Any]) -> str:
         logger.warning("No email found in claims")
     return email
 
+def authorize_websocket(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Lambda authorizer for the WebSocket $connect route.
+
+    Browsers cannot set headers on a WebSocket, so the client passes its
+    Cognito access token in the ``token`` query parameter and Cognito
+    validates it. The returned principalId (the user's sub) is what API
+    Gateway hands to every later route on the connection.
+    """
+    token = (event.get('queryStringParameters') or {}).get('token')
+    effect, principal_id, context = 'Deny', 'anonymous', {}
+    if token:
+        try:
+            user = get_client('cognito-idp').get_user(AccessToken=token)
+            attributes = {attribute['Name']: attribute['Value'] for attribute in user['UserAttributes']}
+            effect, principal_id = 'Allow', attributes['sub']
+            context = {'email': attributes.get('email', '')}
+        except ClientError as e:
+            logger.warning(f"Rejected WebSocket connection: {e.response['Error']['Code']}")
+    return {
+        'principalId': principal_id,
+        'policyDocument': {
+            'Version': '2012-10-17',
+            'Statement': [{
+                'Action': 'execute-api:Invoke',
+                'Effect': effect,
+                'Resource': event['methodArn']
+            }]
+        },
+        'context': context
+    }
+
+def handle_websocket_event(event: Dict[str, Any]) -> Dict[str, Any]:
+    """Handle WebSocket API events, streaming assistant replies to the client"""
+    request_context = event['requestContext']
+    route_key = request_context.get('routeKey')
+    connection_id = request_context['connectionId']
+    logger.info(f"WebSocket route: {route_key}, connection: {connection_id}")
+
+    if route_key in ('$connect', '$disconnect'):
+        return {'statusCode': 200}
+
+    management_api = get_client(
+        'apigatewaymanagementapi',
+        endpoint_url=f"https://{request_context['domainName']}/{request_context['stage']}"
+    )
+
+    def post(payload: Dict[str, Any]) -> None:
+        management_api.post_to_connection(
+            ConnectionId=connection_id,
+            Data=json.dumps(payload, cls=DecimalEncoder).encode('utf-8')
+        )
+
+    try:
+        if route_key != 'sendMessage':
+            raise APIError(f'Unsupported route: {route_key}', 400)
+
+        user_id = get_user_id(event)
+        data = json.loads(event.get('body') or '{}')
+        for part in get_chat_service().stream_message(
+            data.get('chatId', ''),
+            data.get('content', ''),
+            user_id,
+        ):
+            post(part)
+        return {'statusCode': 200}
+
+    except Exception as e:
+        logger.error(f"WebSocket error: {str(e)}")
+        post({'type': 'error', 'error': str(e)})
+        return {'statusCode': getattr(e, 'status_code', 500)}
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """Main Lambda handler function"""
+    # Authorizer events carry a connectionId too, so check for them first
+    if event.get('type') == 'REQUEST' and event.get('methodArn'):
+        return authorize_websocket(event)
+
     try:
         logger.info(f"Received event: {json.dumps(event)}")
+
+        if event.get('requestContext', {}).get('connectionId'):
+            return handle_websocket_event(event)
         
         http_method = event.get('httpMethod', '')
         path = event.get('path', '')
@@ -49,12 +136,17 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         path = path.strip('/')
         logger.info(f"Normalized path: {path}")
         
-        chat_service = ChatService()
-        kb_service = KnowledgeBaseService()
+        # Build only the service the route needs, so a chat service that fails
+        # to start (e.g. a misconfigured retrieval backend) cannot take the
+        # upload routes down with it
+        if path.startswith('chats'):
+            chat_service = get_chat_service()
+        elif path in ('add_to_knowledge_base', 'upload_url', 'complete_upload'):
+            kb_service = get_knowledge_base_service()
         
         user_id = None
         user_email = None
-        if path.startswith('chats') or path == 'add_to_knowledge_base':
+        if path.startswith('chats') or path in ('add_to_knowledge_base', 'upload_url', 'complete_upload'):
             try:
                 user_id = get_user_id(event)
                 user_email = get_user_email(event)
@@ -65,13 +157,24 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         if path == 'chats' and http_method == 'GET':
             logger.info("Handling GET /chats request")
-            chats = chat_service.get_chats(user_id)
+            params = event.get('queryStringParameters') or {}
+            chats = chat_service.get_chats(
+                user_id,
+                parse_limit(params.get('limit'), chat_service.chats_page_size, MAX_PAGE_SIZE),
+                params.get('cursor')
+            )
             return create_response(chats)
         
         elif path.startswith('chats/') and path.endswith('/messages') and http_method == 'GET':
             logger.info(f"Handling GET /chats/{path.split('/')[-2]}/messages request")
             chat_id = path.split('/')[-2]
-            messages = chat_service.get_messages(chat_id, user_id)
+            params = event.get('queryStringParameters') or {}
+            messages = chat_service.get_messages(
+                chat_id,
+                user_id,
+                parse_limit(params.get('limit'), chat_service.messages_page_size, MAX_PAGE_SIZE),
+                params.get('cursor')
+            )
             return create_response(messages)
         
         elif path.startswith('chats/') and path.endswith('/messages') and http_method == 'POST':
@@ -99,21 +202,57 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
         elif path == 'add_to_knowledge_base' and http_method == 'POST':
             logger.info("Handling POST /add_to_knowledge_base request")
-            content_type = event.get('headers', {}).get('Content-Type', '')
-            body = event.get('body', '')
-            if event.get('isBase64Encoded', False):
-                body = base64.b64decode(body)
-            form = cgi.FieldStorage(
-                fp=io.BytesIO(body),
-                headers={'content-type': content_type},
-                environ={'REQUEST_METHOD': 'POST'}
-            )
+            headers = event.get('headers') or {}
+            content_type = headers.get('Content-Type') or headers.get('content-type', '')
+            try:
+                file_field = get_file_field(
+                    event.get('body') or '',
+                    event.get('isBase64Encoded', False),
+                    content_type
+                )
+            except (KeyError, ValueError) as e:
+                raise APIError(f'Invalid multipart upload: {str(e)}', 400)
             result = kb_service.add_to_knowledge_base(
-                form['file'],
+                file_field,
+                user_email
+            )
+            return create_response(result)
+            
+        elif path == 'upload_url' and http_method == 'POST':
+            logger.info("Handling POST /upload_url request")
+            data = json.loads(event.get('body') or '{}')
+            upload = kb_service.create_upload(
+                data.get('filename', ''),
+                data.get('contentType') or 'application/pdf',
+                int(data.get('size', 0)),
+                user_email,
+                data.get('contentHash')
+            )
+            return create_response(upload)
+            
+        elif path == 'complete_upload' and http_method == 'POST':
+            logger.info("Handling POST /complete_upload request")
+            data = json.loads(event.get('body') or '{}')
+            result = kb_service.complete_upload(
+                data.get('s3_key', ''),
+                data.get('upload_id', ''),
+                data.get('parts', []),
                 user_email
             )
             return create_response(result)
             
+        elif path == 'admin/chats' and http_method == 'GET':
+            logger.info("Handling GET /admin/chats request")
+            claims = event.get('requestContext', {}).get('authorizer', {}).get('claims', {})
+            require_group(claims, os.environ.get('ADMIN_GROUP', 'admin'))
+            params = event.get('queryStringParameters') or {}
+            admin_service = get_admin_service()
+            chats = admin_service.list_chats(
+                params.get('cursor'),
+                parse_limit(params.get('limit'), admin_service.page_size, MAX_ADMIN_PAGE_SIZE)
+            )
+            return create_response(chats)
+            
         else:
             logger.warning(f"No route found for {http_method} {path}")
             return create_response({'error': 'Not found'}, 404)
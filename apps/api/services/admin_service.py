@@ -0,0 +1,90 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+
+from utils.clients import get_resource
+from utils.errors import APIError
+from utils.pagination import encode_cursor, decode_cursor
+from utils.throttle import CapacityLimiter
+
+logger = logging.getLogger(__name__)
+
+# Cursor entry for a segment that has been scanned to the end
+SEGMENT_DONE = False
+
+
+class AdminService:
+    """Operator-only access to data across all users.
+
+    Listing uses a parallel segmented scan: every page reads one page from
+    each unfinished segment on a worker pool, and all reads are throttled to
+    ADMIN_SCAN_RCU_PER_SECOND so exports cannot starve user traffic of
+    read capacity.
+    """
+
+    def __init__(self):
+        self.dynamodb = get_resource('dynamodb')
+        self.table = self.dynamodb.Table(f"{os.environ['PROJECT_NAME']}-chats")
+        self.total_segments = int(os.environ.get('ADMIN_SCAN_SEGMENTS', '4'))
+        self.page_size = int(os.environ.get('ADMIN_SCAN_PAGE_SIZE', '100'))
+        self.limiter = CapacityLimiter(float(os.environ.get('ADMIN_SCAN_RCU_PER_SECOND', '50')))
+        self._pool = ThreadPoolExecutor(max_workers=self.total_segments, thread_name_prefix='admin-scan')
+
+    def _scan_page(self, segment: int, total_segments: int, start_key: Optional[Dict[str, Any]],
+                   limit: int) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'Limit': limit,
+            # Title marker items share the table but are not chats
+            'FilterExpression': 'attribute_not_exists(titleOf)',
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        if start_key:
+            scan_kwargs['ExclusiveStartKey'] = start_key
+
+        self.limiter.wait()
+        response = self.table.scan(**scan_kwargs)
+        self.limiter.charge(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+        return response.get('Items', []), response.get('LastEvaluatedKey')
+
+    def scan_chats(self, segments: List[Any], limit: int) -> Iterator[Tuple[int, List[Dict[str, Any]], Any]]:
+        """Read one page from every unfinished segment in parallel.
+
+        Yields (segment, items, next position) as each segment's page
+        arrives. The position is a LastEvaluatedKey, or SEGMENT_DONE.
+        """
+        per_segment = max(1, limit // len(segments))
+        futures = {
+            self._pool.submit(self._scan_page, segment, len(segments), position, per_segment): segment
+            for segment, position in enumerate(segments)
+            if position is not SEGMENT_DONE
+        }
+        for future in as_completed(futures):
+            items, last_key = future.result()
+            yield futures[future], items, last_key or SEGMENT_DONE
+
+    def list_chats(self, cursor: str = None, limit: int = None) -> Dict[str, Any]:
+        """Get a page of chats across all users, in no particular order.
+
+        The cursor records each segment's position; the segment count is
+        taken from it, so an export that is under way is not disturbed by a
+        configuration change.
+        """
+        state = decode_cursor(cursor, {})
+        segments = state.get('segments') if state else [None] * self.total_segments
+        if not isinstance(segments, list) or not segments:
+            raise APIError('Invalid cursor', 400)
+
+        items = []
+        for segment, page, position in self.scan_chats(segments, limit or self.page_size):
+            items.extend(page)
+            segments[segment] = position
+
+        logger.info("Admin scan returned %d chats from %d segments", len(items), len(segments))
+        finished = all(position is SEGMENT_DONE for position in segments)
+        return {
+            'items': items,
+            'nextCursor': None if finished else encode_cursor({'segments': segments})
+        }
@@ -0,0 +1,102 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Any, Optional
+
+import numpy as np
+
+from services.retrieval_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CachedAnswer:
+    vector: np.ndarray
+    fingerprint: str
+    answer: str
+    expires_at: float
+    generation_ms: float
+
+
+class AnswerCache:
+    """In-process semantic cache of generated answers, isolated per tenant.
+
+    Only answers to history-free turns are cached, since anything else
+    depends on the conversation. A stored answer is reused when a new
+    question embeds within ``similarity`` (cosine) of the cached one and
+    retrieval returned exactly the same context, so a changed index never
+    serves a stale answer. Entries expire after ``ttl_seconds``; each
+    tenant keeps at most ``max_entries`` and the least recently used
+    tenants are dropped beyond ``max_tenants``.
+    """
+
+    def __init__(self, embedder):
+        self.embedder = embedder
+        self.similarity = float(os.environ.get('ANSWER_CACHE_SIMILARITY', '0.95'))
+        self.ttl_seconds = int(os.environ.get('ANSWER_CACHE_TTL', '3600'))
+        self.max_entries = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', '128'))
+        self.max_tenants = int(os.environ.get('ANSWER_CACHE_MAX_TENANTS', '256'))
+        self._tenants: 'OrderedDict[str, OrderedDict[int, CachedAnswer]]' = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'saved_ms': 0.0}
+
+    @staticmethod
+    def fingerprint(model_id: str, context: str) -> str:
+        """Identify the retrieved context (and model) an answer was generated from"""
+        return hashlib.sha256(f"{model_id}\n{context}".encode('utf-8')).hexdigest()
+
+    def embed(self, question: str) -> np.ndarray:
+        return self.embedder.embed([normalize_query(question)])[0]
+
+    def lookup(self, tenant: str, vector: np.ndarray, fingerprint: str) -> Optional[CachedAnswer]:
+        now = time.time()
+        with self._lock:
+            entries = self._tenants.get(tenant)
+            best, best_score = None, self.similarity
+            if entries:
+                self._tenants.move_to_end(tenant)
+                for entry_id, entry in list(entries.items()):
+                    if entry.expires_at <= now:
+                        del entries[entry_id]
+                        continue
+                    if entry.fingerprint != fingerprint:
+                        continue
+                    score = float(np.dot(vector, entry.vector))
+                    if score >= best_score:
+                        best, best_score = (entry_id, entry), score
+
+            if best is None:
+                self.metrics['misses'] += 1
+                return None
+            entries.move_to_end(best[0])
+            self.metrics['hits'] += 1
+            self.metrics['saved_ms'] += best[1].generation_ms
+            return best[1]
+
+    def store(self, tenant: str, vector: np.ndarray, fingerprint: str, answer: str, generation_ms: float) -> None:
+        entry = CachedAnswer(vector, fingerprint, answer, time.time() + self.ttl_seconds, generation_ms)
+        with self._lock:
+            entries = self._tenants.setdefault(tenant, OrderedDict())
+            self._tenants.move_to_end(tenant)
+            entries[self._next_id] = entry
+            self._next_id += 1
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            while len(self._tenants) > self.max_tenants:
+                self._tenants.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.metrics['hits'] + self.metrics['misses']
+            return {
+                **self.metrics,
+                'saved_ms': round(self.metrics['saved_ms'], 2),
+                'hit_rate': round(self.metrics['hits'] / lookups, 3) if lookups else 0.0,
+                'tenants': len(self._tenants)
+            }
@@ -1,37 +1,119 @@
 import os
 from datetime import datetime
-from typing import Dict, Any, List
-import boto3
+from typing import Dict, Any, List, Iterator, Optional
 import uuid
 import json
+import time
 import logging
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from botocore.exceptions import ClientError
+from utils.clients import get_client, get_resource
+from services.history_manager import ChatHistoryManager, estimate_tokens
+from services.retrieval_cache import RetrievalCache
+from services.retrieval import Passages, create_retriever
+from services.turn_store import TurnStore, USAGE_COUNTERS, serialize_item
+from services.single_flight import SingleFlight, DynamoLease
+from services.generation import GenerationClient
 from utils.errors import APIError
+from utils.timing import StageTimer
+from utils.pagination import encode_cursor, decode_cursor
 
 logger = logging.getLogger(__name__)
 
+# Chat titles are claimed by marker items in the chats table, keyed by this
+# prefix plus the title; they carry no lastMessageAt, so listings never see them
+TITLE_MARKER_PREFIX = 'title#'
+
+
+def _token_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+    """The token counts of a Bedrock usage block that are worth keeping"""
+    return {field: int(usage.get(field) or 0) for field in USAGE_COUNTERS}
+
+
+# Shared across warm invocations; bounds the I/O that a turn runs in parallel
+_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('CHAT_IO_WORKERS', '8')),
+    thread_name_prefix='chat-io'
+)
+
 class ChatService:
     def __init__(self):
-        self.dynamodb = boto3.resource('dynamodb')
+        self.dynamodb = get_resource('dynamodb')
         self.table = self.dynamodb.Table(f"{os.environ['PROJECT_NAME']}-chats")
         self.messages_table = self.dynamodb.Table(f"{os.environ['PROJECT_NAME']}-messages")
-        self.bedrock = boto3.client('bedrock-runtime', region_name='us-east-1')
-        self.kendra = boto3.client('kendra', region_name='us-east-1')
-        self.model_id = 'arn:aws:bedrock:us-east-1:727646510092:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0'
+        self.turns = TurnStore(self.dynamodb.meta.client, self.table.name, self.messages_table.name)
+        self.bedrock = get_client('bedrock-runtime', region_name='us-east-1')
+        self.kendra = get_client('kendra', region_name='us-east-1')
+        # The generation client retries and falls back itself, so its client must not retry too
+        self.generator = GenerationClient(get_client('bedrock-runtime', region_name='us-east-1', max_attempts=1))
+        self.model_id = self.generator.model_id
+        # Only enable for models that support prompt caching on Bedrock
+        self.prompt_caching = os.environ.get('BEDROCK_PROMPT_CACHING', 'false').lower() == 'true'
         self.kendra_index_id = os.environ['KENDRA_INDEX_ID']
+        self.chats_page_size = int(os.environ.get('CHATS_PAGE_SIZE', '50'))
+        self.messages_page_size = int(os.environ.get('MESSAGES_PAGE_SIZE', '50'))
+        self.retriever = create_retriever(self.kendra, self.kendra_index_id)
+        self.retrieval_namespace = f"{self.retriever.name}:{self.kendra_index_id}"
+        cache_table_name = os.environ.get('RETRIEVAL_CACHE_TABLE')
+        cache_table = self.dynamodb.Table(cache_table_name) if cache_table_name else None
+        self.retrieval_cache = RetrievalCache(cache_table)
+        # Identical concurrent questions share one retrieval across containers
+        # through a lease in the cache table. A Lambda container runs one
+        # invocation at a time, so the in-process flight only collapses turns
+        # run concurrently on one host; generation is not coalesced at all.
+        self.retrieval_flight = SingleFlight()
+        self.retrieval_lease = DynamoLease(cache_table) if cache_table else None
+        self.retrieval_lease_wait = int(os.environ.get('RETRIEVAL_LEASE_WAIT_MS', '3000')) / 1000
+        self.answer_cache = None
+        if os.environ.get('ANSWER_CACHE_ENABLED', 'false').lower() == 'true':
+            # Imported here so containers without the answer cache skip loading numpy
+            from services.answer_cache import AnswerCache
+            from embedders import get_embedder
+            self.answer_cache = AnswerCache(get_embedder(self.bedrock))
+        summarize = os.environ.get('CHAT_HISTORY_SUMMARY', 'false').lower() == 'true'
+        self.history = ChatHistoryManager(
+            self.table,
+            self.messages_table,
+            summarizer=self._summarize if summarize else None
+        )
+        # The history window is anchored on the chat item and slides in blocks
+        self._anchored_history = summarize or self.prompt_caching
+        # A turn waits this long for its summary refresh before replying. The
+        # refresh only lands if summarizedThrough has not moved past it, so
+        # one that finishes later, or never, cannot clobber a newer summary;
+        # the next turn that needs the window slid simply refreshes again.
+        self.summary_wait = int(os.environ.get('CHAT_SUMMARY_WAIT_MS', '0')) / 1000
     
-    def get_chats(self, user_id: str = None) -> List[Dict[str, Any]]:
-        if user_id:
-            response = self.table.query(
-                IndexName='LastMessageIndex',
-                KeyConditionExpression='userId = :userId',
-                ExpressionAttributeValues={
-                    ':userId': user_id
-                },
-                ScanIndexForward=False
-            )
-        else:
-            response = self.table.scan()
-        return response.get('Items', [])
+    def get_chats(self, user_id: str, limit: int = None, cursor: str = None) -> Dict[str, Any]:
+        """Get one page of a user's chats, most recently active first.
+
+        Only the attributes the chat list renders are read. Pass the returned
+        nextCursor back to get the following page; it is None on the last one.
+        Listing across users is AdminService.list_chats.
+        """
+        if not user_id:
+            raise APIError('User ID is required to list chats', 400)
+
+        query_kwargs = {
+            'ProjectionExpression': 'userId, chatId, title, created_at, updated_at, messageCount, lastMessageAt',
+            'Limit': limit or self.chats_page_size
+        }
+        start_key = decode_cursor(cursor, {'userId': user_id})
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        response = self.table.query(
+            IndexName='LastMessageIndex',
+            KeyConditionExpression='userId = :userId',
+            ExpressionAttributeValues={
+                ':userId': user_id
+            },
+            ScanIndexForward=False,
+            **query_kwargs
+        )
+        return {
+            'items': response.get('Items', []),
+            'nextCursor': encode_cursor(response.get('LastEvaluatedKey'))
+        }
 
     def get_chat(self, chat_id: str, user_id: str = None) -> Dict[str, Any]:
         if not user_id:
@@ -45,7 +127,7 @@ class ChatService:
         )
         chat = response.get('Item')
         
-        if not chat:
+        if not chat or chat_id.startswith(TITLE_MARKER_PREFIX):
             raise APIError('Chat not found', 404)
             
         return chat
@@ -54,11 +136,6 @@ class ChatService:
         if not user_id:
             raise APIError('User ID is required to create a chat', 400)
             
-        existing_chats = self.get_chats(user_id)
-        for chat in existing_chats:
-            if chat.get('title') == title:
-                raise APIError(f'Chat with name "{title}" already exists', 409)
-        
         chat_id = str(uuid.uuid4())
         timestamp = datetime.utcnow().isoformat()
         
@@ -71,27 +148,64 @@ class ChatService:
             'messageCount': 0
         }
         
-        self.table.put_item(Item=chat)
+        # The marker item claims the title, so uniqueness costs one conditional
+        # write instead of reading every chat, and concurrent creates cannot race
+        marker = {
+            'userId': user_id,
+            'chatId': f"{TITLE_MARKER_PREFIX}{title}",
+            'titleOf': chat_id,
+            'created_at': timestamp
+        }
+        try:
+            self.dynamodb.meta.client.transact_write_items(
+                TransactItems=[
+                    {
+                        'Put': {
+                            'TableName': self.table.name,
+                            'Item': serialize_item(marker),
+                            'ConditionExpression': 'attribute_not_exists(chatId)'
+                        }
+                    },
+                    {
+                        'Put': {
+                            'TableName': self.table.name,
+                            'Item': serialize_item(chat),
+                            'ConditionExpression': 'attribute_not_exists(chatId)'
+                        }
+                    }
+                ]
+            )
+        except ClientError as e:
+            reasons = e.response.get('CancellationReasons', [])
+            if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+                raise APIError(f'Chat with name "{title}" already exists', 409)
+            raise
         return chat
 
-    def _get_chat_history(self, chat_id: str) -> List[Dict[str, str]]:
-        """Get chat history in the format expected by Claude"""
-        response = self.messages_table.query(
-            KeyConditionExpression='chatId = :chatId',
-            ExpressionAttributeValues={
-                ':chatId': chat_id
-            },
-            ScanIndexForward=True
+    def _get_chat_history(self, chat_id: str, exclude_message_id: str = None) -> List[Dict[str, Any]]:
+        """Get the most recent message items of a chat, oldest first"""
+        return self.history.get_recent(chat_id, exclude_message_id)
+
+    def _summarize(self, previous_summary: str, messages: List[Dict[str, str]]) -> str:
+        """Fold older turns into the rolling conversation summary"""
+        prompt = (
+            f"Current summary of the conversation:\n{previous_summary or '(none)'}\n\n"
+            f"New turns to fold in:\n{self._format_chat_history(messages)}\n"
+            "Rewrite the summary so it covers everything above in at most a few short paragraphs."
         )
-        
-        messages = []
-        for item in response.get('Items', []):
-            role = 'assistant' if item['author'] == 'assistant' else 'user'
-            messages.append({
-                'role': role,
-                'content': item['message']
-            })
-        return messages
+        response_body = self.generator.invoke({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 300,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": prompt}]
+        })
+        return response_body['content'][0]['text'].strip()
+
+    def _refresh_summary(self, chat: Dict[str, Any], through_id: str) -> None:
+        try:
+            self.history.refresh_summary(chat, through_id)
+        except Exception as e:
+            logger.error("Error refreshing chat summary: %s", str(e))
 
     def _format_chat_history(self, chat_history: List[Dict[str, str]]) -> str:
         """Format chat history for Titan Text Lite"""
@@ -102,86 +216,159 @@ class ChatService:
         return formatted_history
     
     def _query_kendra(self, query: str) -> str:
-        """Query Kendra for relevant context based on the user's message."""
+        """Retrieve relevant context for the user's message from the configured backend."""
         try:
-            response = self.kendra.query(
-                IndexId=self.kendra_index_id,
-                QueryText=query
+            cached = self.retrieval_cache.get(self.retrieval_namespace, query)
+            if cached is not None:
+                logger.info("Retrieval cache hit: %s", self.retrieval_cache.stats())
+                return cached
+
+            context, shared = self.retrieval_flight.do(
+                self.retrieval_cache.key(self.retrieval_namespace, query), self._retrieve_context, query
             )
+            logger.info("Retrieval cache miss (%s): %s, single-flight: %s",
+                        'shared' if shared else 'led', self.retrieval_cache.stats(), self.retrieval_flight.stats())
+            return context
 
-            if not response.get('ResultItems'):
-                return ""
+        except Exception as e:
+            logger.error("Error querying %s: %s", self.retriever.name, str(e))
+            return ""
 
-            result_items = response['ResultItems'][:3]
+    def _retrieve_context(self, query: str) -> str:
+        """Run retrieval for a query and cache the context.
 
-            context_parts = []
-            for item in result_items:
-                title = item.get('DocumentTitle', {}).get('Text') if isinstance(item.get('DocumentTitle'), dict) else item.get('DocumentTitle', 'Untitled')
-                excerpt = item.get('DocumentExcerpt', {}).get('Text', '')
+        When the shared cache table is configured, the container that takes
+        the query's lease retrieves and the others wait for its result to
+        land in the cache, retrieving themselves only if it does not arrive
+        within RETRIEVAL_LEASE_WAIT_MS.
+        """
+        key = self.retrieval_cache.key(self.retrieval_namespace, query)
+        leased = self.retrieval_lease is not None and self.retrieval_lease.acquire(key)
+        if self.retrieval_lease and not leased:
+            context = self._await_retrieval(query)
+            if context is not None:
+                return context
+
+        try:
+            passages = self.retriever.retrieve(query, top_k=3)
 
+            context_parts = []
+            for passage in passages:
                 context_parts.append(
-                    f"Relevant information from document '{title}':\n{excerpt}"
+                    f"Relevant information from document '{passage.title}':\n{passage.text}"
                 )
-            
-            logger.info(result_items)
 
-            return "\n\n".join(context_parts)
+            logger.info(passages)
+
+            context = "\n\n".join(context_parts)
+            if isinstance(passages, Passages) and passages.degraded:
+                # A stage missed its budget or failed; the next turn should retry it
+                logger.info("Not caching degraded retrieval for query")
+            else:
+                self.retrieval_cache.put(self.retrieval_namespace, query, context)
+            return context
+        finally:
+            if leased:
+                self.retrieval_lease.release(key)
+
+    def _await_retrieval(self, query: str) -> Optional[str]:
+        """Poll the shared cache for a retrieval another container is running"""
+        deadline = time.monotonic() + self.retrieval_lease_wait
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            context = self.retrieval_cache.get(self.retrieval_namespace, query)
+            if context is not None:
+                return context
+        logger.info("Timed out waiting for a shared retrieval, retrieving locally")
+        return None
 
+    def _embed_question(self, content: str):
+        try:
+            return self.answer_cache.embed(content)
         except Exception as e:
-            logger.error("Error querying Kendra: %s", str(e))
-            return ""
+            logger.error("Error embedding question for the answer cache: %s", str(e))
+            return None
 
+    def _cached_answer(self, user_id: str, answer_key) -> Optional[str]:
+        if not answer_key:
+            return None
+        cached = self.answer_cache.lookup(user_id, *answer_key)
+        logger.info("Answer cache %s: %s", 'hit' if cached else 'miss', self.answer_cache.stats())
+        return cached.answer if cached else None
 
+    def _remember_answer(self, user_id: str, answer_key, ai_message: str, timer: StageTimer) -> None:
+        if answer_key and ai_message:
+            self.answer_cache.store(user_id, *answer_key, ai_message, timer.stages.get('generate', 0.0))
 
-    def send_message(self, chat_id: str, content: str, user_id: str = None, role: str = 'user') -> Dict[str, Any]:
-        if not user_id:
-            raise APIError('User ID is required to send a message', 400)
-            
-        chat = self.get_chat(chat_id, user_id)
-        now = int(datetime.utcnow().timestamp() * 1000)
-        
- 
-        user_message = {
-            'chatId': chat_id,
-            'messageId': f"msg_{now}_user",
-            'userId': user_id,
-            'author': 'user',
-            'message': content,
-            'timestamp': now
-        }
-        
-        self.messages_table.put_item(Item=user_message)
-        
-        self.table.update_item(
-            Key={
-                'userId': user_id,
-                'chatId': chat_id
-            },
-            UpdateExpression="SET lastMessageAt = :lma, messageCount = if_not_exists(messageCount, :zero) + :inc",
-            ExpressionAttributeValues={
-                ':lma': now,
-                ':inc': 1,
-                ':zero': 0
-            }
-        )
 
+    def _build_request_body(self, chat_id: str, user_id: str, content: str, now: int,
+                            user_message: Future, chat: Optional[Future],
+                            timer: StageTimer, pending: List[Future]):
+        """Build the Claude request from Kendra context and chat history.
+
+        The user message write proves the chat belongs to the caller, so
+        retrieval only starts once it has succeeded; a caller cannot spend
+        Kendra or Bedrock calls on a chat that is not theirs. The history
+        query runs alongside the write, and its result is only used after
+        it. The message may still be in flight when history is read, so it
+        is left out of the fetched history and appended locally instead.
+        Only the recent window that fits the token budget is replayed; older
+        turns are represented by the chat's rolling summary, if enabled.
+
+        Returns the request body and the turn's answer cache key, a
+        (question embedding, context fingerprint) pair. The key is None
+        unless the answer cache is on and the turn replays no history, since
+        only then does the answer depend on nothing but question and context.
+        The question is therefore only embedded once the history is known to
+        be empty, alongside the rest of retrieval.
+        """
         logger.info("QUERYING KENDRA")
 
-        kendra_context = self._query_kendra(content)
+        history_future = _io_executor.submit(
+            timer.timed, 'get_chat_history', self._get_chat_history, chat_id, f"msg_{now}_user"
+        )
+
+        user_message.result()
+        kendra_future = _io_executor.submit(timer.timed, 'query_kendra', self._query_kendra, content)
+        chat = chat.result() if chat else {'chatId': chat_id, 'userId': user_id}
+        recent = history_future.result()
+        embedding_future = None
+        if self.answer_cache and not recent and not chat.get('historySummary'):
+            embedding_future = _io_executor.submit(timer.timed, 'embed_question', self._embed_question, content)
+        kendra_context = kendra_future.result()
 
         logger.info("KENDRA content: %s", kendra_context)
+        
+        context_prompt = f"\nHere is some relevant information that might help answer the question:\n{kendra_context}\n\n" if kendra_context else ""
+        summary = chat.get('historySummary')
+        if summary:
+            context_prompt = f"Summary of the earlier conversation:\n{summary}\n{context_prompt}"
+        
+        logger.info("CONTEXT: %s", f"{context_prompt}")
 
-        chat_history = self._get_chat_history(chat_id)
+        # Summaries and the prompt cache need a window that only slides a block at a time
+        anchor = chat.get('summarizedThrough', '') if self._anchored_history else None
+        history_items, slide_through = self.history.select_window(
+            recent,
+            anchor,
+            reserved_tokens=estimate_tokens(context_prompt) + estimate_tokens(content)
+        )
+        if slide_through:
+            pending.append(_io_executor.submit(
+                timer.timed, 'refresh_summary', self._refresh_summary, chat, slide_through
+            ))
+
+        chat_history = [{
+            'role': 'assistant' if item['author'] == 'assistant' else 'user',
+            'content': item['message']
+        } for item in history_items]
+        chat_history.append({'role': 'user', 'content': content})
 
         logger.info("CHAT HISTORY: %s", chat_history)
         formatted_history = self._format_chat_history(chat_history)
 
         logger.info("FORMATTED HISTORY: %s", formatted_history)
         
-        context_prompt = f"\nHere is some relevant information that might help answer the question:\n{kendra_context}\n\n" if kendra_context else ""
-        
-        logger.info("CONTEXT: %s", f"{context_prompt}")
-        
         messages_for_claude = []
         for msg in chat_history:
             messages_for_claude.append({
@@ -189,70 +376,201 @@ class ChatService:
                 "content": msg['content']
             })
 
-        request_body = {
+        system = context_prompt if context_prompt else ""
+        if self.prompt_caching:
+            system, messages_for_claude = self._cacheable_prompt(summary, kendra_context, messages_for_claude)
+
+        answer_key = None
+        if embedding_future and not history_items and not summary:
+            vector = embedding_future.result()
+            if vector is not None:
+                answer_key = (vector, self.answer_cache.fingerprint(self.model_id, kendra_context))
+
+        return {
             "anthropic_version": "bedrock-2023-05-31",
             "max_tokens": 1000,
             "temperature": 0.3,
             "top_p": 0.1,
             "messages": messages_for_claude,
-            "system": context_prompt if context_prompt else ""
-        }
+            "system": system
+        }, answer_key
+
+    def _cacheable_prompt(self, summary: Optional[str], kendra_context: str,
+                          messages: List[Dict[str, Any]]):
+        """Lay the prompt out so Claude can cache its stable prefix.
+
+        A cache_control breakpoint caches everything before it. The summary
+        and the replayed history only change when the history window slides
+        a block, so they come first, with a breakpoint after the last
+        history turn. The retrieved context changes with every question, so
+        it moves out of the system prompt into the new user turn, after the
+        cached prefix, and gets no breakpoint of its own: a cache entry for
+        it would be written on every turn and hardly ever read.
+        """
+        cache_control = {"type": "ephemeral"}
+        system = []
+        if summary:
+            system.append({
+                "type": "text",
+                "text": f"Summary of the earlier conversation:\n{summary}",
+                "cache_control": cache_control
+            })
 
-        response = self.bedrock.invoke_model(
-            modelId=self.model_id,
-            body=json.dumps(request_body)
+        messages = [{
+            "role": message['role'],
+            "content": [{"type": "text", "text": message['content']}]
+        } for message in messages]
+        if len(messages) > 1:
+            messages[-2]['content'][-1]['cache_control'] = cache_control
+
+        if kendra_context:
+            messages[-1]['content'].insert(0, {
+                "type": "text",
+                "text": f"Here is some relevant information that might help answer the question:\n{kendra_context}"
+            })
+        return system, messages
+
+    def _start_turn(self, chat_id: str, content: str, user_id: str, timer: StageTimer):
+        """Start writing the user message in the background.
+
+        The write doubles as the ownership check. The chat item is only read
+        (in parallel) when rolling summaries or prompt caching are enabled,
+        since the summary and the history window's anchor are all the turn
+        needs from it.
+        """
+        now = int(datetime.utcnow().timestamp() * 1000)
+
+        user_message = _io_executor.submit(
+            timer.timed, 'save_user_message', self.turns.save_user_message, chat_id, user_id, content, now
         )
-        
-        logger.info(response)
-        
-        response_body = json.loads(response['body'].read())
-        logger.debug(f"Bedrock response: {json.dumps(response_body)}")
-        
+        chat = None
+        if self._anchored_history:
+            chat = _io_executor.submit(timer.timed, 'get_chat', self.get_chat, chat_id, user_id)
+        return now, user_message, chat
+
+    def _finish_turn(self, chat_id: str, ai_message: str, user_id: str, now: int,
+                     pending: List[Future], timer: StageTimer, usage: Dict[str, Any]) -> Dict[str, Any]:
+        if pending:
+            _, running = wait(pending, timeout=self.summary_wait)
+            if running:
+                logger.info("Replying before %d summary refreshes of chat %s finish", len(running), chat_id)
+        usage = _token_usage(usage)
+        with timer.stage('save_assistant_message'):
+            ai_response = self.turns.save_assistant_message(chat_id, user_id, ai_message, now, usage)
+        logger.info("Stage timings for chat %s: %s", chat_id, json.dumps(timer.as_dict()))
+        logger.info("Token usage for chat %s: %s", chat_id, json.dumps(usage))
+        return ai_response
+
+    def send_message(self, chat_id: str, content: str, user_id: str = None, role: str = 'user') -> Dict[str, Any]:
+        if not user_id:
+            raise APIError('User ID is required to send a message', 400)
+
+        timer = StageTimer()
+        now, user_message, chat = self._start_turn(chat_id, content, user_id, timer)
+
+        pending = []
+        request_body, answer_key = self._build_request_body(
+            chat_id, user_id, content, now, user_message, chat, timer, pending
+        )
+        cached = self._cached_answer(user_id, answer_key)
+        if cached is not None:
+            return self._finish_turn(chat_id, cached, user_id, now, pending, timer, {})
+
+        with timer.stage('generate'):
+            response_body = self._generate(request_body)
 
         ai_message = response_body['content'][0]['text'].strip()
-        
-        ai_response = {
-            'chatId': chat_id,
-            'messageId': f"msg_{now + 1}_assistant",
-            'userId': user_id,
-            'author': 'assistant',
-            'message': ai_message,
-            'timestamp': now + 1000
-        }
-        
-        self.messages_table.put_item(Item=ai_response)
-        
-        self.table.update_item(
-            Key={
-                'userId': user_id,
-                'chatId': chat_id
-            },
-            UpdateExpression="SET lastMessageAt = :lma, messageCount = messageCount + :inc",
-            ExpressionAttributeValues={
-                ':lma': now + 1000,
-                ':inc': 1
-            }
+        self._remember_answer(user_id, answer_key, ai_message, timer)
+        return self._finish_turn(chat_id, ai_message, user_id, now, pending, timer, response_body.get('usage', {}))
+
+    def _generate(self, request_body: Dict[str, Any]) -> Dict[str, Any]:
+        response_body = self.generator.invoke(request_body)
+        logger.debug(f"Bedrock response: {json.dumps(response_body)}")
+        logger.info("Generation stats: %s", self.generator.stats())
+        return response_body
+
+    def stream_message(self, chat_id: str, content: str, user_id: str = None) -> Iterator[Dict[str, Any]]:
+        """Send a message and yield the assistant reply as it is generated.
+
+        Yields ``{'type': 'chunk', 'text': ...}`` for every text delta and a
+        final ``{'type': 'done', 'message': ...}`` once the full reply has
+        been stored in the messages table.
+        """
+        if not user_id:
+            raise APIError('User ID is required to send a message', 400)
+
+        timer = StageTimer()
+        now, user_message, chat = self._start_turn(chat_id, content, user_id, timer)
+
+        pending = []
+        request_body, answer_key = self._build_request_body(
+            chat_id, user_id, content, now, user_message, chat, timer, pending
         )
-        
-        return ai_response
+        cached = self._cached_answer(user_id, answer_key)
+        if cached is not None:
+            yield {'type': 'chunk', 'text': cached}
+            yield {'type': 'done', 'message': self._finish_turn(chat_id, cached, user_id, now, pending, timer, {})}
+            return
+
+        parts = []
+        usage = {}
+        with timer.stage('generate'):
+            for payload in self.generator.stream(request_body):
+                # Input and cache usage arrive with message_start, output tokens with message_delta
+                if payload.get('type') == 'message_start':
+                    usage.update(payload.get('message', {}).get('usage', {}))
+                elif payload.get('type') == 'message_delta':
+                    usage.update(payload.get('usage', {}))
+                elif payload.get('type') == 'content_block_delta':
+                    text = payload.get('delta', {}).get('text', '')
+                    if text:
+                        if not parts:
+                            timer.mark('first_token')
+                        parts.append(text)
+                        yield {'type': 'chunk', 'text': text}
+
+        ai_message = ''.join(parts).strip()
+        self._remember_answer(user_id, answer_key, ai_message, timer)
+        ai_response = self._finish_turn(chat_id, ai_message, user_id, now, pending, timer, usage)
+        yield {'type': 'done', 'message': ai_response}
+
+    def get_messages(self, chat_id: str, user_id: str, limit: int = None, cursor: str = None) -> Dict[str, Any]:
+        """Get a page of a chat's messages, starting from the newest.
 
-    def get_messages(self, chat_id: str, user_id: str) -> List[Dict[str, Any]]:
-        """Get all messages for a chat in chronological order"""
+        Items within a page are in chronological order; nextCursor points at
+        the page of older messages before them, so the chat screen can load
+        the latest turns first and fetch history on demand.
+        """
         if not user_id:
             raise APIError('User ID is required to get messages', 400)
             
         chat = self.get_chat(chat_id, user_id)
         
-        response = self.messages_table.query(
-            KeyConditionExpression='chatId = :chatId',
-            ExpressionAttributeValues={
+        query_kwargs = {
+            'KeyConditionExpression': 'chatId = :chatId',
+            'ExpressionAttributeValues': {
                 ':chatId': chat_id
             },
-            ScanIndexForward=True
-        )
+            'ProjectionExpression': '#message, author, #timestamp',
+            'ExpressionAttributeNames': {
+                '#message': 'message',
+                '#timestamp': 'timestamp'
+            },
+            'ScanIndexForward': False,
+            'Limit': limit or self.messages_page_size
+        }
+        start_key = decode_cursor(cursor, {'chatId': chat_id})
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        response = self.messages_table.query(**query_kwargs)
         
-        return [{
+        items = [{
             'message': item['message'],
             'author': item['author'],
             'timestamp': item['timestamp']
-        } for item in response.get('Items', [])]
\ No newline at end of file
+        } for item in response.get('Items', [])]
+        items.reverse()
+        return {
+            'items': items,
+            'nextCursor': encode_cursor(response.get('LastEvaluatedKey'))
+        }
\ No newline at end of file
@@ -0,0 +1,215 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+from typing import Dict, Any, Iterator, List
+
+from botocore.exceptions import ClientError
+
+from services.history_manager import estimate_tokens
+from utils.errors import APIError
+from utils.throttle import AIMDLimiter, CapacityLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL_ID = 'arn:aws:bedrock:us-east-1:727646510092:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0'
+
+# Bedrock errors worth retrying; the first two mean the model is saturated
+THROTTLING_ERRORS = {'ThrottlingException', 'ServiceUnavailableException'}
+RETRYABLE_ERRORS = THROTTLING_ERRORS | {'ModelNotReadyException', 'ModelTimeoutException'}
+# Bedrock errors meaning the model cannot be used at all (no access, not in the region)
+UNAVAILABLE_ERRORS = {'AccessDeniedException', 'ResourceNotFoundException'}
+
+
+class _Model:
+    """A model together with the client-side limits that keep it under quota"""
+
+    def __init__(self, model_id: str, tokens_per_minute: int, max_concurrency: int):
+        self.model_id = model_id
+        self.tokens = CapacityLimiter(tokens_per_minute / 60, burst=tokens_per_minute)
+        self.concurrency = AIMDLimiter(max(1, max_concurrency // 2), maximum=max_concurrency)
+
+
+def _billed_tokens(usage: Dict[str, Any]) -> int:
+    return sum(int(usage.get(field) or 0) for field in (
+        'input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens'
+    ))
+
+
+class GenerationClient:
+    """Invoke Claude on Bedrock without exceeding the account's quotas.
+
+    Each model has a token bucket sized to its tokens-per-minute quota and
+    an AIMD concurrency limit. A request reserves its estimated tokens
+    (prompt plus max_tokens) up front and is settled against the actual
+    usage once it finishes. Throttled calls are retried with full-jitter
+    exponential backoff. When the primary model stays throttled, or no
+    capacity frees up within BEDROCK_QUEUE_TIMEOUT_MS, the request moves
+    on to the fallback model, as it does when the primary model is not
+    available to the account at all. If every model is saturated or
+    unavailable the caller gets a 503 rather than a raw Bedrock error.
+
+    The limits live in each container, while the quotas are per account:
+    every container gets an equal share of the tokens-per-minute quota,
+    BEDROCK_EXPECTED_CONCURRENCY being the number of containers expected
+    to run at once. The bedrock client should make a single attempt per
+    call, since retries are handled here.
+    """
+
+    def __init__(self, bedrock):
+        self.bedrock = bedrock
+        containers = max(1, int(os.environ.get('BEDROCK_EXPECTED_CONCURRENCY', '1')))
+        self.models: List[_Model] = [_Model(
+            os.environ.get('BEDROCK_MODEL_ID', DEFAULT_MODEL_ID),
+            int(os.environ.get('BEDROCK_TOKENS_PER_MINUTE', '200000')) // containers,
+            int(os.environ.get('BEDROCK_MAX_CONCURRENCY', '16'))
+        )]
+        fallback_model_id = os.environ.get('BEDROCK_FALLBACK_MODEL_ID')
+        if fallback_model_id:
+            self.models.append(_Model(
+                fallback_model_id,
+                int(os.environ.get('BEDROCK_FALLBACK_TOKENS_PER_MINUTE', '400000')) // containers,
+                int(os.environ.get('BEDROCK_FALLBACK_MAX_CONCURRENCY', '16'))
+            ))
+        self.max_attempts = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', '2'))
+        self.queue_timeout = int(os.environ.get('BEDROCK_QUEUE_TIMEOUT_MS', '2000')) / 1000
+        self.backoff_base = float(os.environ.get('BEDROCK_BACKOFF_BASE_MS', '200')) / 1000
+        self.backoff_cap = float(os.environ.get('BEDROCK_BACKOFF_CAP_MS', '2000')) / 1000
+        self._lock = threading.Lock()
+        self.metrics = {
+            'requests': 0, 'succeeded': 0, 'failed': 0, 'attempts': 0,
+            'throttled': 0, 'shed': 0, 'unavailable': 0, 'fallbacks': 0, 'output_tokens': 0
+        }
+
+    @property
+    def model_id(self) -> str:
+        return self.models[0].model_id
+
+    def _count(self, metric: str, amount: int = 1) -> None:
+        with self._lock:
+            self.metrics[metric] += amount
+
+    def _backoff(self, attempt: int) -> None:
+        time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt)))
+
+    def _call(self, model: _Model, call, reserved: int):
+        """Make the call within the model's limits, retrying throttled attempts.
+
+        Returns the response with a concurrency slot still held (the caller
+        releases it once the response is consumed), or None once the model
+        is saturated or unavailable.
+        """
+        for attempt in range(self.max_attempts):
+            if attempt:
+                self._backoff(attempt)
+            if not model.tokens.wait(self.queue_timeout):
+                self._count('shed')
+                return None
+            if not model.concurrency.acquire(self.queue_timeout):
+                self._count('shed')
+                return None
+
+            model.tokens.charge(reserved)
+            self._count('attempts')
+            try:
+                return call(model.model_id)
+            except ClientError as e:
+                code = e.response['Error']['Code']
+                if code not in THROTTLING_ERRORS:
+                    # A rejected call consumed none of the quota
+                    model.tokens.charge(-reserved)
+                # A throttled one keeps its reservation: other containers have
+                # spent the account's quota even if this one's share is left
+                model.concurrency.release(throttled=code in THROTTLING_ERRORS)
+                if code in UNAVAILABLE_ERRORS:
+                    self._count('unavailable')
+                    logger.error("Bedrock %s on %s: %s", code, model.model_id, e.response['Error'].get('Message'))
+                    return None
+                if code not in RETRYABLE_ERRORS:
+                    raise
+                self._count('throttled')
+                logger.warning("Bedrock %s on %s (attempt %d, concurrency limit %.1f)",
+                               code, model.model_id, attempt + 1, model.concurrency.limit)
+            except Exception:
+                model.tokens.charge(-reserved)
+                model.concurrency.release()
+                raise
+        return None
+
+    def _run(self, body: Dict[str, Any], call):
+        """Try each model in turn; returns (model, response, reserved tokens) with a slot held"""
+        self._count('requests')
+        reserved = estimate_tokens(json.dumps(body)) + int(body.get('max_tokens', 0))
+        for position, model in enumerate(self.models):
+            if position:
+                self._count('fallbacks')
+                logger.warning("Falling back to %s", model.model_id)
+            response = self._call(model, call, reserved)
+            if response is not None:
+                return model, response, reserved
+
+        self._count('failed')
+        logger.error("All models saturated or unavailable: %s", self.stats())
+        raise APIError('The model is unavailable right now, please try again shortly', 503)
+
+    def _settle(self, model: _Model, reserved: int, usage: Dict[str, Any]) -> None:
+        # Without a usage block the reservation stands
+        if usage:
+            model.tokens.charge(_billed_tokens(usage) - reserved)
+        self._count('succeeded')
+        self._count('output_tokens', int(usage.get('output_tokens') or 0))
+
+    def invoke(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Invoke the model and return the parsed response body"""
+        encoded = json.dumps(body)
+        model, response, reserved = self._run(
+            body, lambda model_id: self.bedrock.invoke_model(modelId=model_id, body=encoded)
+        )
+        try:
+            response_body = json.loads(response['body'].read())
+        finally:
+            model.concurrency.release()
+        self._settle(model, reserved, response_body.get('usage', {}))
+        return response_body
+
+    def stream(self, body: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """Invoke the model with a response stream and yield its decoded events.
+
+        Retries and fallback only cover starting the stream; the slot is
+        held until the stream has been read to the end.
+        """
+        encoded = json.dumps(body)
+        model, response, reserved = self._run(
+            body, lambda model_id: self.bedrock.invoke_model_with_response_stream(modelId=model_id, body=encoded)
+        )
+        usage = {}
+        try:
+            for event in response['body']:
+                chunk = event.get('chunk')
+                if not chunk:
+                    continue
+                payload = json.loads(chunk['bytes'])
+                # Input and cache usage arrive with message_start, output tokens with message_delta
+                if payload.get('type') == 'message_start':
+                    usage.update(payload.get('message', {}).get('usage', {}))
+                elif payload.get('type') == 'message_delta':
+                    usage.update(payload.get('usage', {}))
+                yield payload
+        finally:
+            model.concurrency.release()
+        self._settle(model, reserved, usage)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            requests = self.metrics['requests']
+            return {
+                **self.metrics,
+                # Share of requests that got an answer, and of attempts that were not throttled
+                'goodput': round(self.metrics['succeeded'] / requests, 3) if requests else 0.0,
+                'attempt_success': round(
+                    1 - self.metrics['throttled'] / self.metrics['attempts'], 3
+                ) if self.metrics['attempts'] else 0.0,
+                'concurrency_limits': {model.model_id: round(model.concurrency.limit, 1) for model in self.models}
+            }
@@ -0,0 +1,195 @@
+import os
+import logging
+from typing import Dict, Any, List, Callable, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Rough chars-per-token ratio for Claude; good enough for budgeting prompts
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class ChatHistoryManager:
+    """Read a bounded window of recent messages and keep a rolling summary.
+
+    Only the newest messages are read (newest first, paginated), so a turn
+    costs the same number of read units however long the chat is. The
+    window is then cut to ``max_messages`` and ``token_budget``.
+
+    With an anchor (the chat's summarizedThrough), the window starts right
+    after it and only slides a block of ``block_messages`` at a time, so
+    the replayed prefix of the prompt stays the same between slides and
+    can be served from the prompt cache. Each slide moves the anchor and,
+    with summaries enabled, folds the turns it drops into a summary stored
+    on the chat item.
+    """
+
+    def __init__(self, chats_table, messages_table,
+                 summarizer: Optional[Callable[[str, List[Dict[str, str]]], str]] = None):
+        self.chats_table = chats_table
+        self.messages_table = messages_table
+        self.summarizer = summarizer
+        self.max_messages = int(os.environ.get('CHAT_HISTORY_MAX_MESSAGES', '20'))
+        self.token_budget = int(os.environ.get('CHAT_HISTORY_TOKEN_BUDGET', '4000'))
+        self.summary_batch = int(os.environ.get('CHAT_HISTORY_SUMMARY_BATCH', '50'))
+        # The window slides (and the summary is refreshed) this many messages at
+        # a time; an even number keeps whole turns together
+        self.block_messages = max(2, int(os.environ.get('CHAT_HISTORY_BLOCK_MESSAGES', '10')))
+
+    def get_recent(self, chat_id: str, exclude_message_id: str = None) -> List[Dict[str, Any]]:
+        """Get up to max_messages plus one block of the most recent items in chronological order.
+
+        The extra block lets select_window see when the messages after the
+        anchor no longer fit and the window has to slide.
+        """
+        limit = self.max_messages + self.block_messages
+        items = []
+        query_kwargs = {
+            'KeyConditionExpression': 'chatId = :chatId',
+            'ExpressionAttributeValues': {
+                ':chatId': chat_id
+            },
+            'ScanIndexForward': False,
+            'Limit': limit + 1
+        }
+
+        while len(items) < limit:
+            response = self.messages_table.query(**query_kwargs)
+            for item in response.get('Items', []):
+                if item['messageId'] != exclude_message_id:
+                    items.append(item)
+
+            last_key = response.get('LastEvaluatedKey')
+            if not last_key:
+                break
+            query_kwargs['ExclusiveStartKey'] = last_key
+
+        items = items[:limit]
+        items.reverse()
+        return items
+
+    def trim_to_budget(self, items: List[Dict[str, Any]], reserved_tokens: int = 0) -> List[Dict[str, Any]]:
+        """Keep the newest items that fit in the token budget.
+
+        The result always starts with a user turn, as the Messages API requires.
+        """
+        budget = self.token_budget - reserved_tokens
+        kept = []
+        for item in reversed(items):
+            cost = estimate_tokens(item['message'])
+            if kept and cost > budget:
+                break
+            budget -= cost
+            kept.append(item)
+        kept.reverse()
+
+        return self._from_user_turn(kept)
+
+    @staticmethod
+    def _from_user_turn(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        start = 0
+        while start < len(items) and items[start]['author'] == 'assistant':
+            start += 1
+        return items[start:]
+
+    def _fits(self, items: List[Dict[str, Any]], reserved_tokens: int) -> bool:
+        return (len(items) <= self.max_messages
+                and sum(estimate_tokens(item['message']) for item in items) <= self.token_budget - reserved_tokens)
+
+    def select_window(self, items: List[Dict[str, Any]], summarized_through: Optional[str] = None,
+                      reserved_tokens: int = 0) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Pick the items to replay from get_recent's result.
+
+        Without an anchor this is the newest max_messages that fit the
+        budget. With one, the window holds everything after the anchor and
+        drops whole blocks from its start once that no longer fits.
+
+        Returns the window and, when it slid, the messageId the anchor
+        should move to (pass it to refresh_summary), otherwise None.
+        """
+        if summarized_through is None:
+            return self.trim_to_budget(items[-self.max_messages:], reserved_tokens), None
+
+        items = [item for item in items if item['messageId'] > summarized_through]
+        start = 0
+        while start < len(items) and not self._fits(items[start:], reserved_tokens):
+            start += self.block_messages
+        if start < len(items):
+            window = self._from_user_turn(items[start:])
+        else:
+            # Not even the newest block fits the budget
+            window = self.trim_to_budget(items, reserved_tokens)
+
+        dropped = len(items) - len(window)
+        return window, items[dropped - 1]['messageId'] if dropped else None
+
+    def refresh_summary(self, chat: Dict[str, Any], through_id: str) -> None:
+        """Move the chat's anchor up to through_id, folding the turns it passes into the summary.
+
+        Called when the window slides, so the summary only changes at block
+        boundaries. At most summary_batch messages are folded at once; the
+        anchor then stops at the last one folded and a later slide catches
+        up. The update is conditioned on the anchor still being the one
+        this fold started from, so concurrent turns cannot overwrite each
+        other's fold or move summarizedThrough backwards.
+        """
+        summarized_through = chat.get('summarizedThrough', '')
+        if summarized_through >= through_id:
+            # Another turn already slid the window this far
+            return
+
+        update_expression = "SET summarizedThrough = :through"
+        values = {':through': through_id}
+        if self.summarizer:
+            if summarized_through:
+                key_condition = 'chatId = :chatId AND messageId BETWEEN :from AND :to'
+                query_values = {':chatId': chat['chatId'], ':from': summarized_through, ':to': through_id}
+            else:
+                key_condition = 'chatId = :chatId AND messageId <= :to'
+                query_values = {':chatId': chat['chatId'], ':to': through_id}
+
+            response = self.messages_table.query(
+                KeyConditionExpression=key_condition,
+                ExpressionAttributeValues=query_values,
+                ScanIndexForward=True,
+                Limit=self.summary_batch + 1
+            )
+            dropped = [
+                item for item in response.get('Items', [])
+                if summarized_through < item['messageId'] <= through_id
+            ][:self.summary_batch]
+            if not dropped:
+                return
+
+            summary = self.summarizer(chat.get('historySummary', ''), [
+                {'role': item['author'], 'content': item['message']} for item in dropped
+            ])
+            update_expression += ", historySummary = :summary"
+            values = {':through': dropped[-1]['messageId'], ':summary': summary}
+
+        if summarized_through:
+            condition = 'summarizedThrough = :previous'
+            values[':previous'] = summarized_through
+        else:
+            condition = 'attribute_not_exists(summarizedThrough)'
+        try:
+            self.chats_table.update_item(
+                Key={
+                    'userId': chat['userId'],
+                    'chatId': chat['chatId']
+                },
+                UpdateExpression=update_expression,
+                ConditionExpression=condition,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            logger.info("Summary of chat %s was refreshed by another turn", chat['chatId'])
+            return
+        logger.info("Slid the history window of chat %s to %s", chat['chatId'], values[':through'])
@@ -1,34 +1,377 @@
-import boto3
 import os
-from typing import Dict, Any
+import re
+import math
+import time
+from typing import Dict, Any, List, Optional, Tuple
 import uuid
+import base64
+import hashlib
 from datetime import datetime
 import traceback
 import json
+from botocore.exceptions import ClientError
+from utils.clients import get_client, get_resource
+from utils.errors import APIError
+from utils.multipart import StreamedFile
+
+# S3 limits for multipart uploads
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+# Direct uploads go under this prefix plus a hash of the uploader's address
+DIRECT_UPLOAD_PREFIX = 'uploads/'
 
 
 class KnowledgeBaseService:
     def __init__(self):
-        self.s3 = boto3.client('s3')
+        self.s3 = get_client('s3')
         self.bucket_name = os.environ['S3_BUCKET_NAME']
         self.project_name = os.environ['PROJECT_NAME']
+        documents_table = os.environ.get('DOCUMENTS_TABLE')
+        self.documents_table = get_resource('dynamodb').Table(documents_table) if documents_table else None
+        self.upload_url_expiry = int(os.environ.get('UPLOAD_URL_EXPIRY', '900'))
+        # How long an upload through the API may hold its content claim, at most the Lambda timeout
+        self.upload_claim_lease = int(os.environ.get('UPLOAD_CLAIM_LEASE', '900'))
+        self.max_upload_bytes = int(os.environ.get('MAX_UPLOAD_BYTES', str(5 * 1024 ** 3)))
+        self.multipart_threshold = int(os.environ.get('MULTIPART_THRESHOLD_BYTES', str(100 * 1024 ** 2)))
+        self.upload_part_size = max(MIN_PART_SIZE, int(os.environ.get('UPLOAD_PART_SIZE', str(8 * 1024 ** 2))))
+        self.multipart_part_size = max(MIN_PART_SIZE, int(os.environ.get('MULTIPART_PART_SIZE', str(16 * 1024 ** 2))))
+
+    def _hash_file(self, file_field: StreamedFile) -> Tuple[str, int]:
+        """SHA-256 hex digest and size of an uploaded file"""
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in file_field.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        return digest.hexdigest(), size
+
+    def _stream_to_s3(self, file_field: StreamedFile, key: str, content_type: str,
+                      metadata: Dict[str, str]) -> None:
+        """Upload a file as it is parsed, through one reusable part buffer.
+
+        Files smaller than one part are sent with a single PutObject;
+        anything larger becomes a multipart upload.
+        """
+        part = bytearray(self.upload_part_size)
+        filled = 0
+        upload_id = None
+        parts = []
+
+        def flush(body) -> None:
+            nonlocal upload_id
+            if upload_id is None:
+                upload_id = self.s3.create_multipart_upload(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    ContentType=content_type,
+                    Metadata=metadata
+                )['UploadId']
+            response = self.s3.upload_part(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                PartNumber=len(parts) + 1,
+                Body=body
+            )
+            parts.append({'PartNumber': len(parts) + 1, 'ETag': response['ETag']})
+
+        try:
+            for chunk in file_field.chunks():
+                while chunk:
+                    taken = min(len(chunk), len(part) - filled)
+                    part[filled:filled + taken] = chunk[:taken]
+                    filled += taken
+                    chunk = chunk[taken:]
+                    if filled == len(part):
+                        flush(part)
+                        filled = 0
+
+            if upload_id is None:
+                self.s3.put_object(
+                    Bucket=self.bucket_name,
+                    Key=key,
+                    Body=bytes(part[:filled]),
+                    ContentType=content_type,
+                    Metadata=metadata
+                )
+                return
+
+            if filled:
+                flush(bytes(part[:filled]))
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            if upload_id is not None:
+                try:
+                    self.s3.abort_multipart_upload(Bucket=self.bucket_name, Key=key, UploadId=upload_id)
+                except Exception as abort_error:
+                    # Keep the original error; the bucket's lifecycle rule cleans up the parts
+                    print(f"Failed to abort multipart upload {upload_id} of {key}: {abort_error}")
+            raise
+
+    def _claim_content(self, content_hash: str, s3_key: str, original_filename: str,
+                       user_email: Optional[str], lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """Register an upload under its content hash.
+
+        The claim is a lease: the content stays 'pending' until pendingUntil
+        and _confirm_upload marks it 'uploaded' once the bytes are in S3, so
+        an upload that never finishes does not block the content for good.
+        Expired and failed claims can be taken over; the item is updated in
+        place, so the owners recorded so far are kept.
 
-    def add_to_knowledge_base(self, file_field, user_email: str = None):
+        Returns None if this upload now holds the content, otherwise the
+        existing document, after recording the new uploader on it.
+        """
+        now = datetime.utcnow().isoformat()
+        epoch = int(time.time())
+        update_expression = (
+            'SET s3Key = :key, originalFilename = :filename, #status = :pending, pendingUntil = :until, '
+            'createdAt = if_not_exists(createdAt, :now), lastUploadedAt = :now ADD uploadCount :one'
+        )
+        values = {
+            ':key': s3_key,
+            ':filename': original_filename,
+            ':pending': 'pending',
+            ':until': epoch + lease_seconds,
+            ':now': now,
+            ':one': 1,
+            ':failed': 'failed',
+            ':epoch': epoch
+        }
+        if user_email:
+            update_expression += ', owners :owner'
+            values[':owner'] = {user_email}
+
+        try:
+            self.documents_table.update_item(
+                Key={'contentHash': content_hash},
+                UpdateExpression=update_expression,
+                ConditionExpression=(
+                    'attribute_not_exists(contentHash) OR #status = :failed '
+                    'OR (#status = :pending AND pendingUntil < :epoch)'
+                ),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues=values
+            )
+            return None
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+        update_expression = 'SET lastUploadedAt = :now ADD uploadCount :one'
+        values = {':now': now, ':one': 1}
+        if user_email:
+            update_expression += ', owners :owner'
+            values[':owner'] = {user_email}
+        response = self.documents_table.update_item(
+            Key={'contentHash': content_hash},
+            UpdateExpression=update_expression,
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW'
+        )
+        return response['Attributes']
+
+    def _confirm_upload(self, content_hash: str, s3_key: str) -> None:
+        """Turn this upload's pending claim into a permanent one.
+
+        The embeddings processor may already have moved the content on to a
+        later status, which is left alone.
+        """
+        try:
+            self.documents_table.update_item(
+                Key={'contentHash': content_hash},
+                UpdateExpression='SET #status = :uploaded REMOVE pendingUntil',
+                ConditionExpression='#status = :pending AND s3Key = :key',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':uploaded': 'uploaded', ':pending': 'pending', ':key': s3_key}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def _mark_failed(self, content_hash: str) -> None:
+        self.documents_table.update_item(
+            Key={'contentHash': content_hash},
+            UpdateExpression='SET #status = :failed',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':failed': 'failed'}
+        )
+
+    def _duplicate_response(self, existing: Dict[str, Any], original_filename: str,
+                            user_email: Optional[str]) -> Dict[str, Any]:
+        print(f"Skipping duplicate upload of {existing['s3Key']} ({existing.get('status')})")
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'File is already in the knowledge base',
+                'duplicate': True,
+                'original_filename': original_filename,
+                's3_key': existing['s3Key'],
+                'status': existing.get('status'),
+                'bucket': self.bucket_name,
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'user_email': user_email
+            })
+        }
+
+    def create_upload(self, filename: str, content_type: str, size: int,
+                      user_email: str = None, content_hash: str = None) -> Dict[str, Any]:
+        """Sign a direct browser-to-S3 upload.
+
+        Files up to MULTIPART_THRESHOLD_BYTES get a presigned POST; larger
+        ones get a multipart upload with one presigned URL per part, to be
+        finished with complete_upload. The object metadata read by the
+        embeddings processor is bound into the signature, so the client
+        cannot change it.
+
+        Uploads always go to a fresh key under the uploader's prefix, which
+        complete_upload checks the caller against. A contentHash (SHA-256 hex) is
+        recorded as the claimed hash only: a presigned POST also binds it as
+        the x-amz-checksum-sha256 S3 checks the body against, and the
+        embeddings processor verifies it (recomputing it for multipart
+        uploads) before deduplicating on it.
+        """
+        if not filename:
+            raise APIError('filename is required', 400)
+        if size <= 0 or size > self.max_upload_bytes:
+            raise APIError(f'size must be between 1 and {self.max_upload_bytes} bytes', 400)
+        if content_hash:
+            content_hash = content_hash.lower()
+            if not SHA256_HEX.match(content_hash):
+                raise APIError('contentHash must be a hex SHA-256 digest', 400)
+
+        file_extension = os.path.splitext(filename)[1]
+        key = f"{self._upload_prefix(user_email)}{uuid.uuid4()}{file_extension}"
+
+        metadata = {
+            'original_filename': filename,
+            'upload_date': datetime.utcnow().isoformat()
+        }
+        if user_email:
+            metadata['user_email'] = user_email
+        if content_hash:
+            metadata['claimed_content_hash'] = content_hash
+
+        if size <= self.multipart_threshold:
+            fields = {
+                'Content-Type': content_type,
+                **{f"x-amz-meta-{name}": value for name, value in metadata.items()}
+            }
+            if content_hash:
+                fields['x-amz-checksum-algorithm'] = 'SHA256'
+                fields['x-amz-checksum-sha256'] = base64.b64encode(bytes.fromhex(content_hash)).decode('ascii')
+            conditions = [{name: value} for name, value in fields.items()]
+            conditions.append(['content-length-range', 1, size])
+            post = self.s3.generate_presigned_post(
+                Bucket=self.bucket_name,
+                Key=key,
+                Fields=fields,
+                Conditions=conditions,
+                ExpiresIn=self.upload_url_expiry
+            )
+            return {
+                'method': 'POST',
+                's3_key': key,
+                'url': post['url'],
+                'fields': post['fields']
+            }
+
+        part_size = max(self.multipart_part_size, math.ceil(size / MAX_PARTS))
+        upload = self.s3.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=key,
+            ContentType=content_type,
+            Metadata=metadata
+        )
+        parts = [
+            {
+                'partNumber': part_number,
+                'url': self.s3.generate_presigned_url(
+                    'upload_part',
+                    Params={
+                        'Bucket': self.bucket_name,
+                        'Key': key,
+                        'UploadId': upload['UploadId'],
+                        'PartNumber': part_number
+                    },
+                    ExpiresIn=self.upload_url_expiry
+                )
+            }
+            for part_number in range(1, math.ceil(size / part_size) + 1)
+        ]
+        return {
+            'method': 'MULTIPART',
+            's3_key': key,
+            'upload_id': upload['UploadId'],
+            'part_size': part_size,
+            'parts': parts
+        }
+
+    @staticmethod
+    def _upload_prefix(user_email: str = None) -> str:
+        """Key prefix of a user's direct uploads; a hash, so keys do not carry the address"""
+        owner = hashlib.sha256((user_email or '').strip().lower().encode('utf-8')).hexdigest()[:32]
+        return f"{DIRECT_UPLOAD_PREFIX}{owner}/"
+
+    def complete_upload(self, key: str, upload_id: str, parts: List[Dict[str, Any]],
+                        user_email: str = None) -> Dict[str, Any]:
+        """Assemble a multipart upload from the ETags the client got for each part.
+
+        Only the user create_upload signed the upload for may complete it:
+        the key has to be under their prefix, and S3 only accepts the
+        upload id together with the key it was created for.
+        """
+        if not key or not upload_id or not parts:
+            raise APIError('s3_key, upload_id and parts are required', 400)
+        if not user_email or not key.startswith(self._upload_prefix(user_email)):
+            raise APIError('Upload not found', 404)
+
+        try:
+            response = self.s3.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    'Parts': sorted(
+                        ({'PartNumber': int(part['partNumber']), 'ETag': part['etag']} for part in parts),
+                        key=lambda part: part['PartNumber']
+                    )
+                }
+            )
+        except ClientError as e:
+            raise APIError(f"Could not complete upload: {e.response['Error']['Message']}", 400)
+        return {
+            's3_key': key,
+            'bucket': self.bucket_name,
+            'etag': response.get('ETag')
+        }
+
+    def add_to_knowledge_base(self, file_field: StreamedFile, user_email: str = None):
+        """Store a file posted through the API, for clients that cannot upload directly.
+
+        The file is streamed twice from the request body: once to hash it for
+        deduplication and once into S3, so neither a decoded copy of the
+        body nor a temporary file is ever created.
+        """
         try:
-            file_data = file_field.file.read()
             original_filename = file_field.filename
+            content_hash, size = self._hash_file(file_field)
             
+            # Content-addressed key: identical files map to the same object
             file_extension = os.path.splitext(original_filename)[1]
-            unique_filename = f"{uuid.uuid4()}{file_extension}"
+            unique_filename = f"{content_hash}{file_extension}"
             
-            temp_path = os.path.join('/tmp', unique_filename)
-            with open(temp_path, 'wb') as f:
-                f.write(file_data)
-                
-            try:
-                s3_client = boto3.client('s3')
-            except Exception as e:
-                raise
+            if self.documents_table:
+                existing = self._claim_content(
+                    content_hash, unique_filename, original_filename, user_email, self.upload_claim_lease
+                )
+                if existing:
+                    return self._duplicate_response(existing, original_filename, user_email)
             
             bucket_name = os.environ.get('S3_BUCKET_NAME')
             if not bucket_name:
@@ -37,7 +380,8 @@ class KnowledgeBaseService:
             # Prepare metadata
             metadata = {
                 'original_filename': original_filename,
-                'upload_date': datetime.utcnow().isoformat()
+                'upload_date': datetime.utcnow().isoformat(),
+                'content_hash': content_hash
             }
             
             # Only add user_email to metadata if it's provided
@@ -48,30 +392,28 @@ class KnowledgeBaseService:
                 print("No user email provided, skipping email notification")
             
             try:
-                print(f"File size: {os.path.getsize(temp_path)} bytes")
-                print(f"File exists: {os.path.exists(temp_path)}")
-                print(f"File permissions: {oct(os.stat(temp_path).st_mode)[-3:]}")
+                print(f"File size: {size} bytes")
                 
                 print("Starting S3 upload...")
-                s3_client.upload_file(
-                    temp_path,
-                    bucket_name,
+                self._stream_to_s3(
+                    file_field,
                     unique_filename,
-                    ExtraArgs={
-                        'ContentType': file_field.type or 'application/pdf',
-                        'Metadata': metadata
-                    }
+                    file_field.type or 'application/pdf',
+                    metadata
                 )
             except Exception as s3_error:
+                # Let the next upload of the same content claim it again
+                if self.documents_table:
+                    self._mark_failed(content_hash)
                 raise s3_error
-            
-            # Clean up temporary file
-            os.remove(temp_path)
+            if self.documents_table:
+                self._confirm_upload(content_hash, unique_filename)
             
             return {
                 'statusCode': 200,
                 'body': json.dumps({
                     'message': f'Successfully uploaded file to S3',
+                    'duplicate': False,
                     'original_filename': original_filename,
                     's3_key': unique_filename,
                     'bucket': bucket_name,
@@ -0,0 +1,104 @@
+import re
+import math
+import heapq
+import logging
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'[a-z0-9]+')
+
+# Common English words that carry no retrieval signal
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have in is it its of on or that the this to was were what when '
+    'where which who why will with how do does did can'.split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class _SegmentPostings:
+    """Inverted index over the chunks of one vector index segment"""
+
+    def __init__(self, chunks: List[str]):
+        self.lengths = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for row, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings[term].append((row, tf))
+
+
+class BM25Index:
+    """In-process Okapi BM25 index over the chunks of the vector index.
+
+    Postings are built per segment and kept until the segment's ETag
+    changes, so a refresh only tokenizes new or updated documents.
+    Document frequencies and the average chunk length are global.
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._segments: Dict[str, Tuple[str, str, _SegmentPostings]] = {}
+        self._df: Counter = Counter()
+        self._chunks = 0
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def _add(self, key: str, etag: str, document_id: str, chunks: List[str]) -> None:
+        postings = _SegmentPostings(chunks)
+        self._segments[key] = (etag, document_id, postings)
+        self._df.update({term: len(rows) for term, rows in postings.postings.items()})
+        self._chunks += len(postings.lengths)
+        self._total_length += sum(postings.lengths)
+
+    def _remove(self, key: str) -> None:
+        _, _, postings = self._segments.pop(key)
+        self._df.subtract({term: len(rows) for term, rows in postings.postings.items()})
+        self._chunks -= len(postings.lengths)
+        self._total_length -= sum(postings.lengths)
+
+    def sync(self, segments: Dict[str, Any]) -> None:
+        """Match the indexed segments to the vector index's current segments"""
+        with self._lock:
+            stale = [key for key, (etag, _, _) in self._segments.items()
+                     if key not in segments or segments[key].etag != etag]
+            for key in stale:
+                self._remove(key)
+            added = [key for key in segments if key not in self._segments]
+            for key in added:
+                segment = segments[key]
+                self._add(key, segment.etag, segment.document_id, segment.chunks)
+            if stale or added:
+                # Drop terms whose document frequency fell to zero
+                self._df = +self._df
+                logger.info("BM25 index dropped %d and added %d segments, now %d chunks",
+                            len(stale), len(added), self._chunks)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[float, str, int]]:
+        """Return (score, document_id, row) of the top_k chunks for the query"""
+        terms = set(tokenize(query))
+        if not terms or not self._chunks:
+            return []
+
+        with self._lock:
+            average_length = self._total_length / self._chunks
+            idf = {
+                term: math.log(1 + (self._chunks - self._df[term] + 0.5) / (self._df[term] + 0.5))
+                for term in terms if self._df[term]
+            }
+            scores: Dict[Tuple[str, int], float] = defaultdict(float)
+            for _, document_id, postings in self._segments.values():
+                for term, weight in idf.items():
+                    for row, tf in postings.postings.get(term, ()):
+                        norm = self.k1 * (1 - self.b + self.b * postings.lengths[row] / average_length)
+                        scores[(document_id, row)] += weight * tf * (self.k1 + 1) / (tf + norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(score, document_id, row) for (document_id, row), score in best]
@@ -0,0 +1,51 @@
+import threading
+from typing import Optional
+
+from services.admin_service import AdminService
+from services.chat_service import ChatService
+from services.knowledge_base_service import KnowledgeBaseService
+from utils.clients import reset_clients
+
+# Services live for the lifetime of the Lambda container and are built on
+# first use, so only the cold start pays for client and table setup.
+_lock = threading.Lock()
+_chat_service: Optional[ChatService] = None
+_kb_service: Optional[KnowledgeBaseService] = None
+_admin_service: Optional[AdminService] = None
+
+
+def get_chat_service() -> ChatService:
+    global _chat_service
+    if _chat_service is None:
+        with _lock:
+            if _chat_service is None:
+                _chat_service = ChatService()
+    return _chat_service
+
+
+def get_knowledge_base_service() -> KnowledgeBaseService:
+    global _kb_service
+    if _kb_service is None:
+        with _lock:
+            if _kb_service is None:
+                _kb_service = KnowledgeBaseService()
+    return _kb_service
+
+
+def get_admin_service() -> AdminService:
+    global _admin_service
+    if _admin_service is None:
+        with _lock:
+            if _admin_service is None:
+                _admin_service = AdminService()
+    return _admin_service
+
+
+def reset_services() -> None:
+    """Forget cached services and clients so the next call rebuilds them"""
+    global _chat_service, _kb_service, _admin_service
+    with _lock:
+        _chat_service = None
+        _kb_service = None
+        _admin_service = None
+    reset_clients()
@@ -0,0 +1,52 @@
+import time
+from typing import List, Tuple
+
+from services.lexical_index import tokenize
+
+
+class TermOverlapReranker:
+    """Cheap local reranker for fused retrieval candidates.
+
+    Scores each candidate on how many of the query's terms it contains and
+    how many of its adjacent term pairs appear as phrases, blended with the
+    candidate's normalized fusion score. This promotes passages that answer
+    the whole question over ones that match a single rare term or are only
+    loosely related by embedding.
+    """
+
+    def __init__(self, fused_weight: float = 0.5, coverage_weight: float = 0.35, phrase_weight: float = 0.15):
+        self.fused_weight = fused_weight
+        self.coverage_weight = coverage_weight
+        self.phrase_weight = phrase_weight
+
+    def score(self, terms: List[str], text: str, fused: float) -> float:
+        tokens = tokenize(text)
+        present = set(tokens)
+        unique_terms = set(terms)
+        coverage = len(unique_terms & present) / len(unique_terms)
+
+        query_pairs = set(zip(terms, terms[1:]))
+        phrase = len(query_pairs & set(zip(tokens, tokens[1:]))) / len(query_pairs) if query_pairs else 0.0
+        return self.fused_weight * fused + self.coverage_weight * coverage + self.phrase_weight * phrase
+
+    def rerank(self, query: str, candidates: List[Tuple[float, str]], deadline: float) -> List[int]:
+        """Return candidate positions, best first.
+
+        ``candidates`` are (fusion score, text) in fusion order. Candidates
+        are scored in that order until ``deadline`` (a time.perf_counter()
+        value); any left unscored keep their fusion order after the rest.
+        """
+        terms = tokenize(query)
+        if not terms or not candidates:
+            return list(range(len(candidates)))
+
+        top = candidates[0][0] or 1.0
+        scored = []
+        for position, (fused, text) in enumerate(candidates):
+            if time.perf_counter() > deadline:
+                break
+            scored.append((self.score(terms, text, fused / top), position))
+
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+        ranked = [position for _, position in scored]
+        return ranked + list(range(len(scored), len(candidates)))
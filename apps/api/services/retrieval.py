@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from utils.clients import get_client
+from utils.timing import StageTimer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Passage:
+    title: str
+    text: str
+    score: float = 0.0
+    document_id: str = ''
+
+
+class Passages(list):
+    """The passages of one retrieval.
+
+    ``degraded`` is set when a stage missed its budget or failed, so the
+    result is worse than the backend would normally return and should not
+    be cached.
+    """
+
+    def __init__(self, passages=(), degraded: bool = False):
+        super().__init__(passages)
+        self.degraded = degraded
+
+
+class RetrievalBackend:
+    """Interface for the engines that supply context passages to the chat"""
+
+    name = 'base'
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[Passage]:
+        raise NotImplementedError
+
+
+class KendraRetriever(RetrievalBackend):
+    name = 'kendra'
+
+    def __init__(self, kendra, index_id: str):
+        self.kendra = kendra
+        self.index_id = index_id
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[Passage]:
+        response = self.kendra.query(
+            IndexId=self.index_id,
+            QueryText=query
+        )
+
+        passages = []
+        for item in response.get('ResultItems', [])[:top_k]:
+            title = item.get('DocumentTitle', {}).get('Text') if isinstance(item.get('DocumentTitle'), dict) else item.get('DocumentTitle', 'Untitled')
+            passages.append(Passage(
+                title=title,
+                text=item.get('DocumentExcerpt', {}).get('Text', ''),
+                document_id=item.get('DocumentId', '')
+            ))
+        return passages
+
+
+class VectorIndexRetriever(RetrievalBackend):
+    name = 'vector'
+
+    def __init__(self, index, embedder):
+        self.index = index
+        self.embedder = embedder
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[Passage]:
+        query_vector = self.embedder.embed([query])
+        hits = self.index.search(query_vector, top_k)[0]
+        return [
+            Passage(title=hit.title, text=hit.text, score=hit.score, document_id=hit.document_id)
+            for hit in hits
+        ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[str, int]]], k: int = 60) -> List[Tuple[float, Tuple[str, int]]]:
+    """Fuse ranked lists of (document_id, row) by summing 1 / (k + rank)"""
+    scores: Dict[Tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            scores[chunk] = scores.get(chunk, 0.0) + 1.0 / (k + rank)
+    return sorted(((score, chunk) for chunk, score in scores.items()), key=lambda entry: entry[0], reverse=True)
+
+
+class HybridRetriever(RetrievalBackend):
+    """BM25 and vector search over the same chunks, fused and reranked.
+
+    The lexical and vector stages run in parallel and each has a latency
+    budget; a stage that misses it is left out of the fusion rather than
+    holding up the turn. Reciprocal-rank fusion merges the two candidate
+    lists, and a local reranker reorders the top of the fused list until
+    its own budget runs out. Stage timings are logged for every query, and
+    a result missing any stage is returned as degraded.
+
+    The BM25 postings are synced with the vector index's segments in the
+    refresh stage, only when those change, so tokenizing a new document is
+    not charged to the lexical budget.
+    """
+
+    name = 'hybrid'
+
+    def __init__(self, index, embedder, lexical, reranker):
+        self.index = index
+        self.embedder = embedder
+        self.lexical = lexical
+        self.reranker = reranker
+        self.candidates = int(os.environ.get('HYBRID_CANDIDATES', '50'))
+        self.rrf_k = int(os.environ.get('HYBRID_RRF_K', '60'))
+        self.rerank_depth = int(os.environ.get('HYBRID_RERANK_DEPTH', '20'))
+        self.budgets_ms = {
+            'lexical': float(os.environ.get('HYBRID_LEXICAL_BUDGET_MS', '150')),
+            'vector': float(os.environ.get('HYBRID_VECTOR_BUDGET_MS', '500')),
+            'rerank': float(os.environ.get('HYBRID_RERANK_BUDGET_MS', '50'))
+        }
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='hybrid')
+        self._synced_segments = None
+
+    def _vector_search(self, query: str) -> List[Tuple[str, int]]:
+        hits = self.index.search(self.embedder.embed([query]), self.candidates)[0]
+        return [(hit.document_id, hit.row) for hit in hits]
+
+    def refresh(self) -> None:
+        """Reload changed vector segments and bring the BM25 postings in line with them"""
+        self.index.refresh()
+        segments = self.index.segments
+        # refresh() swaps in a new dict whenever it reloads, so identity is enough
+        if segments is not self._synced_segments:
+            self.lexical.sync(segments)
+            self._synced_segments = segments
+
+    def _lexical_search(self, query: str) -> List[Tuple[str, int]]:
+        return [(document_id, row) for _, document_id, row in self.lexical.search(query, self.candidates)]
+
+    def _collect(self, future: Future, stage: str, started: float, overruns: List[str],
+                 failures: List[str]) -> List[Tuple[str, int]]:
+        remaining = self.budgets_ms[stage] / 1000 - (time.perf_counter() - started)
+        try:
+            return future.result(timeout=max(remaining, 0))
+        except TimeoutError:
+            overruns.append(stage)
+            return []
+        except Exception as e:
+            logger.error("Hybrid %s stage failed: %s", stage, str(e))
+            failures.append(stage)
+            return []
+
+    def retrieve(self, query: str, top_k: int = 3) -> Passages:
+        timer = StageTimer()
+        with timer.stage('refresh'):
+            self.refresh()
+
+        started = time.perf_counter()
+        lexical_future = self._pool.submit(timer.timed, 'lexical', self._lexical_search, query)
+        vector_future = self._pool.submit(timer.timed, 'vector', self._vector_search, query)
+        overruns: List[str] = []
+        failures: List[str] = []
+        lexical = self._collect(lexical_future, 'lexical', started, overruns, failures)
+        vector = self._collect(vector_future, 'vector', started, overruns, failures)
+
+        with timer.stage('fuse'):
+            fused = reciprocal_rank_fusion([ranking for ranking in (lexical, vector) if ranking], self.rrf_k)
+            segments = {segment.document_id: segment for segment in list(self.index.segments.values())}
+            candidates = [
+                (score, segments[document_id], row)
+                for score, (document_id, row) in fused[:self.rerank_depth]
+                if document_id in segments
+            ]
+
+        with timer.stage('rerank'):
+            deadline = time.perf_counter() + self.budgets_ms['rerank'] / 1000
+            order = self.reranker.rerank(
+                query,
+                [(score, segment.chunks[row]) for score, segment, row in candidates],
+                deadline
+            )
+            if time.perf_counter() > deadline:
+                overruns.append('rerank')
+
+        logger.info("Hybrid retrieval: %d lexical, %d vector, %d fused candidates; timings %s; "
+                    "over budget %s; failed %s",
+                    len(lexical), len(vector), len(fused), json.dumps(timer.as_dict()), overruns, failures)
+
+        passages = Passages(degraded=bool(overruns or failures))
+        for position in order[:top_k]:
+            score, segment, row = candidates[position]
+            passages.append(Passage(
+                title=segment.title,
+                text=segment.chunks[row],
+                score=score,
+                document_id=segment.document_id
+            ))
+        return passages
+
+
+def _create_vector_index():
+    # Deferred so a Kendra-only cold start does not pay for importing numpy
+    from embedders import get_embedder
+    from services.vector_index import VectorIndex
+
+    embedder = get_embedder(get_client('bedrock-runtime', region_name='us-east-1'))
+    index = VectorIndex(
+        get_client('s3'),
+        os.environ.get('VECTOR_INDEX_BUCKET', os.environ.get('S3_BUCKET_NAME')),
+        embedder.name,
+        embedder.dimension
+    )
+    return index, embedder
+
+
+def create_retriever(kendra, kendra_index_id: str) -> RetrievalBackend:
+    """Build the retrieval backend selected by RETRIEVAL_BACKEND (kendra, vector or hybrid)"""
+    backend = os.environ.get('RETRIEVAL_BACKEND', 'kendra')
+    if backend == 'kendra':
+        return KendraRetriever(kendra, kendra_index_id)
+
+    if backend == 'vector':
+        index, embedder = _create_vector_index()
+        return VectorIndexRetriever(index, embedder)
+
+    if backend == 'hybrid':
+        from services.lexical_index import BM25Index
+        from services.reranker import TermOverlapReranker
+
+        index, embedder = _create_vector_index()
+        return HybridRetriever(index, embedder, BM25Index(), TermOverlapReranker())
+
+    raise ValueError(f"Unknown retrieval backend: {backend}")
@@ -0,0 +1,117 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Item in the cache table holding the counter that ingestion bumps
+INDEX_VERSION_KEY = '__index_version__'
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a query so trivially different phrasings share a cache entry"""
+    text = re.sub(r'\s+', ' ', text.lower()).strip()
+    return text.strip('?!.,;: ')
+
+
+class RetrievalCache:
+    """Two-tier cache for retrieval context keyed on normalized query text.
+
+    Entries live in an in-process LRU and, when a table is configured, in a
+    DynamoDB table shared by all containers. Keys include the index version
+    counter, so bumping it on ingestion invalidates every cached result.
+    """
+
+    def __init__(self, table=None):
+        self.table = table
+        self.ttl_seconds = int(os.environ.get('RETRIEVAL_CACHE_TTL', '900'))
+        self.max_entries = int(os.environ.get('RETRIEVAL_CACHE_MAX_ENTRIES', '512'))
+        self.version_ttl_seconds = int(os.environ.get('RETRIEVAL_CACHE_VERSION_TTL', '30'))
+        self._entries: 'OrderedDict[str, Tuple[float, str]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._version: Tuple[float, int] = (0.0, 0)
+        self.metrics = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def _index_version(self) -> int:
+        checked_at, version = self._version
+        if not self.table or time.time() - checked_at < self.version_ttl_seconds:
+            return version
+        try:
+            item = self.table.get_item(Key={'cacheKey': INDEX_VERSION_KEY}).get('Item') or {}
+            version = int(item.get('version', 0))
+        except Exception as e:
+            logger.error("Error reading index version: %s", str(e))
+        self._version = (time.time(), version)
+        return version
+
+    def key(self, namespace: str, query: str) -> str:
+        """The cache key of a query; equal for queries that share an entry"""
+        digest = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+        return f"{namespace}:{self._index_version()}:{digest}"
+
+    def _count(self, metric: str) -> None:
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def get(self, namespace: str, query: str) -> Optional[str]:
+        key = self.key(namespace, query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.metrics['local_hits'] += 1
+                return entry[1]
+            if entry:
+                del self._entries[key]
+
+        if self.table:
+            try:
+                item = self.table.get_item(Key={'cacheKey': key}).get('Item')
+                if item and int(item['expiresAt']) > now:
+                    self._store_local(key, item['context'], float(item['expiresAt']))
+                    self._count('shared_hits')
+                    return item['context']
+            except Exception as e:
+                logger.error("Error reading retrieval cache: %s", str(e))
+
+        self._count('misses')
+        return None
+
+    def put(self, namespace: str, query: str, context: str) -> None:
+        key = self.key(namespace, query)
+        expires_at = time.time() + self.ttl_seconds
+        self._store_local(key, context, expires_at)
+
+        if self.table:
+            try:
+                self.table.put_item(Item={
+                    'cacheKey': key,
+                    'context': context,
+                    'expiresAt': int(expires_at)
+                })
+            except Exception as e:
+                logger.error("Error writing retrieval cache: %s", str(e))
+
+    def _store_local(self, key: str, context: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (expires_at, context)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = sum(self.metrics.values())
+            hits = self.metrics['local_hits'] + self.metrics['shared_hits']
+            return {
+                **self.metrics,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'local_entries': len(self._entries)
+            }
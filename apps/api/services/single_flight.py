@@ -0,0 +1,108 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Tuple
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Lease items share the retrieval cache table under this key prefix
+LEASE_PREFIX = 'lease#'
+
+
+class SingleFlight:
+    """Share one in-flight call among concurrent callers with the same key.
+
+    The first caller for a key (the leader) runs the call; callers that
+    arrive while it is running wait for and return the leader's result, or
+    its exception. Nothing is kept once the call finishes, so this only
+    collapses concurrent duplicates and never serves stale results.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.metrics = {'leaders': 0, 'followers': 0}
+
+    def do(self, key: str, func: Callable[..., Any], *args, **kwargs) -> Tuple[Any, bool]:
+        """Return (result, shared); shared is True if another caller ran the call"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+                self.metrics['leaders'] += 1
+            else:
+                self.metrics['followers'] += 1
+        if not leader:
+            return call.result(), True
+
+        try:
+            call.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            call.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return call.result(), False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.metrics['leaders'] + self.metrics['followers']
+            return {
+                **self.metrics,
+                'shared_rate': round(self.metrics['followers'] / calls, 3) if calls else 0.0,
+                'in_flight': len(self._calls)
+            }
+
+
+class DynamoLease:
+    """Best-effort lease on a key, held in a DynamoDB table with a TTL.
+
+    Lets one container run an expensive call while others wait for its
+    result to show up in a shared cache. A lease expires after
+    ``ttl_seconds`` so a container that dies mid-call cannot block the key,
+    and any DynamoDB error is treated as acquiring it, so the lease can
+    only cost a duplicate call, never a failed request.
+    """
+
+    def __init__(self, table, ttl_seconds: int = None):
+        self.table = table
+        self.ttl_seconds = ttl_seconds or int(os.environ.get('RETRIEVAL_LEASE_SECONDS', '10'))
+        self.owner = str(uuid.uuid4())
+
+    def acquire(self, key: str) -> bool:
+        now = int(time.time())
+        try:
+            self.table.put_item(
+                Item={
+                    'cacheKey': f"{LEASE_PREFIX}{key}",
+                    'owner': self.owner,
+                    'expiresAt': now + self.ttl_seconds
+                },
+                ConditionExpression='attribute_not_exists(cacheKey) OR expiresAt < :now',
+                ExpressionAttributeValues={':now': now}
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            logger.error("Error acquiring lease %s: %s", key, str(e))
+            return True
+
+    def release(self, key: str) -> None:
+        try:
+            self.table.delete_item(
+                Key={'cacheKey': f"{LEASE_PREFIX}{key}"},
+                ConditionExpression='#owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={':owner': self.owner}
+            )
+        except ClientError as e:
+            # Expired and taken over by another container; nothing to release
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error("Error releasing lease %s: %s", key, str(e))
@@ -0,0 +1,113 @@
+import logging
+from typing import Dict, Any, Optional
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+from utils.errors import APIError
+
+logger = logging.getLogger(__name__)
+
+_serializer = TypeSerializer()
+
+# Per-chat running totals kept from each reply's Bedrock usage block
+USAGE_COUNTERS = {
+    'input_tokens': 'inputTokens',
+    'output_tokens': 'outputTokens',
+    'cache_creation_input_tokens': 'cacheWriteTokens',
+    'cache_read_input_tokens': 'cacheReadTokens'
+}
+
+
+def serialize_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a resource-style item to the low-level format transactions take"""
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+class TurnStore:
+    """Persist the messages of a chat turn, one transaction per message.
+
+    Each message Put is paired with the chat's counter Update, conditioned
+    on the chat existing under the caller's userId. Ownership check, message
+    and counter are therefore one round trip, and a message is never stored
+    for a chat the caller does not own. A message whose messageId is already
+    taken is rejected with a 409 instead of overwriting it.
+    """
+
+    def __init__(self, client, chats_table_name: str, messages_table_name: str):
+        self.client = client
+        self.chats_table_name = chats_table_name
+        self.messages_table_name = messages_table_name
+
+    def _write(self, message: Dict[str, Any], usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        update_expression = "SET lastMessageAt = :lma, messageCount = if_not_exists(messageCount, :zero) + :inc"
+        values = {
+            ':lma': message['timestamp'],
+            ':inc': 1,
+            ':zero': 0
+        }
+        if usage:
+            update_expression += ' ADD ' + ', '.join(
+                f"{attribute} :{attribute}" for attribute in USAGE_COUNTERS.values()
+            )
+            for field, attribute in USAGE_COUNTERS.items():
+                values[f":{attribute}"] = usage.get(field, 0)
+
+        try:
+            self.client.transact_write_items(
+                TransactItems=[
+                    {
+                        'Update': {
+                            'TableName': self.chats_table_name,
+                            'Key': serialize_item({
+                                'userId': message['userId'],
+                                'chatId': message['chatId']
+                            }),
+                            'UpdateExpression': update_expression,
+                            # Title marker items share the table but are not chats
+                            'ConditionExpression': 'attribute_exists(chatId) AND attribute_not_exists(titleOf)',
+                            'ExpressionAttributeValues': serialize_item(values)
+                        }
+                    },
+                    {
+                        'Put': {
+                            'TableName': self.messages_table_name,
+                            'Item': serialize_item(message),
+                            'ConditionExpression': 'attribute_not_exists(messageId)'
+                        }
+                    }
+                ]
+            )
+        except ClientError as e:
+            # One reason per transaction item, in order: the chat update, then the message put
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons', [])]
+            if reasons[:1] == ['ConditionalCheckFailed']:
+                raise APIError('Chat not found', 404)
+            if reasons[1:2] == ['ConditionalCheckFailed']:
+                raise APIError(f"Message {message['messageId']} already exists", 409)
+            raise
+        return message
+
+    def save_user_message(self, chat_id: str, user_id: str, content: str, now: int) -> Dict[str, Any]:
+        return self._write({
+            'chatId': chat_id,
+            'messageId': f"msg_{now}_user",
+            'userId': user_id,
+            'author': 'user',
+            'message': content,
+            'timestamp': now
+        })
+
+    def save_assistant_message(self, chat_id: str, user_id: str, content: str, now: int,
+                               usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        """Store the reply; its token usage is kept on the message and added to the chat's totals"""
+        message = {
+            'chatId': chat_id,
+            'messageId': f"msg_{now + 1}_assistant",
+            'userId': user_id,
+            'author': 'assistant',
+            'message': content,
+            'timestamp': now + 1000
+        }
+        if usage:
+            message['usage'] = usage
+        return self._write(message, usage)
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import logging
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Segment:
+    """One document's chunk vectors, memory-mapped from local disk"""
+    document_id: str
+    title: str
+    chunks: List[str]
+    vectors: np.ndarray
+    etag: str
+    ivf_version: Optional[str] = None
+    list_offsets: Optional[np.ndarray] = None
+
+
+@dataclass
+class ListLayout:
+    """Rows of the IVF-partitioned segments regrouped so each list is contiguous.
+
+    Rows of list ``l`` are ``vectors[offsets[l]:offsets[l + 1]]``; row ``i``
+    came from row ``rows[i]`` of ``segments[owners[i]]``. Rows of segments
+    deleted or replaced since the merge have ``live[owner]`` unset and are
+    skipped until the next compaction.
+    """
+    path: str
+    centroids: np.ndarray
+    vectors: np.ndarray
+    offsets: np.ndarray
+    segments: List[Segment]
+    owners: np.ndarray
+    rows: np.ndarray
+    live: np.ndarray
+
+
+@dataclass
+class VectorHit:
+    score: float
+    document_id: str
+    title: str
+    text: str
+    row: int = -1
+
+
+class VectorIndex:
+    """Cosine search over vector segments written by the embeddings processor.
+
+    Segments are synced from S3 into a local cache directory and opened with
+    ``mmap_mode='r'``, so only the pages touched by a search are read into
+    memory and warm containers reuse them across invocations.
+
+    Once IVF centroids have been trained, each query only scores the rows
+    in its ``nprobe`` nearest lists (approximate search). The lists are
+    merged across segments at refresh time, so a probe reads one block per
+    list. Raising nprobe trades latency for recall; segments partitioned
+    with another centroid version, or not at all, are scanned exhaustively.
+
+    Segments that arrive after a merge go into a small delta layout next to
+    the base one, so a refresh only copies the new rows. Once the delta and
+    the rows of deleted segments reach VECTOR_INDEX_COMPACT_RATIO of the
+    base, both are merged into a new base.
+    """
+
+    def __init__(self, s3, bucket: str, embedder_name: str, dimension: int):
+        self.s3 = s3
+        self.bucket = bucket
+        self.embedder_name = embedder_name
+        self.dimension = dimension
+        self.prefix = os.environ.get('VECTOR_INDEX_PREFIX', 'vector-index/')
+        self.cache_dir = os.environ.get('VECTOR_INDEX_CACHE_DIR', '/tmp/vector-index')
+        self.refresh_seconds = int(os.environ.get('VECTOR_INDEX_REFRESH_SECONDS', '300'))
+        self.block_rows = int(os.environ.get('VECTOR_INDEX_BLOCK_ROWS', '65536'))
+        self.nprobe = int(os.environ.get('VECTOR_INDEX_NPROBE', '16'))
+        self.compact_ratio = float(os.environ.get('VECTOR_INDEX_COMPACT_RATIO', '0.25'))
+        self.ivf_prefix = f"{self.prefix}_ivf/"
+        self.ivf_version: Optional[str] = None
+        self.centroids: Optional[np.ndarray] = None
+        self.segments: Dict[str, Segment] = {}
+        # The base layout, then the delta layout if there is one
+        self._lists: Tuple[ListLayout, ...] = ()
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+
+    def _list_segment_keys(self) -> Dict[str, str]:
+        keys = {}
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('.npy') and not obj['Key'].startswith(self.ivf_prefix):
+                    keys[obj['Key'][:-len('.npy')]] = obj['ETag']
+        return keys
+
+    def _load_segment(self, key: str) -> Segment:
+        """Download a segment's vectors and read its chunks.
+
+        Both files carry the revision of the write that produced them; a
+        pair from different writes (a rewrite caught half done) is rejected
+        and retried on the next refresh.
+        """
+        name = key[len(self.prefix):].replace('/', '_')
+        vectors_path = os.path.join(self.cache_dir, f"{name}.npy")
+        response = self.s3.get_object(Bucket=self.bucket, Key=f"{key}.npy")
+        # Write beside the current copy and swap, since searches may still map it
+        download_path = f"{vectors_path}.{uuid.uuid4().hex}"
+        with open(download_path, 'wb') as f:
+            for chunk in response['Body'].iter_chunks(1024 * 1024):
+                f.write(chunk)
+        os.replace(download_path, vectors_path)
+        metadata = json.loads(self.s3.get_object(Bucket=self.bucket, Key=f"{key}.json")['Body'].read())
+
+        if metadata.get('embedder') != self.embedder_name or metadata.get('dimension') != self.dimension:
+            raise ValueError(
+                f"Segment {key} was embedded with {metadata.get('embedder')}/{metadata.get('dimension')}, "
+                f"expected {self.embedder_name}/{self.dimension}"
+            )
+        revision = response.get('Metadata', {}).get('revision')
+        if revision != metadata.get('revision'):
+            raise ValueError(f"Segment {key} is being rewritten (.npy {revision}, .json {metadata.get('revision')})")
+
+        return Segment(
+            document_id=metadata['document_id'],
+            title=metadata.get('title', 'Untitled'),
+            chunks=metadata['chunks'],
+            vectors=np.load(vectors_path, mmap_mode='r'),
+            etag=response['ETag'],
+            ivf_version=metadata.get('ivf_version'),
+            list_offsets=np.asarray(metadata['list_offsets']) if 'list_offsets' in metadata else None
+        )
+
+    def _load_ivf(self) -> None:
+        try:
+            info = json.loads(
+                self.s3.get_object(Bucket=self.bucket, Key=f"{self.ivf_prefix}centroids.json")['Body'].read()
+            )
+        except self.s3.exceptions.NoSuchKey:
+            return
+        if info['version'] == self.ivf_version:
+            return
+
+        path = os.path.join(self.cache_dir, f"_ivf-centroids-{info['version']}.npy")
+        self.s3.download_file(self.bucket, f"{self.ivf_prefix}centroids-{info['version']}.npy", path)
+        self.centroids = np.load(path)
+        self.ivf_version = info['version']
+
+    def refresh(self, force: bool = False) -> None:
+        """Download new or changed segments and drop deleted ones"""
+        if not force and time.time() - self._refreshed_at < self.refresh_seconds:
+            return
+
+        with self._lock:
+            if not force and time.time() - self._refreshed_at < self.refresh_seconds:
+                return
+            os.makedirs(self.cache_dir, exist_ok=True)
+            ivf_version = self.ivf_version
+            try:
+                self._load_ivf()
+            except Exception as e:
+                logger.error("Error loading IVF centroids: %s", str(e))
+            keys = self._list_segment_keys()
+
+            segments = {key: seg for key, seg in self.segments.items() if keys.get(key) == seg.etag}
+            changed = len(segments) != len(self.segments) or self.ivf_version != ivf_version
+            for key in keys:
+                if key in segments:
+                    continue
+                try:
+                    segments[key] = self._load_segment(key)
+                    changed = True
+                except Exception as e:
+                    logger.error("Error loading vector index segment %s: %s", key, str(e))
+                    # Keep serving the copy we have until the new one loads
+                    if key in self.segments:
+                        segments[key] = self.segments[key]
+
+            if changed or not self._lists:
+                previous, self._lists = self._lists, self._update_lists(list(segments.values()))
+                for layout in previous:
+                    if all(layout.path != current.path for current in self._lists):
+                        # Searches still holding the old map keep reading the unlinked file
+                        os.remove(layout.path)
+            self.segments = segments
+            self._refreshed_at = time.time()
+            logger.info("Vector index has %d segments, %d chunks",
+                        len(segments), sum(len(seg.chunks) for seg in segments.values()))
+
+    def _update_lists(self, segments: List[Segment]) -> Tuple[ListLayout, ...]:
+        """Bring the merged layouts up to date with the current segments.
+
+        New IVF-partitioned segments are merged into the delta layout, which
+        is rewritten with the segments it already held; the base layout is
+        left alone apart from marking the rows of segments that are gone.
+        The base is rebuilt from every segment when the centroids change or
+        the delta and dead rows outgrow compact_ratio of it.
+        """
+        if self.centroids is None:
+            return ()
+        members = [seg for seg in segments if seg.ivf_version == self.ivf_version and seg.list_offsets is not None]
+        current = {id(seg) for seg in members}
+        if not self._lists or self._lists[0].centroids is not self.centroids:
+            return self._compact(members)
+
+        layouts = tuple(replace(layout, live=np.array([id(seg) in current for seg in layout.segments]))
+                        for layout in self._lists)
+        base, delta = layouts[0], layouts[1:]
+        merged = {id(seg) for layout in layouts for seg in layout.segments}
+        added = [seg for seg in members if id(seg) not in merged]
+        pending = [seg for layout in delta for seg, live in zip(layout.segments, layout.live) if live] + added
+        dead = sum(len(seg.chunks) for layout in layouts for seg, live in zip(layout.segments, layout.live)
+                   if not live)
+        if sum(len(seg.chunks) for seg in pending) + dead > self.compact_ratio * len(base.vectors):
+            return self._compact(members)
+        if added:
+            return (base, self._merge_lists(pending))
+        return layouts
+
+    def _compact(self, members: List[Segment]) -> Tuple[ListLayout, ...]:
+        layout = self._merge_lists(members)
+        return (layout,) if layout is not None else ()
+
+    def _merge_lists(self, members: List[Segment]) -> Optional[ListLayout]:
+        """Regroup the rows of IVF-partitioned segments by list.
+
+        Each list's rows, from all segments, end up in one contiguous block
+        of a memory-mapped file in the cache directory, so probing a list is
+        a single slice however many segments contributed to it.
+        """
+        if not members:
+            return None
+
+        nlist = len(self.centroids)
+        counts = sum(np.diff(seg.list_offsets) for seg in members)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        path = os.path.join(self.cache_dir, f"_ivf-lists-{self.ivf_version}-{uuid.uuid4().hex}.npy")
+        vectors = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                            shape=(int(offsets[-1]), self.dimension))
+        owners = np.empty(len(vectors), dtype=np.int32)
+        rows = np.empty(len(vectors), dtype=np.int32)
+
+        cursor = offsets[:-1].copy()
+        for position, seg in enumerate(members):
+            seg_counts = np.diff(seg.list_offsets)
+            list_ids = np.repeat(np.arange(nlist), seg_counts)
+            local = np.arange(len(list_ids))
+            # Rows of list l go after the rows earlier segments put in it
+            target = cursor[list_ids] + (local - seg.list_offsets[list_ids])
+            vectors[target] = seg.vectors[:len(list_ids)]
+            owners[target] = position
+            rows[target] = local
+            cursor += seg_counts
+        vectors.flush()
+        return ListLayout(path, self.centroids, np.load(path, mmap_mode='r'), offsets, members, owners, rows,
+                          np.ones(len(members), dtype=bool))
+
+    def _score_rows(self, queries: np.ndarray, segment: Segment, start: int, end: int,
+                    top_k: int, heaps: List[List[Any]]) -> None:
+        """Score rows start:end of a segment against all queries and update their heaps"""
+        scores = queries @ segment.vectors[start:end].T
+        k = min(top_k, end - start)
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        for q, rows in enumerate(candidates):
+            for row in rows:
+                _push(heaps[q], (float(scores[q, row]), segment.document_id, start + int(row), segment), top_k)
+
+    def _probe_lists(self, query: np.ndarray, lists: np.ndarray, layout: ListLayout,
+                     top_k: int, heap: List[Any]) -> None:
+        """Score one query against the merged blocks of its probed lists"""
+        blocks = [(int(layout.offsets[l]), int(layout.offsets[l + 1])) for l in lists]
+        blocks = [(start, end) for start, end in blocks if end > start]
+        if not blocks:
+            return
+        index = np.concatenate([np.arange(start, end) for start, end in blocks])
+        scores = np.concatenate([layout.vectors[start:end] for start, end in blocks]) @ query
+        if not layout.live.all():
+            keep = layout.live[layout.owners[index]]
+            index, scores = index[keep], scores[keep]
+            if not len(scores):
+                return
+        k = min(top_k, len(scores))
+        for i in np.argpartition(-scores, k - 1)[:k]:
+            segment = layout.segments[layout.owners[index[i]]]
+            _push(heap, (float(scores[i]), segment.document_id, int(layout.rows[index[i]]), segment), top_k)
+
+    def search(self, queries: np.ndarray, top_k: int = 3, nprobe: int = None) -> List[List[VectorHit]]:
+        """Return the top_k chunks by cosine similarity for each query row.
+
+        Queries must be unit length. Exhaustive scans score every query at
+        once with one matrix product per block of rows; IVF probes score
+        each query with one product over the merged blocks of its lists.
+        """
+        self.refresh()
+        queries = np.atleast_2d(queries).astype(np.float32)
+        heaps: List[List[Any]] = [[] for _ in range(len(queries))]
+
+        layouts = self._lists
+        nprobe = nprobe or self.nprobe
+        probed = set()
+        if layouts and nprobe < len(layouts[0].centroids):
+            probes = np.argsort(-(queries @ layouts[0].centroids.T), axis=1)[:, :nprobe]
+            for layout in layouts:
+                for q, lists in enumerate(probes):
+                    self._probe_lists(queries[q], lists, layout, top_k, heaps[q])
+                probed.update(id(seg) for seg in layout.segments)
+
+        for segment in list(self.segments.values()):
+            if id(segment) in probed:
+                continue
+            for start in range(0, len(segment.vectors), self.block_rows):
+                end = min(start + self.block_rows, len(segment.vectors))
+                self._score_rows(queries, segment, start, end, top_k, heaps)
+
+        return [
+            [
+                VectorHit(score, document_id, segment.title, segment.chunks[row], row)
+                for score, document_id, row, segment in sorted(heap, key=lambda e: e[0], reverse=True)
+            ]
+            for heap in heaps
+        ]
+
+
+def _push(heap: List[Any], entry: Tuple[float, str, int, Segment], top_k: int) -> None:
+    # (document_id, row) is unique, so segments are never compared
+    if len(heap) < top_k:
+        heapq.heappush(heap, entry)
+    elif entry[0] > heap[0][0]:
+        heapq.heapreplace(heap, entry)
@@ -1,8 +1,21 @@
-from typing import Dict, Any
+from typing import Dict, Any, List
 from .errors import APIError
 
 def get_user_id(claims: Dict[str, Any]) -> str:
     user_id = claims.get('sub')
     if not user_id:
         raise APIError('Unauthorized - No user ID found', 401)
-    return user_id 
\ No newline at end of file
+    return user_id 
+
+
+def get_groups(claims: Dict[str, Any]) -> List[str]:
+    """Cognito groups of the caller; the claim arrives as a list or a string like "[a b]" or "a,b" """
+    groups = claims.get('cognito:groups') or []
+    if isinstance(groups, str):
+        groups = groups.strip('[]').replace(',', ' ').split()
+    return list(groups)
+
+
+def require_group(claims: Dict[str, Any], group: str) -> None:
+    if group not in get_groups(claims):
+        raise APIError('Forbidden', 403)
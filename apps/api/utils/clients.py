@@ -0,0 +1,65 @@
+import os
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+# Clients are cached per container so warm invocations reuse the same
+# connection pools instead of rebuilding them on every request.
+_lock = threading.Lock()
+_clients: Dict[Tuple[str, str, Optional[str], Optional[str], int], Any] = {}
+
+
+def get_client_config(max_attempts: int = 4) -> Config:
+    """Shared botocore config used for every client and resource.
+
+    ``max_attempts`` counts the first attempt too, unlike botocore's own
+    max_attempts setting, which counts only the retries.
+    """
+    return Config(
+        max_pool_connections=int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '25')),
+        retries={'total_max_attempts': max_attempts, 'mode': 'standard'}
+    )
+
+
+def _get_or_create(kind: str, service_name: str, region_name: Optional[str],
+                   endpoint_url: Optional[str] = None, max_attempts: int = 4) -> Any:
+    key = (kind, service_name, region_name, endpoint_url, max_attempts)
+    instance = _clients.get(key)
+    if instance is not None:
+        return instance
+
+    with _lock:
+        instance = _clients.get(key)
+        if instance is None:
+            factory = boto3.client if kind == 'client' else boto3.resource
+            kwargs = {'config': get_client_config(max_attempts)}
+            if region_name:
+                kwargs['region_name'] = region_name
+            if endpoint_url:
+                kwargs['endpoint_url'] = endpoint_url
+            instance = factory(service_name, **kwargs)
+            _clients[key] = instance
+    return instance
+
+
+def get_client(service_name: str, region_name: Optional[str] = None,
+               endpoint_url: Optional[str] = None, max_attempts: int = 4) -> Any:
+    """Get a cached boto3 client for the given service.
+
+    Callers that retry on their own pass ``max_attempts=1`` and get a
+    separate client that makes a single attempt per call.
+    """
+    return _get_or_create('client', service_name, region_name, endpoint_url, max_attempts)
+
+
+def get_resource(service_name: str, region_name: Optional[str] = None) -> Any:
+    """Get a cached boto3 resource for the given service"""
+    return _get_or_create('resource', service_name, region_name)
+
+
+def reset_clients() -> None:
+    """Drop all cached clients, e.g. between tests that stub boto3"""
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,143 @@
+import base64
+from email.message import Message
+from typing import Dict, Iterable, Iterator, Optional
+
+# Base64 text is decoded this many characters at a time (a multiple of 4)
+DECODE_CHUNK_CHARS = 64 * 1024
+
+
+def _header_params(name: str, value: str) -> Message:
+    message = Message()
+    message[name] = value
+    return message
+
+
+def get_boundary(content_type: str) -> bytes:
+    """Get the boundary of a multipart/form-data Content-Type header"""
+    boundary = _header_params('content-type', content_type).get_param('boundary')
+    if not boundary:
+        raise ValueError('Content-Type has no multipart boundary')
+    return boundary.encode('latin-1')
+
+
+def iter_body(body: str, is_base64: bool) -> Iterator[bytes]:
+    """Yield a Lambda proxy event body as bytes, decoding a slice at a time"""
+    for start in range(0, len(body), DECODE_CHUNK_CHARS):
+        piece = body[start:start + DECODE_CHUNK_CHARS]
+        yield base64.b64decode(piece) if is_base64 else piece.encode('utf-8')
+
+
+class _Reader:
+    """Cursor over a stream of byte chunks that hands out memoryview slices"""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buf = b''
+        self._pos = 0
+
+    def _fill(self) -> None:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise ValueError('Unexpected end of multipart body')
+        # Earlier slices keep the old buffer alive, so only the unread tail is copied
+        tail = self._buf[self._pos:]
+        self._buf = tail + chunk if tail else chunk
+        self._pos = 0
+
+    def read(self, size: int) -> bytes:
+        while len(self._buf) - self._pos < size:
+            self._fill()
+        data = self._buf[self._pos:self._pos + size]
+        self._pos += size
+        return data
+
+    def read_until(self, delimiter: bytes) -> Iterator[memoryview]:
+        """Yield everything up to delimiter, then skip past it"""
+        while True:
+            index = self._buf.find(delimiter, self._pos)
+            if index >= 0:
+                if index > self._pos:
+                    yield memoryview(self._buf)[self._pos:index]
+                self._pos = index + len(delimiter)
+                return
+
+            # Hold back enough bytes to spot a delimiter split across chunks
+            safe = len(self._buf) - len(delimiter) + 1
+            if safe > self._pos:
+                yield memoryview(self._buf)[self._pos:safe]
+                self._pos = safe
+            self._fill()
+
+
+class Part:
+    """One form-data part; data must be consumed before the next part is read"""
+
+    def __init__(self, headers: Dict[str, str], data: Iterator[memoryview]):
+        self.headers = headers
+        self.data = data
+        disposition = _header_params('content-disposition', headers.get('content-disposition', ''))
+        self.name: Optional[str] = disposition.get_param('name', header='content-disposition')
+        self.filename: Optional[str] = disposition.get_param('filename', header='content-disposition')
+        self.type: str = headers.get('content-type', '')
+
+
+def _parse_headers(raw: bytes) -> Dict[str, str]:
+    headers = {}
+    for line in raw.decode('utf-8', errors='replace').split('\r\n'):
+        name, _, value = line.partition(':')
+        if value:
+            headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def iter_parts(chunks: Iterable[bytes], boundary: bytes) -> Iterator[Part]:
+    """Parse a multipart/form-data body incrementally.
+
+    Part data is yielded as memoryview slices of the incoming chunks, so
+    the parser itself holds no more than one chunk plus a delimiter's worth
+    of bytes, however large the files are.
+    """
+    reader = _Reader(chunks)
+    for _ in reader.read_until(b'--' + boundary):
+        pass  # preamble
+
+    while True:
+        if reader.read(2) == b'--':
+            return
+        headers = _parse_headers(b''.join(reader.read_until(b'\r\n\r\n')))
+        part = Part(headers, reader.read_until(b'\r\n--' + boundary))
+        yield part
+        for _ in part.data:
+            pass  # skip whatever the caller did not read
+
+
+class StreamedFile:
+    """A file field of a multipart body that is re-parsed on every read.
+
+    Exposes ``filename`` and ``type`` like ``cgi.FieldStorage`` did, but the
+    contents are only available as a stream of chunks, which can be read
+    more than once without ever buffering the whole file.
+    """
+
+    def __init__(self, body: str, is_base64: bool, boundary: bytes, part: Part):
+        self._body = body
+        self._is_base64 = is_base64
+        self._boundary = boundary
+        self.name = part.name
+        self.filename = part.filename
+        self.type = part.type
+
+    def chunks(self) -> Iterator[memoryview]:
+        for part in iter_parts(iter_body(self._body, self._is_base64), self._boundary):
+            if part.name == self.name:
+                yield from part.data
+                return
+
+
+def get_file_field(body: str, is_base64: bool, content_type: str, field_name: str = 'file') -> StreamedFile:
+    """Find a file field in a multipart/form-data event body"""
+    boundary = get_boundary(content_type)
+    for part in iter_parts(iter_body(body, is_base64), boundary):
+        if part.name == field_name and part.filename is not None:
+            return StreamedFile(body, is_base64, boundary, part)
+    raise KeyError(field_name)
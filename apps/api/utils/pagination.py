@@ -0,0 +1,46 @@
+import json
+import base64
+import binascii
+from decimal import Decimal
+from typing import Dict, Any, Optional
+
+from utils.errors import APIError
+from utils.response import DecimalEncoder
+
+
+def encode_cursor(last_evaluated_key: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Turn a DynamoDB LastEvaluatedKey into an opaque, URL-safe cursor"""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, cls=DecimalEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], expected: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Turn a cursor back into an ExclusiveStartKey.
+
+    ``expected`` holds key attributes the cursor must match, so a cursor
+    from one user's (or chat's) listing cannot be replayed against another.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')), parse_float=Decimal)
+    except (ValueError, binascii.Error):
+        raise APIError('Invalid cursor', 400)
+
+    if not isinstance(key, dict) or any(key.get(name) != value for name, value in expected.items()):
+        raise APIError('Invalid cursor', 400)
+    return key
+
+
+def parse_limit(value: Optional[str], default: int, maximum: int) -> int:
+    """Parse a ``limit`` query parameter, clamped to [1, maximum]"""
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise APIError('limit must be an integer', 400)
+    return max(1, min(limit, maximum))
@@ -0,0 +1,77 @@
+import time
+import threading
+from typing import Optional
+
+
+class CapacityLimiter:
+    """Token bucket over a consumed-capacity unit, e.g. DynamoDB RCUs or model tokens.
+
+    What a call consumes is only known once it returns, so callers wait
+    until the bucket is out of debt, make the call, then charge what it
+    cost. A negative charge refunds units charged up front. The bucket is
+    shared by every worker in the container.
+    """
+
+    def __init__(self, units_per_second: float, burst: float = None):
+        self.rate = units_per_second
+        self.burst = burst if burst is not None else units_per_second
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the bucket is out of debt; False if that takes longer than timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens > 0:
+                    return True
+                delay = -self._tokens / self.rate
+            if deadline is not None and time.monotonic() + delay > deadline:
+                return False
+            time.sleep(delay)
+
+    def charge(self, units: float) -> None:
+        with self._lock:
+            self._refill()
+            self._tokens -= units
+
+
+class AIMDLimiter:
+    """Concurrency limit that adapts to throttling (additive increase, multiplicative decrease).
+
+    Every call that succeeds raises the limit by about one per limit's worth
+    of calls; every throttled call cuts it by ``decrease``. The limit
+    settles just below the point where the backend starts pushing back.
+    """
+
+    def __init__(self, initial: float, minimum: float = 1, maximum: float = 64, decrease: float = 0.5):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.in_flight = 0
+        self._available = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Take a slot; False if none frees up within timeout"""
+        with self._available:
+            if not self._available.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, throttled: bool = False) -> None:
+        with self._available:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._available.notify_all()
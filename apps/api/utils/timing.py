@@ -0,0 +1,34 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator
+
+
+class StageTimer:
+    """Collect wall-clock durations (in ms) for the stages of a request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def timed(self, name: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run ``func`` as stage ``name``; handy for executor.submit"""
+        with self.stage(name):
+            return func(*args, **kwargs)
+
+    def mark(self, name: str) -> None:
+        """Record the time elapsed since the request started, e.g. first token"""
+        self.stages[name] = round((time.perf_counter() - self.started) * 1000, 2)
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            **self.stages,
+            'total': round((time.perf_counter() - self.started) * 1000, 2)
+        }
@@ -0,0 +1,115 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+LINE_SPLIT = re.compile(r'\n+')
+
+
+@dataclass
+class TextLine:
+    """A LINE block from Textract; top and height are page-relative"""
+    text: str
+    page: int = 1
+    top: float = 0.0
+    height: float = 0.0
+
+
+@dataclass
+class Paragraph:
+    text: str
+    page: int
+
+
+@dataclass
+class Chunk:
+    text: str
+    page: int
+    index: int
+
+
+def iter_paragraphs(lines: Iterable[TextLine], gap_ratio: float = None) -> Iterator[Paragraph]:
+    """Group consecutive lines into paragraphs.
+
+    A paragraph ends at a page break, or where the vertical gap to the next
+    line is larger than ``gap_ratio`` times that line's height.
+    """
+    gap_ratio = gap_ratio or float(os.environ.get('PARAGRAPH_GAP_RATIO', '0.8'))
+
+    current, page, previous_bottom = [], None, None
+    for line in lines:
+        text = line.text.strip()
+        if not text:
+            continue
+
+        if current and (
+            line.page != page
+            or (line.height and line.top - previous_bottom > gap_ratio * line.height)
+        ):
+            yield Paragraph(' '.join(current), page)
+            current = []
+
+        current.append(text)
+        page = line.page
+        previous_bottom = line.top + line.height
+
+    if current:
+        yield Paragraph(' '.join(current), page)
+
+
+def _split_long(text: str, size: int) -> Iterator[str]:
+    """Split text into pieces of at most size characters, preferring word boundaries"""
+    while len(text) > size:
+        cut = text.rfind(' ', 0, size)
+        if cut <= size // 2:
+            cut = size
+        yield text[:cut]
+        text = text[cut:].lstrip()
+    if text:
+        yield text
+
+
+def chunk_paragraphs(paragraphs: Iterable[Paragraph], max_chars: int = None,
+                     overlap: int = None) -> Iterator[Chunk]:
+    """Pack paragraphs into overlapping chunks of at most max_chars characters.
+
+    Paragraphs are only split when they would not fit in a chunk on their
+    own. A page break closes the current chunk once it is at least half
+    full, so chunks rarely straddle pages. Each chunk starts with the last
+    ``overlap`` characters of the previous one, except after a page break.
+    Consumes its input lazily, so it can sit on top of a streaming source.
+    """
+    max_chars = max_chars or int(os.environ.get('CHUNK_MAX_CHARS', '1500'))
+    overlap = overlap if overlap is not None else int(os.environ.get('CHUNK_OVERLAP_CHARS', '200'))
+    overlap = min(overlap, max_chars // 2)
+
+    current, chunk_page, index = '', None, 0
+    has_new_text = False
+    last_page = None
+    for paragraph in paragraphs:
+        page_break = last_page is not None and paragraph.page != last_page
+        last_page = paragraph.page
+
+        for piece in _split_long(paragraph.text, max_chars - overlap - 1):
+            full = len(current) + len(piece) + 1 > max_chars
+            if has_new_text and (full or (page_break and len(current) >= max_chars // 2)):
+                yield Chunk(current, chunk_page, index)
+                index += 1
+                current = current[-overlap:] if overlap and not page_break else ''
+                has_new_text = False
+            page_break = False
+
+            if not has_new_text:
+                chunk_page = paragraph.page
+            current = f"{current}\n{piece}" if current else piece
+            has_new_text = True
+
+    if has_new_text:
+        yield Chunk(current, chunk_page, index)
+
+
+def chunk_text(text: str, max_chars: int = None, overlap: int = None) -> Iterator[str]:
+    """Split plain text into overlapping chunks, treating each line as a paragraph"""
+    paragraphs = (Paragraph(line, 1) for line in LINE_SPLIT.split(text) if line.strip())
+    for chunk in chunk_paragraphs(paragraphs, max_chars, overlap):
+        yield chunk.text
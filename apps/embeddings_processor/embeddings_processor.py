@@ -1,12 +1,21 @@
 import json
 import boto3
+import base64
 import os
 import time
+import gzip
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+import tempfile
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from dataclasses import dataclass, field, asdict, replace
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+from chunking import TextLine, Chunk, iter_paragraphs, chunk_paragraphs
+import pdf_text
+from pipeline import prefetch
+
 # Configure logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -26,15 +35,31 @@ sns = boto3.client('sns')
 textract = boto3.client('textract')
 bedrock = boto3.client('bedrock-runtime')
 kendra = boto3.client('kendra', region_name='us-east-1')
+dynamodb = boto3.client('dynamodb')
+lambda_client = boto3.client('lambda')
 
 kendra_index_id = os.environ['KENDRA_INDEX_ID']
+# BatchPutDocument and BatchGetDocumentStatus accept at most 10 documents per call
+KENDRA_BATCH_SIZE = 10
+# Textract's synchronous APIs accept single-page documents of up to 10 MB
+SYNC_TEXTRACT_MAX_BYTES = 10 * 1024 * 1024
 logger.info(f"Using Kendra index ID: {kendra_index_id}")
 
+# Vector index segments are written to S3; their own upload events must be ignored
+vector_index_enabled = os.environ.get('VECTOR_INDEX_ENABLED', 'false').lower() == 'true'
+vector_index_prefix = os.environ.get('VECTOR_INDEX_PREFIX', 'vector-index/')
+# Extracted text is cached per document, so no file goes through OCR twice
+extracted_text_prefix = os.environ.get('EXTRACTED_TEXT_PREFIX', 'extracted-text/')
+# A rebuild step stops this long before the invocation times out and hands over
+REBUILD_STEP_MARGIN_SECONDS = 60
+
 @dataclass
 class S3Object:
     bucket: str
     key: str
     content_type: Optional[str] = None
+    size: int = 0
+    metadata: Dict[str, str] = field(default_factory=dict)
 
 def get_s3_object(bucket: str, key: str) -> S3Object:
     """Retrieve S3 object metadata."""
@@ -44,7 +69,9 @@ def get_s3_object(bucket: str, key: str) -> S3Object:
         return S3Object(
             bucket=bucket,
             key=key,
-            content_type=response.get('ContentType')
+            content_type=response.get('ContentType'),
+            size=response.get('ContentLength', 0),
+            metadata=response.get('Metadata', {})
         )
     except Exception as e:
         logger.error(f"Error retrieving S3 object metadata: {str(e)}")
@@ -56,98 +83,550 @@ def is_pdf(content_type: Optional[str]) -> bool:
     logger.info(f"File content type: {content_type}, is PDF: {is_pdf_file}")
     return is_pdf_file
 
-def extract_text_from_pdf(s3_object: S3Object) -> str:
-    """Extract text from PDF document using Amazon Textract."""
-    if not is_pdf(s3_object.content_type):
-        raise ValueError(f"File {s3_object.key} is not a PDF. Content type: {s3_object.content_type}")
-    
+def _line_from_block(block: Dict[str, Any]) -> TextLine:
+    box = block.get('Geometry', {}).get('BoundingBox', {})
+    return TextLine(
+        text=block['Text'],
+        page=block.get('Page', 1),
+        top=box.get('Top', 0.0),
+        height=box.get('Height', 0.0)
+    )
+
+def choose_extraction_tier(s3_object: S3Object) -> Tuple[str, Optional[Iterator[TextLine]]]:
+    """Pick the cheapest way to extract a PDF's text: 'local', 'sync' or 'async'.
+
+    Every page is inspected. Pages with a text layer are parsed in-process
+    ('local'); scanned pages are split out and sent one at a time to
+    synchronous Textract ('sync'), unless there are more than
+    SYNC_TEXTRACT_MAX_PAGES of them, in which case the whole file goes to an
+    asynchronous job ('async'). The lines are returned for the first two.
+
+    Larger files are probed first with a ranged GET of PDF_PROBE_BYTES, so
+    an obvious scan goes to Textract without being downloaded at all.
+    """
+    max_local_bytes = int(os.environ.get('LOCAL_PDF_MAX_BYTES', str(50 * 1024 * 1024)))
+    if pdf_text.PdfReader is None or s3_object.size > max_local_bytes:
+        return 'async', None
+
+    probe_bytes = int(os.environ.get('PDF_PROBE_BYTES', str(1024 * 1024)))
+    if s3_object.size > probe_bytes:
+        head = s3.get_object(
+            Bucket=s3_object.bucket,
+            Key=s3_object.key,
+            Range=f"bytes=0-{probe_bytes - 1}"
+        )['Body'].read()
+        if pdf_text.looks_scanned(head):
+            logger.info(f"First {probe_bytes} bytes of {s3_object.key} look like a scan")
+            return 'async', None
+        data = head + s3.get_object(
+            Bucket=s3_object.bucket,
+            Key=s3_object.key,
+            Range=f"bytes={probe_bytes}-"
+        )['Body'].read()
+    else:
+        data = s3.get_object(Bucket=s3_object.bucket, Key=s3_object.key)['Body'].read()
+    info = pdf_text.inspect_pdf(data)
+    if info is None:
+        return 'async', None
+    logger.info(f"PDF inspection for {s3_object.key}: {info.page_count} pages, scanned pages {info.scanned_pages}")
+    if info.has_text_layer:
+        return 'local', extract_pages(info, [])
+
+    max_sync_pages = int(os.environ.get('SYNC_TEXTRACT_MAX_PAGES', '20'))
+    if len(info.scanned_pages) > max_sync_pages:
+        return 'async', None
+    scans = pdf_text.split_pages(data, info.scanned_pages)
+    if any(len(scan) > SYNC_TEXTRACT_MAX_BYTES for scan in scans):
+        return 'async', None
+    return 'sync', extract_pages(info, scans)
+
+def extract_pages(info: pdf_text.PdfInfo, scans: List[bytes]) -> Iterator[TextLine]:
+    """Yield the lines of every page in order: its text layer, or Textract's reading of its scan."""
+    scanned = dict(zip(info.scanned_pages, scans))
+    for page_number, text in enumerate(info.page_texts, start=1):
+        if page_number in scanned:
+            for line in detect_text_sync(scanned[page_number]):
+                yield replace(line, page=page_number)
+        else:
+            yield from pdf_text.page_lines(text, page_number)
+
+def detect_text_sync(data: bytes) -> List[TextLine]:
+    """Extract the lines of a single-page document with synchronous Textract."""
+    response = textract.detect_document_text(Document={'Bytes': data})
+    return [_line_from_block(block) for block in response['Blocks'] if block['BlockType'] == 'LINE']
+
+def start_text_extraction(s3_object: S3Object, content_hash: Optional[str]) -> str:
+    """Start an asynchronous Textract text detection job and return its job ID.
+
+    Only LINE blocks are used downstream, so plain text detection is used
+    rather than the pricier table and form analysis. When
+    TEXTRACT_SNS_TOPIC_ARN and TEXTRACT_ROLE_ARN are set, Textract
+    announces completion on that topic and this Lambda resumes the file in
+    handle_textract_completion instead of polling. The verified content
+    hash travels with the job as its JobTag.
+    """
+    params = {
+        'DocumentLocation': {
+            'S3Object': {
+                'Bucket': s3_object.bucket,
+                'Name': s3_object.key
+            }
+        }
+    }
+    if content_hash:
+        params['JobTag'] = content_hash
+    if textract_notifications_enabled():
+        params['NotificationChannel'] = {
+            'SNSTopicArn': os.environ['TEXTRACT_SNS_TOPIC_ARN'],
+            'RoleArn': os.environ['TEXTRACT_ROLE_ARN']
+        }
+
+    logger.info(f"Starting Textract job for file: {s3_object.key}")
+    response = textract.start_document_text_detection(**params)
+    job_id = response['JobId']
+    logger.info(f"Textract job started with ID: {job_id}")
+    # Checkpoint, so a retry picks this job up instead of running OCR again
+    set_ingestion_state(document_id_for(s3_object.bucket, s3_object.key, content_hash), 'started',
+                        textractJobId=job_id)
+    return job_id
+
+def resume_text_extraction(job_id: Optional[str]) -> Optional[str]:
+    """Return the status of an earlier attempt's Textract job if its results can still be used.
+
+    None means there is nothing to resume: no job was started, it failed,
+    or Textract no longer keeps its results (they expire after 7 days).
+    """
+    if not job_id:
+        return None
     try:
-        logger.info(f"Starting Textract job for file: {s3_object.key}")
-        response = textract.start_document_analysis(
-            DocumentLocation={
-                'S3Object': {
-                    'Bucket': s3_object.bucket,
-                    'Name': s3_object.key
-                }
-            },
-            FeatureTypes=['TABLES', 'FORMS']
-        )
-        
-        job_id = response['JobId']
-        logger.info(f"Textract job started with ID: {job_id}")
-        
-        while True:
-            response = textract.get_document_analysis(JobId=job_id)
-            status = response['JobStatus']
-            logger.info(f"Textract job status: {status}")
-            
-            if status in ['SUCCEEDED', 'FAILED']:
-                break
-                
-            time.sleep(5)
-        
-        if status == 'FAILED':
-            error_msg = f"Textract job failed: {response.get('StatusMessage', 'Unknown error')}"
-            logger.error(error_msg)
-            raise Exception(error_msg)
-        
-        text_blocks = []
-        next_token = None
+        status = textract.get_document_text_detection(JobId=job_id, MaxResults=1)['JobStatus']
+    except textract.exceptions.InvalidJobIdException:
+        return None
+    return status if status in ['IN_PROGRESS', 'SUCCEEDED', 'PARTIAL_SUCCESS'] else None
+
+def textract_notifications_enabled() -> bool:
+    return bool(os.environ.get('TEXTRACT_SNS_TOPIC_ARN') and os.environ.get('TEXTRACT_ROLE_ARN'))
+
+def wait_for_text_extraction(job_id: str) -> None:
+    """Poll a Textract job until it finishes; used when no notification channel is configured."""
+    while True:
+        response = textract.get_document_text_detection(JobId=job_id, MaxResults=1)
+        status = response['JobStatus']
+        logger.info(f"Textract job status: {status}")
         
-        while True:
-            if next_token:
-                response = textract.get_document_analysis(
-                    JobId=job_id,
-                    NextToken=next_token
-                )
-            else:
-                response = textract.get_document_analysis(JobId=job_id)
-            
-            for block in response['Blocks']:
-                if block['BlockType'] == 'LINE':
-                    text_blocks.append(block['Text'])
+        if status in ['SUCCEEDED', 'FAILED', 'PARTIAL_SUCCESS']:
+            break
             
-            next_token = response.get('NextToken')
-            if not next_token:
-                break
+        time.sleep(5)
+    
+    if status == 'FAILED':
+        error_msg = f"Textract job failed: {response.get('StatusMessage', 'Unknown error')}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+def iter_extracted_pages(job_id: str, api: str = 'StartDocumentTextDetection') -> Iterator[List[TextLine]]:
+    """Yield the LINE blocks of a finished Textract job, one result page at a time."""
+    if api == 'StartDocumentAnalysis':
+        get_results = textract.get_document_analysis
+    else:
+        get_results = textract.get_document_text_detection
+
+    next_token = None
+    
+    while True:
+        if next_token:
+            response = get_results(
+                JobId=job_id,
+                NextToken=next_token
+            )
+        else:
+            response = get_results(JobId=job_id)
         
-        extracted_text = '\n'.join(text_blocks)
-        logger.info(f"Successfully extracted {len(text_blocks)} text blocks from PDF")
-        return extracted_text
+        yield [_line_from_block(block) for block in response['Blocks'] if block['BlockType'] == 'LINE']
         
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+
+def get_extracted_lines(job_id: str, api: str = 'StartDocumentTextDetection') -> Iterator[TextLine]:
+    """Stream the lines of a finished Textract job.
+
+    The next result page is fetched in the background while the current one
+    is indexed, at most TEXTRACT_PREFETCH_PAGES ahead, so memory stays flat
+    however many pages the document has.
+    """
+    depth = int(os.environ.get('TEXTRACT_PREFETCH_PAGES', '2'))
+    for page in prefetch(iter_extracted_pages(job_id, api), depth):
+        yield from page
+
+def extract_text_from_pdf(s3_object: S3Object, content_hash: Optional[str]) -> Iterator[TextLine]:
+    """Extract the text lines of a PDF document using Amazon Textract, polling for completion."""
+    try:
+        job_id = start_text_extraction(s3_object, content_hash)
+        wait_for_text_extraction(job_id)
+        return get_extracted_lines(job_id)
     except Exception as e:
         logger.error(f"Error extracting text with Textract: {str(e)}")
         raise
 
-def store_in_kendra(text: str, metadata: Dict[str, Any]) -> None:
-    """Store text in Amazon Kendra."""
+def _extracted_text_key(document_id: str) -> str:
+    return f"{extracted_text_prefix}{document_id}.jsonl.gz"
+
+def _read_cached_lines(body) -> Iterator[TextLine]:
+    with gzip.GzipFile(fileobj=body) as f:
+        for raw in f:
+            yield TextLine(**json.loads(raw))
+
+def load_extracted_lines(bucket: str, document_id: str) -> Optional[Iterator[TextLine]]:
+    """Stream the cached text lines of a previously extracted document, if there are any."""
     try:
-        # Create a unique document ID using timestamp
-        document_id = f"doc-{int(time.time())}"
-        logger.info(f"Preparing to store document in Kendra with ID: {document_id}")
-        
-        # Prepare the document for Kendra
-        document = {
-            'Id': document_id,
-            'Title': metadata.get('title', 'Untitled Document'),
-            'Blob': text.encode('utf-8')
-        }
-        
-        logger.info(f"Submitting document to Kendra index {kendra_index_id}")
-        logger.info(f"Document details: Title={document['Title']}, Size={len(text)} bytes")
-        
-        # Submit the document to Kendra
-        response = kendra.batch_put_document(
-            IndexId=kendra_index_id,
-            Documents=[document]
+        response = s3.get_object(Bucket=bucket, Key=_extracted_text_key(document_id))
+    except s3.exceptions.NoSuchKey:
+        return None
+    logger.info(f"Using cached extracted text for {document_id}")
+    return _read_cached_lines(response['Body'])
+
+def cache_extracted_lines(bucket: str, document_id: str, lines: Iterable[TextLine]) -> Iterator[TextLine]:
+    """Pass lines through while spooling them to /tmp; once they run out, upload the spool
+    as the document's text cache and checkpoint it as extracted."""
+    fd, temp_path = tempfile.mkstemp(suffix='.jsonl.gz')
+    os.close(fd)
+    try:
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            for line in lines:
+                f.write(json.dumps(asdict(line)) + '\n')
+                yield line
+        try:
+            s3.upload_file(
+                temp_path,
+                bucket,
+                _extracted_text_key(document_id),
+                ExtraArgs={'ContentType': 'application/gzip'}
+            )
+            set_ingestion_state(document_id, 'extracted')
+        except Exception as e:
+            # The cache is only an optimisation, so indexing carries on without it
+            logger.error(f"Error caching extracted text for {document_id}: {str(e)}")
+    finally:
+        os.remove(temp_path)
+
+def index_new_text(bucket: str, key: str, lines: Iterable[TextLine], content_hash: Optional[str]) -> Dict[str, Any]:
+    """Index freshly extracted lines as they stream in, checkpointing them on the way.
+
+    The lines are spooled while they are indexed, so Kendra and the
+    embeddings start on the first Textract page. If indexing stops early
+    (it failed, or there is no one to notify), the remaining lines are
+    still read into the spool, so a retry reindexes the cached text
+    instead of extracting it again.
+    """
+    document_id = document_id_for(bucket, key, content_hash)
+    spooled = cache_extracted_lines(bucket, document_id, lines)
+    try:
+        return index_extracted_text(bucket, key, spooled, content_hash)
+    finally:
+        try:
+            for _ in spooled:
+                pass
+        except Exception as e:
+            logger.error(f"Error reading the rest of the extracted text for {document_id}: {str(e)}")
+
+def get_ingestion_state(document_id: str) -> Dict[str, str]:
+    """Read the checkpoints earlier attempts left for a document.
+
+    Ingestion state shares the documents table with the dedup entries,
+    keyed on the document ID, which never collides with a content hash, so
+    uploads without a content hash are checkpointed too. The status moves
+    from started (Textract job running, textractJobId set) to extracted
+    (text cached in S3) to indexed (documentId set), or to failed;
+    checkpoints from earlier stages are kept when a later one fails.
+    """
+    table_name = os.environ.get('DOCUMENTS_TABLE')
+    if not table_name:
+        return {}
+    try:
+        response = dynamodb.get_item(
+            TableName=table_name,
+            Key={'contentHash': {'S': document_id}},
+            ConsistentRead=True,
+            ProjectionExpression='#status, textractJobId, documentId',
+            ExpressionAttributeNames={'#status': 'status'}
         )
-        
-        logger.info(f"Kendra batch_put_document response: {json.dumps(response)}")
+    except Exception as e:
+        logger.error(f"Error reading ingestion state of {document_id}: {str(e)}")
+        return {}
+    return {name: value['S'] for name, value in response.get('Item', {}).items()}
+
+def set_ingestion_state(document_id: str, status: str, **attributes: str) -> None:
+    """Checkpoint a document's ingestion stage, plus attributes such as its Textract job."""
+    _set_status(document_id, status, attributes)
+
+def set_document_status(content_hash: Optional[str], status: str, **attributes: str) -> None:
+    """Record the processing outcome on the content's entry in the dedup table."""
+    if content_hash:
+        _set_status(content_hash, status, attributes)
+
+def _set_status(item_key: str, status: str, attributes: Dict[str, str]) -> None:
+    table_name = os.environ.get('DOCUMENTS_TABLE')
+    if not table_name:
+        return
+
+    update_expression = 'SET #status = :status'
+    values = {':status': {'S': status}}
+    for name, value in attributes.items():
+        update_expression += f", {name} = :{name}"
+        values[f":{name}"] = {'S': value}
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'contentHash': {'S': item_key}},
+            UpdateExpression=update_expression,
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues=values
+        )
+    except Exception as e:
+        logger.error(f"Error updating status of {item_key}: {str(e)}")
+
+def _put_kendra_batch(documents: List[Dict[str, Any]]) -> None:
+    response = kendra.batch_put_document(
+        IndexId=kendra_index_id,
+        Documents=documents
+    )
+    failed = response.get('FailedDocuments', [])
+    if failed:
+        raise Exception(f"Kendra rejected {len(failed)} documents: {json.dumps(failed)}")
+
+def wait_until_indexed(document_ids: List[str]) -> bool:
+    """Poll Kendra until the documents are searchable, for up to KENDRA_INDEX_WAIT_SECONDS.
+
+    BatchPutDocument only queues documents for indexing. Returns False if
+    some are still being indexed when the wait runs out; raises if Kendra
+    failed to index any of them.
+    """
+    deadline = time.time() + float(os.environ.get('KENDRA_INDEX_WAIT_SECONDS', '120'))
+    interval = float(os.environ.get('KENDRA_STATUS_POLL_SECONDS', '5'))
+    pending = list(document_ids)
+    while True:
+        processing = []
+        for start in range(0, len(pending), KENDRA_BATCH_SIZE):
+            response = kendra.batch_get_document_status(
+                IndexId=kendra_index_id,
+                DocumentInfoList=[{'DocumentId': doc_id} for doc_id in pending[start:start + KENDRA_BATCH_SIZE]]
+            )
+            for status in response.get('DocumentStatusList', []):
+                if status['DocumentStatus'] in ('FAILED', 'UPDATE_FAILED'):
+                    raise Exception(f"Kendra failed to index {status['DocumentId']}: {status.get('FailureReason')}")
+                if status['DocumentStatus'] not in ('INDEXED', 'UPDATED'):
+                    processing.append(status['DocumentId'])
+            processing.extend(error['DocumentId'] for error in response.get('Errors', []))
+
+        pending = processing
+        if not pending:
+            return True
+        if time.time() + interval > deadline:
+            logger.warning(f"{len(pending)} of {len(document_ids)} Kendra documents still indexing, giving up waiting")
+            return False
+        time.sleep(interval)
+
+def store_in_kendra(chunks: Iterable[Chunk], metadata: Dict[str, Any],
+                    document_id: str, source_uri: str) -> int:
+    """Store document chunks in Amazon Kendra, one Kendra document per chunk.
+
+    Chunks get IDs derived from the parent document ID and share the parent's
+    S3 URI in the reserved _source_uri attribute, so results can be traced
+    back to (and grouped by) the uploaded file.
+
+    Kendra indexes asynchronously, so the retrieval cache is only
+    invalidated once the chunks are reported indexed (or the wait runs
+    out); bumping any earlier would let stale results be cached again.
+    """
+    try:
+        title = metadata.get('title') or metadata.get('original_filename', 'Untitled Document')
+        logger.info(f"Submitting chunks of {document_id} to Kendra index {kendra_index_id}, Title={title}")
+
+        batch = []
+        doc_ids = []
+        for chunk in chunks:
+            batch.append({
+                'Id': f"{document_id}-chunk-{chunk.index:05d}",
+                'Title': title,
+                'Blob': chunk.text.encode('utf-8'),
+                'ContentType': 'PLAIN_TEXT',
+                'Attributes': [
+                    {'Key': '_source_uri', 'Value': {'StringValue': source_uri}},
+                    {'Key': '_excerpt_page_number', 'Value': {'LongValue': chunk.page}}
+                ]
+            })
+            if len(batch) == KENDRA_BATCH_SIZE:
+                _put_kendra_batch(batch)
+                doc_ids.extend(doc['Id'] for doc in batch)
+                batch = []
+
+        if batch:
+            _put_kendra_batch(batch)
+            doc_ids.extend(doc['Id'] for doc in batch)
+
+        logger.info(f"Stored {len(doc_ids)} chunks of {document_id} in Kendra")
+        if doc_ids and wait_until_indexed(doc_ids):
+            logger.info(f"Kendra finished indexing {document_id}")
+        bump_index_version()
+        return len(doc_ids)
             
     except Exception as e:
         logger.error(f"Error storing in Kendra: {str(e)}")
         raise
 
+def open_vector_segment(bucket: str, document_id: str, metadata: Dict[str, Any]):
+    """Start a segment of the local vector index for the document, if the index is enabled.
+
+    The segment is named after the document ID, like the Kendra documents,
+    so reindexing the same content replaces its segment.
+    """
+    if not vector_index_enabled:
+        return None
+
+    # Only import numpy once a segment is actually written
+    from embedders import get_embedder
+    from vector_store import SegmentWriter
+
+    title = metadata.get('original_filename') or metadata.get('title', 'Untitled Document')
+    return SegmentWriter(s3, os.environ.get('VECTOR_INDEX_BUCKET', bucket), get_embedder(bedrock), document_id, title)
+
+def document_id_for(bucket: str, key: str, content_hash: Optional[str]) -> str:
+    """Derive the Kendra document ID from the content, so re-indexing a file overwrites its own documents."""
+    source = content_hash or hashlib.sha256(f"{bucket}/{key}".encode('utf-8')).hexdigest()
+    return f"doc-{source}"
+
+def verified_content_hash(s3_object: S3Object) -> Optional[str]:
+    """Return the SHA-256 the file can be deduplicated on, if it has one.
+
+    Uploads through the API were hashed by the API itself (content_hash).
+    The hash a browser claimed for a direct upload (claimed_content_hash)
+    is checked first: against the SHA-256 checksum S3 verified for a
+    presigned POST, or else by hashing the object as it streams from S3.
+    If the claim is wrong, the actual hash is used.
+    """
+    if s3_object.metadata.get('content_hash'):
+        return s3_object.metadata['content_hash']
+    claimed = s3_object.metadata.get('claimed_content_hash')
+    if not claimed:
+        return None
+
+    response = s3.head_object(Bucket=s3_object.bucket, Key=s3_object.key, ChecksumMode='ENABLED')
+    checksum = response.get('ChecksumSHA256')
+    # Multipart uploads only carry a checksum of their part checksums ("<base64>-<parts>")
+    if checksum and '-' not in checksum:
+        actual = base64.b64decode(checksum).hex()
+    else:
+        digest = hashlib.sha256()
+        for chunk in s3.get_object(Bucket=s3_object.bucket, Key=s3_object.key)['Body'].iter_chunks(1024 * 1024):
+            digest.update(chunk)
+        actual = digest.hexdigest()
+
+    if actual != claimed:
+        logger.warning(f"Claimed content hash {claimed} of {s3_object.key} does not match its content {actual}")
+    return actual
+
+def claim_direct_upload(content_hash: str, s3_object: S3Object) -> Optional[Dict[str, str]]:
+    """Register a direct upload in the dedup table under its verified content hash.
+
+    The counterpart of the API's claim for uploads it hashed itself.
+    Returns None if this upload holds the content (it claimed it now, or an
+    earlier attempt at it did), otherwise the existing document's entry,
+    after recording the uploader on it.
+    """
+    table_name = os.environ.get('DOCUMENTS_TABLE')
+    if not table_name:
+        return None
+
+    now = datetime.utcnow().isoformat()
+    owner = s3_object.metadata.get('user_email')
+    values = {':key': {'S': s3_object.key}, ':now': {'S': now}, ':one': {'N': '1'}}
+    owners = ''
+    if owner:
+        owners = ', owners :owner'
+        values[':owner'] = {'SS': [owner]}
+
+    try:
+        dynamodb.update_item(
+            TableName=table_name,
+            Key={'contentHash': {'S': content_hash}},
+            UpdateExpression=(
+                'SET s3Key = :key, originalFilename = :filename, #status = :uploaded, '
+                'createdAt = if_not_exists(createdAt, :now), lastUploadedAt = :now '
+                f"REMOVE pendingUntil ADD uploadCount :one{owners}"
+            ),
+            ConditionExpression=(
+                'attribute_not_exists(contentHash) OR #status = :failed '
+                'OR (#status = :pending AND pendingUntil < :epoch)'
+            ),
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                **values,
+                ':filename': {'S': s3_object.metadata.get('original_filename', s3_object.key)},
+                ':uploaded': {'S': 'uploaded'},
+                ':failed': {'S': 'failed'},
+                ':pending': {'S': 'pending'},
+                ':epoch': {'N': str(int(time.time()))}
+            }
+        )
+        return None
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        pass
+
+    try:
+        response = dynamodb.update_item(
+            TableName=table_name,
+            Key={'contentHash': {'S': content_hash}},
+            UpdateExpression=f"SET lastUploadedAt = :now ADD uploadCount :one{owners}",
+            ConditionExpression='s3Key <> :key',
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW'
+        )
+    except dynamodb.exceptions.ConditionalCheckFailedException:
+        return None
+    return {name: value['S'] for name, value in response['Attributes'].items() if 'S' in value}
+
+def skip_duplicate_upload(s3_object: S3Object, existing: Dict[str, str]) -> Dict[str, Any]:
+    """Remove a direct upload of content that is already in the knowledge base and tell the uploader."""
+    logger.info(f"{s3_object.key} duplicates {existing.get('s3Key')} ({existing.get('status')}), removing it")
+    s3.delete_object(Bucket=s3_object.bucket, Key=s3_object.key)
+
+    message = {
+        'status': 'success',
+        'message': f"File is already in the knowledge base: {s3_object.key}",
+        'duplicate': True,
+        'original_filename': s3_object.metadata.get('original_filename', s3_object.key),
+        'document_id': existing.get('documentId')
+    }
+    user_email = s3_object.metadata.get('user_email')
+    if user_email:
+        message['user_email'] = user_email
+        send_notification(
+            subject="File Processing Completed",
+            message=json.dumps(message)
+        )
+    return {
+        'statusCode': 200,
+        'body': json.dumps(message)
+    }
+
+def bump_index_version() -> None:
+    """Invalidate cached retrieval results in the API by bumping the index version."""
+    table_name = os.environ.get('RETRIEVAL_CACHE_TABLE')
+    if not table_name:
+        return
+    try:
+        response = dynamodb.update_item(
+            TableName=table_name,
+            Key={'cacheKey': {'S': '__index_version__'}},
+            UpdateExpression='ADD version :one',
+            ExpressionAttributeValues={':one': {'N': '1'}},
+            ReturnValues='UPDATED_NEW'
+        )
+        logger.info(f"Retrieval index version bumped to {response['Attributes']['version']['N']}")
+    except Exception as e:
+        logger.error(f"Error bumping retrieval index version: {str(e)}")
+
 def send_notification(subject: str, message: str) -> None:
     """Send a notification to SNS topic."""
     try:
@@ -160,8 +639,148 @@ def send_notification(subject: str, message: str) -> None:
     except Exception as e:
         logger.error(f"Error sending notification: {str(e)}")
 
+def get_object_metadata(bucket: str, key: str) -> Dict[str, Any]:
+    """Get the user metadata stored with an uploaded file."""
+    try:
+        response = s3.head_object(Bucket=bucket, Key=key)
+        return response.get('Metadata', {})
+    except Exception as e:
+        logger.error(f"Error retrieving S3 object metadata: {str(e)}")
+        return {}
+
+def notify_failure(bucket: str, key: str, error_message: str, content_hash: Optional[str] = None) -> None:
+    """Mark the file's content failed and send the error notification, if there is anyone to notify.
+
+    Callers re-raise afterwards either way, so the message is retried.
+    """
+    metadata = get_object_metadata(bucket, key)
+    content_hash = content_hash or metadata.get('content_hash')
+    # Lets the next upload of the same content be processed again
+    set_document_status(content_hash, 'failed')
+    set_ingestion_state(document_id_for(bucket, key, content_hash), 'failed')
+    
+    # Get user email from metadata for error notification
+    user_email = metadata.get('user_email')
+    if not user_email:
+        logger.warning(f"No user_email found in metadata for error notification for file {key}")
+        return
+    
+    # Send error notification to SNS
+    error_notification = {
+        'status': 'error',
+        'message': error_message,
+        'user_email': user_email,
+        'original_filename': metadata.get('original_filename', key)
+    }
+    
+    send_notification(
+        subject="File Processing Failed",
+        message=json.dumps(error_notification)
+    )
+
+def index_extracted_text(bucket: str, key: str, lines: Iterable[TextLine],
+                         content_hash: Optional[str]) -> Dict[str, Any]:
+    """Second half of processing a file: index the extracted text and notify the uploader.
+
+    Lines are consumed as a stream: they flow through the paragraph and
+    chunk generators into Kendra batches and the vector segment writer,
+    so the document's full text is never held in memory at once.
+    """
+    # Get object metadata from S3
+    metadata = get_object_metadata(bucket, key)
+    
+    # Log metadata for debugging
+    logger.info(f"S3 object metadata: {json.dumps(metadata)}")
+    
+    # Extract filename from the key (remove path if present)
+    filename = key.split('/')[-1]
+    
+    # Get user email from metadata, log if not found
+    user_email = metadata.get('user_email')
+    if not user_email:
+        logger.warning(f"No user_email found in metadata for file {key}")
+        # Don't send notification if no user email
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'status': 'success',
+                'message': f"Successfully processed file: {key}",
+                'note': 'No notification sent - missing user email'
+            })
+        }
+    
+    document_id = document_id_for(bucket, key, content_hash)
+    segment = open_vector_segment(bucket, document_id, metadata)
+    extracted = {'lines': 0, 'characters': 0}
+
+    def counted(lines: Iterable[TextLine]) -> Iterator[TextLine]:
+        for line in lines:
+            extracted['lines'] += 1
+            extracted['characters'] += len(line.text)
+            yield line
+
+    def copied_to_segment(chunks: Iterable[Chunk]) -> Iterator[Chunk]:
+        for chunk in chunks:
+            if segment:
+                segment.add(chunk.text)
+            yield chunk
+
+    chunks = copied_to_segment(chunk_paragraphs(iter_paragraphs(counted(lines))))
+    try:
+        store_in_kendra(chunks, metadata, document_id, f"s3://{bucket}/{key}")
+    except Exception:
+        if segment:
+            # Drop the chunks spooled so far; warm containers keep /tmp
+            segment.close()
+        raise
+    logger.info(f"Successfully extracted {extracted['lines']} lines, {extracted['characters']} characters")
+    logger.info(f"Successfully stored document in Kendra: {filename}")
+
+    if segment:
+        try:
+            segment.finish()
+            bump_index_version()
+        except Exception as e:
+            logger.error(f"Error storing in vector index: {str(e)}")
+            raise
+
+    set_ingestion_state(document_id, 'indexed', documentId=document_id)
+    set_document_status(content_hash, 'indexed', documentId=document_id)
+
+    # Send success notification to SNS
+    success_message = {
+        'status': 'success',
+        'message': f"Successfully processed file: {key}",
+        'user_email': user_email,
+        'original_filename': metadata.get('original_filename', filename),
+        'document_id': document_id
+    }
+    
+    send_notification(
+        subject="File Processing Completed",
+        message=json.dumps(success_message)
+    )
+    
+    return {
+        'statusCode': 200,
+        'body': json.dumps(success_message)
+    }
+
 def process_file(bucket: str, key: str) -> Dict[str, Any]:
-    """Process a single file: extract text and store in Kendra."""
+    """Process a single file: extract text and store in Kendra.
+
+    With Textract notifications enabled this only starts the Textract job;
+    the file is finished by handle_textract_completion.
+
+    Retries (SQS redelivery, the Step Functions Retry block) resume from
+    the last checkpoint: an indexed file is skipped, cached text is
+    reindexed, and a Textract job started by an earlier attempt is reused
+    instead of running OCR again.
+
+    A direct upload is only deduplicated once its claimed content hash has
+    been verified; a duplicate is removed without being processed.
+    """
+    content_hash = None
     try:
         logger.info(f"Starting to process file: {key} from bucket: {bucket}")
         send_notification(
@@ -170,131 +789,221 @@ def process_file(bucket: str, key: str) -> Dict[str, Any]:
         )
         
         s3_object = get_s3_object(bucket, key)
+        if not is_pdf(s3_object.content_type):
+            raise ValueError(f"File {key} is not a PDF. Content type: {s3_object.content_type}")
 
-        text = extract_text_from_pdf(s3_object)
-        logger.info(f"Successfully extracted text from PDF, length: {len(text)} characters")
-        
-        # Get object metadata from S3
-        response = s3.head_object(Bucket=bucket, Key=key)
-        metadata = response.get('Metadata', {})
-        
-        # Log metadata for debugging
-        logger.info(f"S3 object metadata: {json.dumps(metadata)}")
-        
-        # Extract filename from the key (remove path if present)
-        filename = key.split('/')[-1]
-        
-        # Get user email from metadata, log if not found
-        user_email = metadata.get('user_email')
-        if not user_email:
-            logger.warning(f"No user_email found in metadata for file {key}")
-            # Don't send notification if no user email
+        content_hash = verified_content_hash(s3_object)
+        if content_hash and not s3_object.metadata.get('content_hash'):
+            existing = claim_direct_upload(content_hash, s3_object)
+            if existing:
+                return skip_duplicate_upload(s3_object, existing)
+
+        document_id = document_id_for(bucket, key, content_hash)
+        state = get_ingestion_state(document_id)
+        if state.get('status') == 'indexed':
+            logger.info(f"Skipping {key}, already indexed as {state.get('documentId')}")
             return {
                 'statusCode': 200,
                 'body': json.dumps({
                     'status': 'success',
-                    'message': f"Successfully processed file: {key}",
-                    'note': 'No notification sent - missing user email'
+                    'message': f"File already processed: {key}",
+                    'document_id': state.get('documentId')
                 })
             }
-        
-        store_in_kendra(text, metadata)
-        logger.info(f"Successfully stored document in Kendra: {filename}")
-
-        # Send success notification to SNS
-        success_message = {
-            'status': 'success',
-            'message': f"Successfully processed file: {key}",
-            'user_email': user_email,
-            'original_filename': metadata.get('original_filename', filename),
-            'document_id': f"doc-{int(time.time())}"
-        }
-        
-        send_notification(
-            subject="File Processing Completed",
-            message=json.dumps(success_message)
-        )
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps(success_message)
-        }
-    except Exception as e:
-        error_message = f"Error processing file {key}: {str(e)}"
-        logger.error(error_message)
-        
-        # Get user email from metadata for error notification
-        user_email = metadata.get('user_email')
-        if not user_email:
-            logger.warning(f"No user_email found in metadata for error notification for file {key}")
+
+        cached_lines = load_extracted_lines(bucket, document_id)
+        if cached_lines is not None:
+            return index_extracted_text(bucket, key, cached_lines, content_hash)
+
+        job_id = state.get('textractJobId')
+        job_status = resume_text_extraction(job_id)
+        if job_status == 'IN_PROGRESS' and textract_notifications_enabled():
+            logger.info(f"Textract job {job_id} for {key} is still running, waiting for its notification")
             return {
-                'statusCode': 500,
+                'statusCode': 202,
                 'body': json.dumps({
-                    'status': 'error',
-                    'message': error_message,
-                    'note': 'No notification sent - missing user email'
+                    'status': 'extracting',
+                    'message': f"Text extraction already running for file: {key}",
+                    'job_id': job_id
                 })
             }
+        if job_status:
+            logger.info(f"Resuming {key} from Textract job {job_id} ({job_status})")
+            if job_status == 'IN_PROGRESS':
+                wait_for_text_extraction(job_id)
+            return index_new_text(bucket, key, get_extracted_lines(job_id), content_hash)
+
+        started = time.time()
+        tier, lines = choose_extraction_tier(s3_object)
+        logger.info(f"Using {tier} text extraction for {key} ({s3_object.size} bytes)")
+
+        if tier == 'async':
+            if textract_notifications_enabled():
+                job_id = start_text_extraction(s3_object, content_hash)
+                return {
+                    'statusCode': 202,
+                    'body': json.dumps({
+                        'status': 'extracting',
+                        'message': f"Started text extraction for file: {key}",
+                        'job_id': job_id
+                    })
+                }
+            lines = extract_text_from_pdf(s3_object, content_hash)
+
+        logger.info(f"Text extraction for {key} with {tier} tier ready in {time.time() - started:.2f}s")
+        return index_new_text(bucket, key, lines, content_hash)
+    except Exception as e:
+        error_message = f"Error processing file {key}: {str(e)}"
+        logger.error(error_message)
         
-        # Send error notification to SNS
-        error_notification = {
-            'status': 'error',
-            'message': error_message,
-            'user_email': user_email,
-            'original_filename': metadata.get('original_filename', key)
-        }
-        
-        send_notification(
-            subject="File Processing Failed",
-            message=json.dumps(error_notification)
-        )
+        notify_failure(bucket, key, error_message, content_hash)
+        raise
+
+def handle_textract_completion(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Resume processing a file once Textract reports that its job has finished."""
+    job_id = message['JobId']
+    status = message['Status']
+    bucket = message['DocumentLocation']['S3Bucket']
+    key = message['DocumentLocation']['S3ObjectName']
+    logger.info(f"Textract job {job_id} for {key} finished with status {status}")
+    # Verified when the job was started; uploads through the API also carry it as metadata
+    content_hash = message.get('JobTag') or get_object_metadata(bucket, key).get('content_hash')
+
+    try:
+        if status not in ['SUCCEEDED', 'PARTIAL_SUCCESS']:
+            raise Exception(f"Textract job failed with status {status}")
+
+        lines = get_extracted_lines(job_id, message.get('API', 'StartDocumentTextDetection'))
+        return index_new_text(bucket, key, lines, content_hash)
+    except Exception as e:
+        error_message = f"Error processing file {key}: {str(e)}"
+        logger.error(error_message)
         
+        notify_failure(bucket, key, error_message, content_hash)
         raise
 
+def get_files_from_record(record: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Return the (bucket, key) pairs announced by an SQS record carrying an S3 event."""
+    attributes = record.get('messageAttributes', {})
+    if attributes.get('eventType', {}).get('stringValue') != 'S3Event':
+        logger.info("Skipping non-S3 event message")
+        return []
+
+    try:
+        message_body = json.loads(record['body'])
+    except json.JSONDecodeError as e:
+        logger.error(f"Failed to parse S3 event message body: {str(e)}")
+        return []
+    logger.info(f"Processing S3 event: {json.dumps(message_body)}")
+
+    files = []
+    for s3_record in message_body.get('Records', []):
+        if 's3' in s3_record:
+            bucket = s3_record['s3']['bucket']['name']
+            key = s3_record['s3']['object']['key']
+            if key.startswith(vector_index_prefix):
+                logger.info(f"Skipping vector index segment: {key}")
+                continue
+            if key.startswith(extracted_text_prefix):
+                logger.info(f"Skipping extracted text cache: {key}")
+                continue
+            files.append((bucket, key))
+    return files
+
+def rebuild_ivf_step(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Run one step of an IVF rebuild and hand the rest to a new invocation.
+
+    Each step repartitions segments until REBUILD_STEP_MARGIN_SECONDS
+    before the invocation times out, then invokes this function again
+    with the version and the last segment done, so a rebuild is not bound
+    by one Lambda's timeout however many segments there are.
+    """
+    from vector_store import rebuild_ivf
+
+    deadline = None
+    if context is not None:
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - REBUILD_STEP_MARGIN_SECONDS
+    result = rebuild_ivf(
+        s3, os.environ.get('VECTOR_INDEX_BUCKET', os.environ['S3_BUCKET_NAME']),
+        event.get('version'), event.get('start_after', ''), deadline
+    )
+    if result['done']:
+        bump_index_version()
+    else:
+        lambda_client.invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({
+                'action': 'rebuild_ivf',
+                'version': result['version'],
+                'start_after': result['start_after']
+            }).encode('utf-8')
+        )
+    return {
+        'statusCode': 200,
+        'body': json.dumps(result)
+    }
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
-    """Process messages from SQS queue."""
+    """Process messages from SQS queue.
+
+    All files in the batch are processed concurrently on a bounded pool
+    (PROCESSING_WORKERS). Messages with a failed file are reported back as
+    batchItemFailures, so SQS only redelivers those.
+    """
     logger.info("Lambda handler started")
     logger.info(f"Received event: {json.dumps(event)}")
     
     try:
-        # Process each record from SQS
-        if 'Records' in event:
-            logger.info(f"Found {len(event['Records'])} records to process")
-            for record in event['Records']:
-                logger.info(f"Processing record: {json.dumps(record)}")
-                
-                # Check if this is an S3 event (has MessageAttributes)
-                if 'messageAttributes' in record and 'eventType' in record['messageAttributes']:
-                    event_type = record['messageAttributes']['eventType']['stringValue']
-                    if event_type == 'S3Event':
-                        # This is our S3 event, process it directly
-                        try:
-                            message_body = json.loads(record['body'])
-                            logger.info(f"Processing S3 event: {json.dumps(message_body)}")
-                            
-                            if 'Records' in message_body:
-                                for s3_record in message_body['Records']:
-                                    if 's3' in s3_record:
-                                        bucket = s3_record['s3']['bucket']['name']
-                                        key = s3_record['s3']['object']['key']
-                                        logger.info(f"Processing file from bucket: {bucket}, key: {key}")
-                                        
-                                        result = process_file(bucket, key)
-                                        return result
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Failed to parse S3 event message body: {str(e)}")
-                            continue
-                else:
-                    logger.info("Skipping non-S3 event message")
-                    continue
-        else:
+        # Maintenance action, e.g. from the schedule or a manual invoke
+        if event.get('action') == 'rebuild_ivf':
+            return rebuild_ivf_step(event, context)
+
+        if 'Records' not in event:
             logger.warning(f"Unexpected event format: {event}")
             return {
                 'statusCode': 400,
                 'body': 'Invalid event format'
             }
+
+        records = event['Records']
+        logger.info(f"Found {len(records)} records to process")
+
+        # Textract job completions published to the notification channel;
+        # SNS delivers them one per invocation and retries on error
+        if records[0].get('EventSource') == 'aws:sns':
+            results = [handle_textract_completion(json.loads(record['Sns']['Message'])) for record in records]
+            return results[-1]
+
+        tasks = [
+            (record['messageId'], bucket, key)
+            for record in records
+            for bucket, key in get_files_from_record(record)
+        ]
+        failed_message_ids = set()
+        if tasks:
+            max_workers = min(len(tasks), int(os.environ.get('PROCESSING_WORKERS', '4')))
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = {
+                    pool.submit(process_file, bucket, key): (message_id, key)
+                    for message_id, bucket, key in tasks
+                }
+                for future in as_completed(futures):
+                    message_id, key = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to process {key} from message {message_id}: {str(e)}")
+                        failed_message_ids.add(message_id)
+
+        logger.info(f"Processed {len(tasks)} files from {len(records)} records, {len(failed_message_ids)} records failed")
+        return {
+            'batchItemFailures': [
+                {'itemIdentifier': message_id} for message_id in sorted(failed_message_ids)
+            ]
+        }
         
     except Exception as e:
         logger.error(f"Error in lambda_handler: {str(e)}")
         logger.error(f"Event that caused error: {json.dumps(event)}")
-        raise 
\ No newline at end of file
+        raise
@@ -0,0 +1,49 @@
+"""
+Inverted-file (IVF) partitioning for the vector index.
+
+Vectors are clustered around ``nlist`` centroids with spherical k-means.
+Each segment stores its rows grouped by nearest centroid, so a search only
+has to score the rows in the ``nprobe`` lists closest to the query.
+"""
+import numpy as np
+
+from embedders import normalize_rows
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 65536) -> np.ndarray:
+    """Return the index of the nearest centroid for every row"""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = vectors[start:start + block_rows]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def train_centroids(vectors: np.ndarray, nlist: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Cluster unit-length vectors into nlist unit-length centroids"""
+    rng = np.random.default_rng(seed)
+    nlist = max(1, min(nlist, len(vectors)))
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        if empty.any():
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+def partition(vectors: np.ndarray, centroids: np.ndarray):
+    """Order rows by list and return (row order, list offsets).
+
+    Rows of list ``l`` end up at ``offsets[l]:offsets[l + 1]`` once the
+    vectors are reordered with ``order``.
+    """
+    assignments = assign(vectors, centroids)
+    order = np.argsort(assignments, kind='stable')
+    offsets = np.searchsorted(assignments[order], np.arange(len(centroids) + 1))
+    return order, offsets
@@ -0,0 +1,98 @@
+"""
+Local text extraction for PDFs that already carry a text layer.
+
+pypdf is optional: without it every PDF is sent to Textract.
+"""
+import io
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from chunking import TextLine
+
+logger = logging.getLogger()
+
+try:
+    from pypdf import PdfReader, PdfWriter
+except ImportError:
+    PdfReader = PdfWriter = None
+
+
+@dataclass
+class PdfInfo:
+    page_count: int
+    # Text layer of each page, and the (1-based) pages that need OCR instead
+    page_texts: List[str]
+    scanned_pages: List[int]
+
+    @property
+    def has_text_layer(self) -> bool:
+        return not self.scanned_pages
+
+
+def looks_scanned(head: bytes) -> bool:
+    """Guess from the first bytes of a PDF whether it is an image-only scan.
+
+    Only trusted when the objects are stored uncompressed: a scan then shows
+    image XObjects but no /Font resource. With object streams the markers
+    are hidden, so the answer is False and the caller inspects the full file.
+    """
+    return b'/ObjStm' not in head and b'/Font' not in head and b'/Image' in head
+
+
+def _has_images(page) -> bool:
+    resources = page.get('/Resources')
+    xobjects = resources.get_object().get('/XObject') if resources is not None else None
+    if not xobjects:
+        return False
+    return any(xobject.get_object().get('/Subtype') == '/Image' for xobject in xobjects.get_object().values())
+
+
+def inspect_pdf(data: bytes, min_chars_per_page: int = 100) -> Optional[PdfInfo]:
+    """Read the text layer of every page and find the pages that need OCR.
+
+    A page needs OCR when it has an image but less than min_chars_per_page
+    characters of text; pages without images (blank or title pages) are
+    taken as they are. Returns None when the PDF cannot be parsed locally.
+    """
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(data))
+        page_texts, scanned_pages = [], []
+        for page_number, page in enumerate(reader.pages, start=1):
+            text = page.extract_text() or ''
+            page_texts.append(text)
+            if len(text.strip()) < min_chars_per_page and _has_images(page):
+                scanned_pages.append(page_number)
+        return PdfInfo(page_count=len(page_texts), page_texts=page_texts, scanned_pages=scanned_pages)
+    except Exception as e:
+        logger.warning(f"Could not inspect PDF locally: {str(e)}")
+        return None
+
+
+def page_lines(text: str, page_number: int) -> List[TextLine]:
+    """Turn a page's text layer into lines.
+
+    There is no geometry, so lines are given unit height on a synthetic
+    grid and blank lines leave a one-line gap, which iter_paragraphs reads
+    as a paragraph break.
+    """
+    lines = []
+    for row, line in enumerate(text.splitlines()):
+        if line.strip():
+            lines.append(TextLine(text=line, page=page_number, top=float(row), height=1.0))
+    return lines
+
+
+def split_pages(data: bytes, page_numbers: List[int]) -> List[bytes]:
+    """Copy each of the given (1-based) pages into a single-page PDF of its own"""
+    reader = PdfReader(io.BytesIO(data))
+    documents = []
+    for page_number in page_numbers:
+        writer = PdfWriter()
+        writer.add_page(reader.pages[page_number - 1])
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        documents.append(buffer.getvalue())
+    return documents
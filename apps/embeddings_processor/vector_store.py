@@ -0,0 +1,284 @@
+import io
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import tempfile
+from typing import Dict, Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from embedders import Embedder
+from ivf import partition, train_centroids
+
+logger = logging.getLogger()
+
+VECTOR_INDEX_PREFIX = os.environ.get('VECTOR_INDEX_PREFIX', 'vector-index/')
+IVF_PREFIX = f"{VECTOR_INDEX_PREFIX}_ivf/"
+# Vectors are copied into the uploaded .npy this many bytes at a time
+COPY_BLOCK_BYTES = 8 * 1024 * 1024
+
+
+def _save_npy(s3, bucket: str, key: str, array: np.ndarray, metadata: Dict[str, str] = None) -> None:
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(array, dtype=np.float32))
+    s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), Metadata=metadata or {})
+
+
+def _load_npy(s3, bucket: str, key: str) -> np.ndarray:
+    return np.load(io.BytesIO(s3.get_object(Bucket=bucket, Key=key)['Body'].read()))
+
+
+def _load_segment_files(s3, bucket: str, key: str) -> Tuple[Dict[str, Any], np.ndarray]:
+    """Read a segment's metadata and vectors, refusing a pair from different writes"""
+    metadata = json.loads(s3.get_object(Bucket=bucket, Key=f"{key}.json")['Body'].read())
+    response = s3.get_object(Bucket=bucket, Key=f"{key}.npy")
+    revision = response.get('Metadata', {}).get('revision')
+    if revision != metadata.get('revision'):
+        raise ValueError(f"Segment {key} is being rewritten (.npy {revision}, .json {metadata.get('revision')})")
+    return metadata, np.load(io.BytesIO(response['Body'].read()))
+
+
+def load_ivf(s3, bucket: str) -> Optional[Tuple[str, np.ndarray]]:
+    """Return (version, centroids) of the current IVF partitioning, if trained"""
+    try:
+        info = json.loads(s3.get_object(Bucket=bucket, Key=f"{IVF_PREFIX}centroids.json")['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+    return info['version'], _load_npy(s3, bucket, f"{IVF_PREFIX}centroids-{info['version']}.npy")
+
+
+def write_segment(s3, bucket: str, document_id: str, title: str,
+                  chunks: Sequence[str], vectors: np.ndarray, embedder_name: str,
+                  ivf: Optional[Tuple[str, np.ndarray]] = None) -> str:
+    """Upload one document's vectors (.npy) and chunk metadata (.json) to S3.
+
+    The .npy file is a plain float32 matrix so readers can memory-map it.
+    With an IVF partitioning, rows are grouped by list and the list offsets
+    are stored in the metadata.
+
+    Both files are built in /tmp and uploaded from there, copying a block
+    of rows and one chunk at a time, so chunks and vectors can be spooled
+    or memory-mapped rather than held in memory.
+
+    Both files carry the same revision (in the .json and as object metadata
+    on the .npy), so a reader that catches a rewrite half done can tell the
+    pair apart. The .json goes first: readers key segments on the .npy
+    ETag, so by the time a new ETag shows up its chunks are already there.
+    """
+    key = f"{VECTOR_INDEX_PREFIX}{document_id}"
+    revision = uuid.uuid4().hex
+    metadata = {
+        'document_id': document_id,
+        'title': title,
+        'embedder': embedder_name,
+        'dimension': int(vectors.shape[1]),
+        'revision': revision
+    }
+
+    order = None
+    if ivf:
+        version, centroids = ivf
+        order, offsets = partition(vectors, centroids)
+        metadata['ivf_version'] = version
+        metadata['list_offsets'] = offsets.tolist()
+
+    with tempfile.TemporaryDirectory(prefix='segment-upload-') as spool:
+        json_path = os.path.join(spool, 'segment.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            # Same document as json.dumps({**metadata, 'chunks': chunks}), streamed
+            f.write(json.dumps(metadata)[:-1] + ', "chunks": [')
+            ordered = (chunks[int(i)] for i in order) if order is not None else iter(chunks)
+            for position, chunk in enumerate(ordered):
+                f.write(f", {json.dumps(chunk)}" if position else json.dumps(chunk))
+            f.write(']}')
+
+        npy_path = os.path.join(spool, 'segment.npy')
+        target = np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32, shape=vectors.shape)
+        step = max(1, COPY_BLOCK_BYTES // (vectors.shape[1] * 4))
+        for start in range(0, len(vectors), step):
+            rows = order[start:start + step] if order is not None else slice(start, start + step)
+            target[start:start + step] = vectors[rows]
+        target.flush()
+        del target
+
+        s3.upload_file(json_path, bucket, f"{key}.json", ExtraArgs={'ContentType': 'application/json'})
+        s3.upload_file(npy_path, bucket, f"{key}.npy", ExtraArgs={'Metadata': {'revision': revision}})
+    return key
+
+
+class SpooledChunks:
+    """Chunk texts appended to a file in /tmp, readable back by position"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'w+b')
+        self._ends: List[int] = []
+
+    def append(self, text: str) -> None:
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(text.encode('utf-8'))
+        self._ends.append(self._file.tell())
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __getitem__(self, position: int) -> str:
+        start = self._ends[position - 1] if position else 0
+        self._file.seek(start)
+        return self._file.read(self._ends[position] - start).decode('utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(len(self)):
+            yield self[position]
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class SegmentWriter:
+    """Embed chunks as they arrive and write them as one segment when finished.
+
+    Chunks are embedded in batches of EMBEDDING_BATCH_SIZE, so the writer
+    can consume a streaming chunk source without buffering raw text blocks.
+    Embedded chunks and their vectors are spooled to /tmp rather than kept
+    in memory, so a long document costs disk, not Lambda memory. Call
+    finish(), or close() to discard the segment.
+    """
+
+    def __init__(self, s3, bucket: str, embedder: Embedder, document_id: str, title: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.embedder = embedder
+        self.document_id = document_id
+        self.title = title
+        self.batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', '32'))
+        self._spool = tempfile.mkdtemp(prefix='segment-')
+        self.chunks = SpooledChunks(os.path.join(self._spool, 'chunks.txt'))
+        self._vectors_path = os.path.join(self._spool, 'vectors.f32')
+        self._vectors = open(self._vectors_path, 'wb')
+        self._dimension = 0
+        self._pending: List[str] = []
+
+    def add(self, chunk: str) -> None:
+        self._pending.append(chunk)
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._pending:
+            vectors = np.ascontiguousarray(self.embedder.embed(self._pending), dtype=np.float32)
+            self._dimension = vectors.shape[1]
+            self._vectors.write(vectors.tobytes())
+            for chunk in self._pending:
+                self.chunks.append(chunk)
+            self._pending = []
+
+    def finish(self) -> int:
+        """Write the segment, partitioned with the current IVF centroids if any"""
+        try:
+            self._flush()
+            if not len(self.chunks):
+                logger.warning(f"No text to index for document {self.document_id}")
+                return 0
+
+            self._vectors.close()
+            vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r',
+                                shape=(len(self.chunks), self._dimension))
+            key = write_segment(
+                self.s3, self.bucket, self.document_id, self.title, self.chunks,
+                vectors, self.embedder.name, load_ivf(self.s3, self.bucket)
+            )
+            logger.info(f"Stored {len(self.chunks)} chunk vectors for {self.document_id} at s3://{self.bucket}/{key}")
+            return len(self.chunks)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Remove the spooled chunks and vectors"""
+        self._vectors.close()
+        self.chunks.close()
+        shutil.rmtree(self._spool, ignore_errors=True)
+
+
+def _segment_keys(s3, bucket: str) -> List[str]:
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=VECTOR_INDEX_PREFIX):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith('.npy') and not obj['Key'].startswith(IVF_PREFIX):
+                keys.append(obj['Key'][:-len('.npy')])
+    return keys
+
+
+def train_ivf(s3, bucket: str, keys: List[str]) -> Tuple[str, np.ndarray]:
+    """Train IVF centroids on a sample of the vectors and save them under a new version.
+
+    IVF_TRAIN_SEGMENTS caps how many segments are read for the sample and
+    IVF_TRAIN_SAMPLE how many vectors k-means is trained on. IVF_NLIST sets
+    the number of lists (default ~sqrt(N), N estimated from the sample).
+    """
+    sample_size = int(os.environ.get('IVF_TRAIN_SAMPLE', '100000'))
+    max_segments = int(os.environ.get('IVF_TRAIN_SEGMENTS', '256'))
+    rng = np.random.default_rng(0)
+    sampled = sorted(rng.choice(len(keys), min(len(keys), max_segments), replace=False))
+    samples, rows = [], 0
+    for position in sampled:
+        vectors = _load_npy(s3, bucket, f"{keys[position]}.npy")
+        rows += len(vectors)
+        take = min(len(vectors), max(1, sample_size // len(sampled)))
+        samples.append(vectors[rng.choice(len(vectors), take, replace=False)])
+    sample = np.vstack(samples)
+
+    total = rows * len(keys) // len(sampled)
+    nlist = int(os.environ.get('IVF_NLIST', '0')) or int(np.sqrt(total))
+    centroids = train_centroids(sample, nlist)
+    version = str(int(time.time()))
+    _save_npy(s3, bucket, f"{IVF_PREFIX}centroids-{version}.npy", centroids)
+    logger.info(f"Trained IVF centroids {version}: {len(centroids)} lists on {len(sample)} vectors "
+                f"from {len(sampled)} of {len(keys)} segments")
+    return version, centroids
+
+
+def rebuild_ivf(s3, bucket: str, version: Optional[str] = None, start_after: str = '',
+                deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Train new IVF centroids and repartition every segment with them, in steps.
+
+    Without a version, new centroids are trained first. Segments are then
+    repartitioned in key order until ``deadline`` (a time.time() value)
+    passes; the result carries the version and the last key done, for the
+    next step to resume from. The step that reaches the last segment
+    publishes the version. Without a deadline it all happens in one call.
+    """
+    keys = _segment_keys(s3, bucket)
+    if not keys:
+        return {'segments': 0, 'done': True}
+
+    if version is None:
+        version, centroids = train_ivf(s3, bucket, keys)
+    else:
+        centroids = _load_npy(s3, bucket, f"{IVF_PREFIX}centroids-{version}.npy")
+
+    # Repartition before publishing, so readers never see a version without segments
+    done = 0
+    for key in sorted(key for key in keys if key > start_after):
+        if deadline is not None and done and time.time() >= deadline:
+            logger.info(f"Repartitioned {done} segments for IVF index {version}, resuming after {start_after}")
+            return {'version': version, 'segments': done, 'start_after': start_after, 'done': False}
+        metadata, vectors = _load_segment_files(s3, bucket, key)
+        write_segment(
+            s3, bucket, metadata['document_id'], metadata['title'], metadata['chunks'],
+            vectors, metadata['embedder'], (version, centroids)
+        )
+        start_after = key
+        done += 1
+
+    s3.put_object(
+        Bucket=bucket,
+        Key=f"{IVF_PREFIX}centroids.json",
+        Body=json.dumps({'version': version, 'nlist': len(centroids)}).encode('utf-8'),
+        ContentType='application/json'
+    )
+    logger.info(f"Published IVF index {version}: {len(centroids)} lists over {len(keys)} segments")
+    return {'version': version, 'segments': done, 'nlist': len(centroids), 'done': True}
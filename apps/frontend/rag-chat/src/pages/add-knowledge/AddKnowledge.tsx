@@ -17,6 +17,7 @@ export const AddKnowledge = () => {
   const theme = useTheme();
   const [file, setFile] = useState<File | null>(null);
   const [isUploading, setIsUploading] = useState(false);
+  const [progress, setProgress] = useState<number | null>(null);
   const [error, setError] = useState<string | null>(null);
   const [success, setSuccess] = useState<string | null>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
@@ -34,23 +35,25 @@ export const AddKnowledge = () => {
     if (!file) return;
 
     setIsUploading(true);
+    setProgress(null);
     setError(null);
     setSuccess(null);
     try {
-      await uploadKnowledge(file);
+      await uploadKnowledge(file, setProgress);
       setFile(null);
       if (fileInputRef.current) {
         fileInputRef.current.value = "";
       }
+      setSuccess(
+        "Data sent sucessfully. Soon it will be added to knowledge base"
+      );
     } catch (error) {
       setError(
         error instanceof Error ? error.message : "Failed to upload file"
       );
     } finally {
       setIsUploading(false);
-      setSuccess(
-        "Data sent sucessfully. Soon it will be added to knowledge base"
-      );
+      setProgress(null);
     }
   };
 
@@ -159,7 +162,12 @@ export const AddKnowledge = () => {
             }}
           >
             {isUploading ? (
-              <CircularProgress size={24} color="inherit" />
+              <CircularProgress
+                size={24}
+                color="inherit"
+                variant={progress === null ? "indeterminate" : "determinate"}
+                value={(progress ?? 0) * 100}
+              />
             ) : (
               "Upload"
             )}
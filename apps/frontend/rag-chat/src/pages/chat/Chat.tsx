@@ -4,13 +4,20 @@ import { ChatHistoryComponent } from "./ChatHistoryComponent";
 import { ChatInput } from "./ChatInput";
 import {
   Box,
+  Button,
   Container,
   Paper,
   Typography,
   useTheme,
   CircularProgress,
 } from "@mui/material";
-import { getChat, getMessages, sendMessage, Message } from "../../services/api";
+import {
+  getChat,
+  getMessagesPage,
+  sendMessage,
+  Message,
+} from "../../services/api";
+import { isStreamingAvailable, streamMessage } from "../../services/chatSocket";
 
 export type ChatMessage = {
   id: string;
@@ -25,6 +32,13 @@ export type ChatHistory = {
   messages?: ChatMessage[];
 };
 
+const toChatMessages = (messages: Message[]): ChatMessage[] =>
+  messages.map((msg) => ({
+    id: String(msg.timestamp),
+    content: msg.message,
+    role: msg.author as "user" | "assistant",
+  }));
+
 export const Chat = () => {
   const theme = useTheme();
   const { id } = useParams<{ id: string }>();
@@ -32,6 +46,9 @@ export const Chat = () => {
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
   const [isSending, setIsSending] = useState(false);
+  // Pages start at the newest messages; this one loads the turns before them
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
 
   const loadChat = useCallback(async () => {
     if (!id) {
@@ -44,20 +61,15 @@ export const Chat = () => {
 
       const chat = await getChat(id);
 
-      const messages = await getMessages(id);
-
-      const transformedMessages = messages.map((msg: Message) => ({
-        id: String(msg.timestamp),
-        content: msg.message,
-        role: msg.author as "user" | "assistant",
-      }));
+      const page = await getMessagesPage(id);
 
       setChatHistory({
         id: chat.chatId,
         name: decodeURIComponent(chat.title),
         createdAt: String(chat.created_at),
-        messages: transformedMessages,
+        messages: toChatMessages(page.items),
       });
+      setOlderCursor(page.nextCursor);
     } catch (err) {
       setError(err instanceof Error ? err.message : "Failed to load chat");
     } finally {
@@ -69,6 +81,24 @@ export const Chat = () => {
     loadChat();
   }, [loadChat]);
 
+  const loadOlderMessages = async () => {
+    if (!id || !olderCursor) return;
+
+    try {
+      setIsLoadingOlder(true);
+      const page = await getMessagesPage(id, olderCursor);
+      setChatHistory((prev) => ({
+        ...prev!,
+        messages: [...toChatMessages(page.items), ...(prev?.messages || [])],
+      }));
+      setOlderCursor(page.nextCursor);
+    } catch (err) {
+      console.error("Error loading older messages:", err);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const handleSendMessage = async (content: string) => {
     if (!id || !chatHistory) return;
 
@@ -85,6 +115,37 @@ export const Chat = () => {
 
     setIsSending(true);
     try {
+      if (isStreamingAvailable()) {
+        // Show the reply as it streams in, then swap in the stored message
+        const pendingId = `pending-${userMessage.id}`;
+        let streamed = "";
+        setChatHistory((prev) => ({
+          ...prev!,
+          messages: [
+            ...(prev?.messages || []),
+            { id: pendingId, content: "", role: "assistant" },
+          ],
+        }));
+        const replaceStreamed = (message: ChatMessage) =>
+          setChatHistory((prev) => ({
+            ...prev!,
+            messages: (prev?.messages || []).map((msg) =>
+              msg.id === pendingId ? message : msg
+            ),
+          }));
+
+        const response = await streamMessage(id, content, (text) => {
+          streamed += text;
+          replaceStreamed({ id: pendingId, content: streamed, role: "assistant" });
+        });
+        replaceStreamed({
+          id: String(response.timestamp),
+          content: response.message,
+          role: "assistant",
+        });
+        return;
+      }
+
       const response = await sendMessage(id, content);
 
       const assistantMessage: ChatMessage = {
@@ -186,6 +247,17 @@ export const Chat = () => {
             p: 2,
           }}
         >
+          {olderCursor && (
+            <Box sx={{ mb: 2, display: "flex", justifyContent: "center" }}>
+              <Button onClick={loadOlderMessages} disabled={isLoadingOlder}>
+                {isLoadingOlder ? (
+                  <CircularProgress size={20} />
+                ) : (
+                  "Load earlier messages"
+                )}
+              </Button>
+            </Box>
+          )}
           <ChatHistoryComponent
             chatHistory={chatHistory}
             isWaitingForResponse={isSending}
@@ -16,7 +16,7 @@ import {
   CircularProgress,
 } from "@mui/material";
 import AddIcon from "@mui/icons-material/Add";
-import { getChats, Chat } from "../../services/api";
+import { getChatsPage, Chat } from "../../services/api";
 
 export const Chats = () => {
   const theme = useTheme();
@@ -24,14 +24,17 @@ export const Chats = () => {
   const [chats, setChats] = useState<Chat[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
 
   useEffect(() => {
     const loadChats = async () => {
       try {
         setIsLoading(true);
         setError(null);
-        const userChats = await getChats();
-        setChats(userChats);
+        const page = await getChatsPage();
+        setChats(page.items);
+        setNextCursor(page.nextCursor);
       } catch (err) {
         console.error("Failed to load chats:", err);
         setError("Failed to load chats. Please try again later.");
@@ -43,6 +46,21 @@ export const Chats = () => {
     loadChats();
   }, []);
 
+  const loadMoreChats = async () => {
+    if (!nextCursor) return;
+
+    try {
+      setIsLoadingMore(true);
+      const page = await getChatsPage(nextCursor);
+      setChats((prev) => [...prev, ...page.items]);
+      setNextCursor(page.nextCursor);
+    } catch (err) {
+      console.error("Failed to load more chats:", err);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
   if (isLoading) {
     return (
       <Container
@@ -166,6 +184,13 @@ export const Chats = () => {
               </ListItem>
             ))}
           </List>
+          {nextCursor && (
+            <Box sx={{ p: 2, display: "flex", justifyContent: "center" }}>
+              <Button onClick={loadMoreChats} disabled={isLoadingMore}>
+                {isLoadingMore ? <CircularProgress size={20} /> : "Load more"}
+              </Button>
+            </Box>
+          )}
         </Paper>
       )}
     </Container>
@@ -17,6 +17,19 @@ export interface Message {
   timestamp: number;
 }
 
+export interface Page<T> {
+  items: T[];
+  nextCursor: string | null;
+}
+
+const pageQuery = (cursor?: string, limit?: number) => {
+  const params = new URLSearchParams();
+  if (cursor) params.set("cursor", cursor);
+  if (limit) params.set("limit", String(limit));
+  const query = params.toString();
+  return query ? `?${query}` : "";
+};
+
 export const getAuthHeaders = async () => {
   try {
     const session = await fetchAuthSession();
@@ -78,21 +91,55 @@ export async function createChat(title: string): Promise<Chat> {
   return response;
 }
 
-export async function getChats(): Promise<Chat[]> {
-  const response = await api.get("/chats");
+export async function getChatsPage(
+  cursor?: string,
+  limit?: number
+): Promise<Page<Chat>> {
+  const response = await api.get(`/chats${pageQuery(cursor, limit)}`);
   return response;
 }
 
+// Every chat of the user, one page after another
+export async function getChats(): Promise<Chat[]> {
+  const chats: Chat[] = [];
+  let cursor: string | undefined;
+  do {
+    const page = await getChatsPage(cursor);
+    chats.push(...page.items);
+    cursor = page.nextCursor ?? undefined;
+  } while (cursor);
+  return chats;
+}
+
 export async function getChat(chatId: string): Promise<Chat> {
   const response = await api.get(`/chats/${chatId}`);
   return response;
 }
 
-export async function getMessages(chatId: string): Promise<Message[]> {
-  const response = await api.get(`/chats/${chatId}/messages`);
+// Pages start at the newest messages; nextCursor loads the older ones
+export async function getMessagesPage(
+  chatId: string,
+  cursor?: string,
+  limit?: number
+): Promise<Page<Message>> {
+  const response = await api.get(
+    `/chats/${chatId}/messages${pageQuery(cursor, limit)}`
+  );
   return response;
 }
 
+// The whole history in chronological order; older pages go in front
+export async function getMessages(chatId: string): Promise<Message[]> {
+  let messages: Message[] = [];
+  let cursor: string | undefined;
+  do {
+    const page = await getMessagesPage(chatId, cursor);
+    messages = [...page.items, ...messages];
+    cursor = page.nextCursor ?? undefined;
+  } while (cursor);
+  return messages;
+}
+
 export async function sendMessage(
   chatId: string,
   content: string
@@ -101,34 +148,152 @@ export async function sendMessage(
   return response;
 }
 
-export async function uploadKnowledge(file: File): Promise<void> {
-  try {
-    const session = await fetchAuthSession();
-    const token = session.tokens?.idToken?.toString();
+interface PostUpload {
+  method: "POST";
+  s3_key: string;
+  url: string;
+  fields: Record<string, string>;
+}
 
-    if (!token) {
-      throw new Error("No authentication token available");
+interface MultipartUpload {
+  method: "MULTIPART";
+  s3_key: string;
+  upload_id: string;
+  part_size: number;
+  parts: { partNumber: number; url: string }[];
+}
+
+// Files up to this size are hashed in the browser, so S3 can check the body
+// of a presigned POST and duplicates are spotted without rehashing
+const HASH_MAX_BYTES = 64 * 1024 * 1024;
+// Multipart parts sent to S3 at once
+const PART_CONCURRENCY = 4;
+
+async function sha256Hex(file: File): Promise<string> {
+  const data = await file.arrayBuffer();
+  const digest = await crypto.subtle.digest("SHA-256", data);
+  return Array.from(new Uint8Array(digest))
+    .map((byte) => byte.toString(16).padStart(2, "0"))
+    .join("");
+}
+
+async function postToS3(upload: PostUpload, file: File): Promise<void> {
+  const formData = new FormData();
+  Object.entries(upload.fields).forEach(([name, value]) =>
+    formData.append(name, value)
+  );
+  // S3 ignores every field after the file
+  formData.append("file", file);
+
+  const response = await fetch(upload.url, { method: "POST", body: formData });
+  if (!response.ok) {
+    throw new Error(`Upload to storage failed (${response.status})`);
+  }
+}
+
+async function putPartsToS3(
+  upload: MultipartUpload,
+  file: File,
+  onProgress?: (fraction: number) => void
+): Promise<{ partNumber: number; etag: string }[]> {
+  const completed: { partNumber: number; etag: string }[] = [];
+  const pending = [...upload.parts];
+
+  const worker = async () => {
+    for (let part = pending.shift(); part; part = pending.shift()) {
+      const start = (part.partNumber - 1) * upload.part_size;
+      const response = await fetch(part.url, {
+        method: "PUT",
+        body: file.slice(start, start + upload.part_size),
+      });
+      const etag = response.headers.get("ETag");
+      if (!response.ok || !etag) {
+        throw new Error(
+          `Upload of part ${part.partNumber} failed (${response.status})`
+        );
+      }
+      completed.push({ partNumber: part.partNumber, etag });
+      onProgress?.(completed.length / upload.parts.length);
     }
+  };
+
+  const workers = Math.min(PART_CONCURRENCY, upload.parts.length);
+  await Promise.all(Array.from({ length: workers }, worker));
+  return completed;
+}
 
-    const formData = new FormData();
-    formData.append("file", file);
+// Sends the file straight to the bucket: the API only signs the upload and,
+// for multipart uploads, assembles the parts
+async function uploadDirect(
+  file: File,
+  onProgress?: (fraction: number) => void
+): Promise<void> {
+  const contentHash =
+    file.size <= HASH_MAX_BYTES ? await sha256Hex(file) : undefined;
+  const upload: PostUpload | MultipartUpload = await api.post("/upload_url", {
+    filename: file.name,
+    contentType: file.type || "application/pdf",
+    size: file.size,
+    contentHash,
+  });
 
-    const response = await fetch(`${API_URL}/add_to_knowledge_base`, {
-      method: "POST",
-      headers: {
-        Authorization: `Bearer ${token}`,
-      },
-      body: formData,
+  if (upload.method === "POST") {
+    await postToS3(upload, file);
+  } else {
+    const parts = await putPartsToS3(upload, file, onProgress);
+    await api.post("/complete_upload", {
+      s3_key: upload.s3_key,
+      upload_id: upload.upload_id,
+      parts,
     });
+  }
+  onProgress?.(1);
+}
 
-    if (!response.ok) {
-      const error = await response
-        .json()
-        .catch(() => ({ message: "Failed to upload file" }));
-      throw new Error(error.message || "Failed to upload file");
+// Posts the whole file through the API, for when the direct upload fails
+async function uploadThroughApi(file: File): Promise<void> {
+  const session = await fetchAuthSession();
+  const token = session.tokens?.idToken?.toString();
+
+  if (!token) {
+    throw new Error("No authentication token available");
+  }
+
+  const formData = new FormData();
+  formData.append("file", file);
+
+  const response = await fetch(`${API_URL}/add_to_knowledge_base`, {
+    method: "POST",
+    headers: {
+      Authorization: `Bearer ${token}`,
+    },
+    body: formData,
+  });
+
+  if (!response.ok) {
+    const error = await response
+      .json()
+      .catch(() => ({ message: "Failed to upload file" }));
+    throw new Error(error.message || "Failed to upload file");
+  }
+}
+
+export async function uploadKnowledge(
+  file: File,
+  onProgress?: (fraction: number) => void
+): Promise<void> {
+  try {
+    await uploadDirect(file, onProgress);
+  } catch (directError) {
+    console.warn(
+      "Direct upload failed, sending the file through the API:",
+      directError
+    );
+    try {
+      await uploadThroughApi(file);
+    } catch (error) {
+      console.error("Error uploading file:", error);
+      throw error;
     }
-  } catch (error) {
-    console.error("Error uploading file:", error);
-    throw error;
   }
 }
@@ -0,0 +1,58 @@
+import { fetchAuthSession } from "@aws-amplify/auth";
+import { Message } from "./api";
+
+const WEBSOCKET_URL = process.env.REACT_APP_WEBSOCKET_URL;
+
+type StreamEvent =
+  | { type: "chunk"; text: string }
+  | { type: "done"; message: Message }
+  | { type: "error"; error: string };
+
+export const isStreamingAvailable = () => Boolean(WEBSOCKET_URL);
+
+// Sends a message over the WebSocket API and calls onText with each piece of
+// the reply as it is generated; resolves with the stored assistant message.
+// Browsers cannot set headers on a WebSocket, so the access token goes in the
+// query string, where the API's $connect authorizer checks it.
+export async function streamMessage(
+  chatId: string,
+  content: string,
+  onText: (text: string) => void
+): Promise<Message> {
+  const session = await fetchAuthSession();
+  const token = session.tokens?.accessToken?.toString();
+  if (!token) {
+    throw new Error("No authentication token available");
+  }
+
+  return new Promise<Message>((resolve, reject) => {
+    const socket = new WebSocket(
+      `${WEBSOCKET_URL}?token=${encodeURIComponent(token)}`
+    );
+    let settled = false;
+    const settle = (done: () => void) => {
+      if (settled) return;
+      settled = true;
+      done();
+      socket.close();
+    };
+
+    socket.onopen = () => {
+      socket.send(JSON.stringify({ action: "sendMessage", chatId, content }));
+    };
+    socket.onmessage = (event) => {
+      const data: StreamEvent = JSON.parse(event.data);
+      if (data.type === "chunk") {
+        onText(data.text);
+      } else if (data.type === "done") {
+        settle(() => resolve(data.message));
+      } else if (data.type === "error") {
+        settle(() => reject(new Error(data.error)));
+      }
+    };
+    socket.onerror = () =>
+      settle(() => reject(new Error("WebSocket connection failed")));
+    socket.onclose = () =>
+      settle(() => reject(new Error("WebSocket closed before the reply finished")));
+  });
+}
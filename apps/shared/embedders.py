@@ -0,0 +1,85 @@
+"""
+Text embedders used to build and query the vector index.
+
+Shared by the API and the embeddings processor through their dependency
+layers, since documents and queries must be embedded by the same model for
+their vectors to be comparable.
+"""
+import os
+import re
+import json
+import hashlib
+from typing import List
+
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length so a dot product is the cosine similarity"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class Embedder:
+    name = 'base'
+    dimension = 0
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Return a float32 matrix with one unit-length row per text"""
+        raise NotImplementedError
+
+
+class BedrockEmbedder(Embedder):
+    """Embeddings from a Bedrock Titan text embeddings model"""
+
+    def __init__(self, bedrock):
+        self.bedrock = bedrock
+        self.model_id = os.environ.get('EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v2:0')
+        self.dimension = int(os.environ.get('EMBEDDING_DIMENSION', '512'))
+        self.name = f"bedrock:{self.model_id}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            response = self.bedrock.invoke_model(
+                modelId=self.model_id,
+                body=json.dumps({
+                    'inputText': text,
+                    'dimensions': self.dimension,
+                    'normalize': True
+                })
+            )
+            vectors[i] = json.loads(response['body'].read())['embedding']
+        return normalize_rows(vectors)
+
+
+class HashingEmbedder(Embedder):
+    """Deterministic feature-hashing embedder over word unigrams and bigrams.
+
+    Needs no network or model, so it can be used in tests and offline
+    benchmarks.
+    """
+
+    def __init__(self):
+        self.dimension = int(os.environ.get('EMBEDDING_DIMENSION', '384'))
+        self.name = 'hashing'
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for i, text in enumerate(texts):
+            tokens = TOKEN_PATTERN.findall(text.lower())
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                h = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+                vectors[i, h % self.dimension] += 1.0 if h >> 63 else -1.0
+        return normalize_rows(vectors)
+
+
+def get_embedder(bedrock=None) -> Embedder:
+    """Build the embedder selected by the EMBEDDER environment variable"""
+    if os.environ.get('EMBEDDER', 'bedrock') == 'hashing':
+        return HashingEmbedder()
+    return BedrockEmbedder(bedrock)
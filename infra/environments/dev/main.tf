@@ -13,7 +13,13 @@ module "api" {
   s3_bucket_name     = module.s3.bucket_name
   project_name       = "rag-chat"
   kendra_index_id    = module.kendra.index_id
+  retrieval_cache_table_name = module.dynamodb.retrieval_cache_table_name
+  documents_table_name       = module.dynamodb.documents_table_name
+  bedrock_model_id           = var.bedrock_model_id
+  bedrock_fallback_model_id  = var.bedrock_fallback_model_id
+  bedrock_expected_concurrency = var.bedrock_expected_concurrency
   xray_layer_arn     = aws_lambda_layer_version.xray_sdk_layer.arn
+  dependencies_layer_arn = aws_lambda_layer_version.api_dependencies.arn
 }
 
 module "api_gateway" {
@@ -91,6 +97,9 @@ module "embeddings_processor" {
   notification_topic_arn = module.sns.notification_topic_arn
   kendra_index_id    = module.kendra.index_id
   s3_bucket_name     = module.s3.bucket_name
+  retrieval_cache_table_name = module.dynamodb.retrieval_cache_table_name
+  documents_table_name       = module.dynamodb.documents_table_name
+  dependencies_layer_arn     = aws_lambda_layer_version.embeddings_processor_dependencies.arn
 }
 
 module "cognito" {
@@ -107,6 +116,7 @@ module "amplify" {
   repository_url = var.repository_url
   github_token   = var.github_token
   backend_url    = module.api_gateway.api_url
+  websocket_url  = module.api_gateway.websocket_url
   aws_region     = var.aws_region
   domain_name    = var.domain_name
   user_pool_id   = module.cognito.user_pool_id
@@ -128,3 +138,18 @@ data "archive_file" "xray_layer_zip" {
   depends_on = [null_resource.install_xray_dependencies]
 }
 
+data "archive_file" "api_dependencies_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/build/api-deps"
+  output_path = "${path.module}/api-dependencies-layer.zip"
+
+  depends_on = [null_resource.install_api_dependencies]
+}
+
+data "archive_file" "embeddings_processor_dependencies_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/build/embeddings-processor-deps"
+  output_path = "${path.module}/embeddings-processor-dependencies-layer.zip"
+
+  depends_on = [null_resource.install_embeddings_processor_dependencies]
+}
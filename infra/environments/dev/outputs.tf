@@ -7,3 +7,8 @@ output "amplify_app_url" {
   description = "The URL of the Amplify application"
   value       = module.amplify.app_url
 }
+
+output "websocket_url" {
+  description = "The URL of the WebSocket API used to stream chat replies"
+  value       = module.api_gateway.websocket_url
+}
@@ -64,7 +64,8 @@ resource "aws_iam_role_policy" "lambda_s3_policy" {
         Action = [
           "s3:PutObject",
           "s3:GetObject",
-          "s3:DeleteObject"
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload"
         ]
         Resource = "${module.s3.bucket_arn}/*"
       }
@@ -162,6 +163,18 @@ resource "aws_iam_role_policy" "lambda_notification_policy" {
   })
 }
 
+locals {
+  bedrock_generation_models = compact([var.bedrock_model_id, var.bedrock_fallback_model_id])
+  # An inference profile is invoked in any of its regions and routes to the
+  # foundation model it names, so both need allowing
+  bedrock_generation_arns = flatten([
+    for model in local.bedrock_generation_models : concat(
+      length(regexall("inference-profile/", model)) > 0 ? [replace(model, "/^arn:aws:bedrock:[^:]*:/", "arn:aws:bedrock:*:")] : [],
+      ["arn:aws:bedrock:*::foundation-model/${replace(basename(model), "/^(us|eu|apac)\\./", "")}"]
+    )
+  ])
+}
+
 resource "aws_iam_role_policy" "lambda_policy" {
   name = "lambda-policy"
   role = aws_iam_role.lambda_role.id
@@ -215,14 +228,19 @@ resource "aws_iam_role_policy" "lambda_policy" {
           "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.chats_table_name}",
           "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.messages_table_name}",
           "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.chats_table_name}/index/*",
-          "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.messages_table_name}/index/*"
+          "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.messages_table_name}/index/*",
+          "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.retrieval_cache_table_name}",
+          "arn:aws:dynamodb:${data.aws_region.current.name}:${data.aws_caller_identity.current.account_id}:table/${module.dynamodb.documents_table_name}"
         ]
       },
       {
         Effect = "Allow"
         Action = [
           "textract:StartDocumentAnalysis",
-          "textract:GetDocumentAnalysis"
+          "textract:GetDocumentAnalysis",
+          "textract:StartDocumentTextDetection",
+          "textract:GetDocumentTextDetection",
+          "textract:DetectDocumentText"
         ]
         Resource = "*"
       },
@@ -230,6 +248,7 @@ resource "aws_iam_role_policy" "lambda_policy" {
         Effect = "Allow"
         Action = [
           "kendra:BatchPutDocument",
+          "kendra:BatchGetDocumentStatus",
           "kendra:BatchDeleteDocument",
           "kendra:SubmitFeedback",
           "kendra:Query",
@@ -240,10 +259,16 @@ resource "aws_iam_role_policy" "lambda_policy" {
       {
         Effect   = "Allow"
         Action   = ["bedrock:InvokeModel", "bedrock:InvokeModelWithResponseStream"]
-        Resource = [
-          "arn:aws:bedrock:*:727646510092:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0",
-          "arn:aws:bedrock:*::foundation-model/anthropic.claude-3-5-sonnet-20241022-v2:0"
-        ]
+        Resource = concat(local.bedrock_generation_arns, [
+          # Titan embeddings for the vector index and the answer cache
+          "arn:aws:bedrock:*::foundation-model/amazon.titan-embed-text-v2:0"
+        ])
+      },
+      {
+        # Streams replies back to WebSocket clients
+        Effect   = "Allow"
+        Action   = ["execute-api:ManageConnections"]
+        Resource = "${module.api_gateway.websocket_execution_arn}/*/POST/@connections/*"
       }
     ]
   })
@@ -300,6 +325,52 @@ resource "null_resource" "install_xray_dependencies" {
   }
 }
 
+# numpy and pypdf ship native wheels, so they are installed for the Lambda
+# platform rather than for the machine running terraform. Both layers also
+# carry apps/shared/embedders.py, so documents and queries are embedded by
+# the same code.
+resource "null_resource" "install_api_dependencies" {
+
+  triggers = {
+    requirements_md5 = filemd5("${path.module}/../../../apps/api/requirements.txt")
+    embedders_md5    = filemd5("${path.module}/../../../apps/shared/embedders.py")
+  }
+
+  provisioner "local-exec" {
+    command = "rm -rf ${path.module}/build/api-deps && mkdir -p ${path.module}/build/api-deps/python && pip3 install -r ${path.module}/../../../apps/api/requirements.txt -t ${path.module}/build/api-deps/python --platform manylinux2014_x86_64 --implementation cp --python-version 3.9 --only-binary=:all: && cp ${path.module}/../../../apps/shared/embedders.py ${path.module}/build/api-deps/python/"
+  }
+}
+
+resource "aws_lambda_layer_version" "api_dependencies" {
+  layer_name = "rag-chat-api-dependencies"
+
+  filename         = data.archive_file.api_dependencies_zip.output_path
+  source_code_hash = data.archive_file.api_dependencies_zip.output_base64sha256
+
+  compatible_runtimes = ["python3.9"]
+}
+
+resource "null_resource" "install_embeddings_processor_dependencies" {
+
+  triggers = {
+    requirements_md5 = filemd5("${path.module}/../../../apps/embeddings_processor/requirements.txt")
+    embedders_md5    = filemd5("${path.module}/../../../apps/shared/embedders.py")
+  }
+
+  provisioner "local-exec" {
+    command = "rm -rf ${path.module}/build/embeddings-processor-deps && mkdir -p ${path.module}/build/embeddings-processor-deps/python && pip3 install -r ${path.module}/../../../apps/embeddings_processor/requirements.txt -t ${path.module}/build/embeddings-processor-deps/python --platform manylinux2014_x86_64 --implementation cp --python-version 3.9 --only-binary=:all: && cp ${path.module}/../../../apps/shared/embedders.py ${path.module}/build/embeddings-processor-deps/python/"
+  }
+}
+
+resource "aws_lambda_layer_version" "embeddings_processor_dependencies" {
+  layer_name = "embeddings-processor-dependencies"
+
+  filename         = data.archive_file.embeddings_processor_dependencies_zip.output_path
+  source_code_hash = data.archive_file.embeddings_processor_dependencies_zip.output_base64sha256
+
+  compatible_runtimes = ["python3.9"]
+}
+
 resource "aws_lambda_layer_version" "xray_sdk_layer" {
   layer_name = "aws-xray-sdk-layer-automated"
   
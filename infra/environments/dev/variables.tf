@@ -24,4 +24,22 @@ variable "aws_region" {
 variable "ses_sender_email" {
   description = "Email address to use as the sender for SES notifications"
   type        = string
-} 
\ No newline at end of file
+} 
+
+variable "bedrock_model_id" {
+  description = "Model ID or inference profile ARN the chat API answers with"
+  type        = string
+  default     = "arn:aws:bedrock:us-east-1:727646510092:inference-profile/us.anthropic.claude-3-5-sonnet-20241022-v2:0"
+}
+
+variable "bedrock_fallback_model_id" {
+  description = "Model ID or inference profile ARN the chat API falls back to; empty for none"
+  type        = string
+  default     = "arn:aws:bedrock:us-east-1:727646510092:inference-profile/us.anthropic.claude-3-5-haiku-20241022-v1:0"
+}
+
+variable "bedrock_expected_concurrency" {
+  description = "Number of chat API containers expected to run at once; the Bedrock quotas are split between them"
+  type        = number
+  default     = 10
+}
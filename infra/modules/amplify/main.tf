@@ -29,6 +29,7 @@ resource "aws_amplify_app" "frontend" {
 
   environment_variables = {
     REACT_APP_BACKEND_URL = var.backend_url
+    REACT_APP_WEBSOCKET_URL = var.websocket_url
     REACT_APP_ENV         = "development"
     REACT_APP_REGION      = var.aws_region
     REACT_APP_USER_POOL_ID = var.user_pool_id
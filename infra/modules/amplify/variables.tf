@@ -19,6 +19,12 @@ variable "backend_url" {
   type        = string
 }
 
+variable "websocket_url" {
+  description = "WebSocket API URL the frontend streams chat replies from"
+  type        = string
+  default     = ""
+}
+
 variable "domain_name" {
   description = "Custom domain name for the application (optional)"
   type        = string
@@ -12,7 +12,7 @@ resource "aws_lambda_function" "api" {
   filename        = data.archive_file.lambda_zip.output_path
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
   timeout         = 30
-  layers          = [var.xray_layer_arn]
+  layers          = [var.xray_layer_arn, var.dependencies_layer_arn]
   tracing_config {
     mode = "Active"
   }
@@ -22,6 +22,11 @@ resource "aws_lambda_function" "api" {
       S3_BUCKET_NAME = var.s3_bucket_name
       PROJECT_NAME   = var.project_name
       KENDRA_INDEX_ID = var.kendra_index_id
+      RETRIEVAL_CACHE_TABLE = var.retrieval_cache_table_name
+      DOCUMENTS_TABLE = var.documents_table_name
+      BEDROCK_MODEL_ID = var.bedrock_model_id
+      BEDROCK_FALLBACK_MODEL_ID = var.bedrock_fallback_model_id
+      BEDROCK_EXPECTED_CONCURRENCY = var.bedrock_expected_concurrency
     }
   }
 }
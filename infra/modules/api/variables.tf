@@ -36,4 +36,37 @@ variable "kendra_index_id" {
 variable "xray_layer_arn" {
   description = "ARN of the X-Ray SDK Lambda layer"
   type        = string
-}
\ No newline at end of file
+}
+
+variable "dependencies_layer_arn" {
+  description = "ARN of the layer holding the packages in requirements.txt"
+  type        = string
+}
+
+variable "retrieval_cache_table_name" {
+  description = "Name of the DynamoDB table caching retrieval results"
+  type        = string
+}
+
+variable "documents_table_name" {
+  description = "Name of the DynamoDB table deduplicating uploads by content hash"
+  type        = string
+}
+
+
+variable "bedrock_model_id" {
+  description = "Model ID or inference profile ARN used to generate answers"
+  type        = string
+}
+
+variable "bedrock_fallback_model_id" {
+  description = "Model ID or inference profile ARN used when the primary model is saturated or unavailable; empty for none"
+  type        = string
+  default     = ""
+}
+
+variable "bedrock_expected_concurrency" {
+  description = "Number of API containers expected to run at once; each gets this share of the Bedrock tokens-per-minute quota"
+  type        = number
+  default     = 1
+}
@@ -77,6 +77,32 @@ resource "aws_apigatewayv2_route" "add_to_knowledge_base" {
   authorizer_id      = aws_apigatewayv2_authorizer.cognito_authorizer.id
 }
 
+# Direct-to-S3 upload routes
+resource "aws_apigatewayv2_route" "upload_url" {
+  api_id             = aws_apigatewayv2_api.api.id
+  route_key          = "POST /upload_url"
+  target             = "integrations/${aws_apigatewayv2_integration.lambda_integration.id}"
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.cognito_authorizer.id
+}
+
+resource "aws_apigatewayv2_route" "complete_upload" {
+  api_id             = aws_apigatewayv2_api.api.id
+  route_key          = "POST /complete_upload"
+  target             = "integrations/${aws_apigatewayv2_integration.lambda_integration.id}"
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.cognito_authorizer.id
+}
+
+# Admin routes; the Lambda additionally requires the caller to be in the admin group
+resource "aws_apigatewayv2_route" "admin_list_chats" {
+  api_id             = aws_apigatewayv2_api.api.id
+  route_key          = "GET /admin/chats"
+  target             = "integrations/${aws_apigatewayv2_integration.lambda_integration.id}"
+  authorization_type = "JWT"
+  authorizer_id      = aws_apigatewayv2_authorizer.cognito_authorizer.id
+}
+
 resource "aws_apigatewayv2_stage" "api_stage" {
   api_id      = aws_apigatewayv2_api.api.id
   name        = "$default"
@@ -94,3 +120,70 @@ resource "aws_lambda_permission" "api_gw" {
   principal     = "apigateway.amazonaws.com"
   source_arn    = "${aws_apigatewayv2_api.api.execution_arn}/*/*"
 }
+
+# WebSocket API for streamed chat replies. Browsers cannot set headers on a
+# WebSocket, so $connect is guarded by a Lambda authorizer that checks the
+# Cognito access token passed in the "token" query parameter; later routes
+# inherit the principal it returns.
+resource "aws_apigatewayv2_api" "websocket" {
+  name                       = "${var.api_name}-websocket"
+  protocol_type              = "WEBSOCKET"
+  route_selection_expression = "$request.body.action"
+}
+
+resource "aws_apigatewayv2_authorizer" "websocket_authorizer" {
+  api_id           = aws_apigatewayv2_api.websocket.id
+  authorizer_type  = "REQUEST"
+  authorizer_uri   = var.lambda_invoke_arn
+  identity_sources = ["route.request.querystring.token"]
+  name             = "websocket-token-authorizer"
+}
+
+resource "aws_apigatewayv2_integration" "websocket_integration" {
+  api_id           = aws_apigatewayv2_api.websocket.id
+  integration_type = "AWS_PROXY"
+  integration_uri  = var.lambda_invoke_arn
+}
+
+resource "aws_apigatewayv2_route" "websocket_connect" {
+  api_id             = aws_apigatewayv2_api.websocket.id
+  route_key          = "$connect"
+  target             = "integrations/${aws_apigatewayv2_integration.websocket_integration.id}"
+  authorization_type = "CUSTOM"
+  authorizer_id      = aws_apigatewayv2_authorizer.websocket_authorizer.id
+}
+
+resource "aws_apigatewayv2_route" "websocket_disconnect" {
+  api_id    = aws_apigatewayv2_api.websocket.id
+  route_key = "$disconnect"
+  target    = "integrations/${aws_apigatewayv2_integration.websocket_integration.id}"
+}
+
+resource "aws_apigatewayv2_route" "websocket_send_message" {
+  api_id    = aws_apigatewayv2_api.websocket.id
+  route_key = "sendMessage"
+  target    = "integrations/${aws_apigatewayv2_integration.websocket_integration.id}"
+}
+
+resource "aws_apigatewayv2_stage" "websocket_stage" {
+  api_id      = aws_apigatewayv2_api.websocket.id
+  name        = var.stage_name
+  auto_deploy = true
+}
+
+resource "aws_lambda_permission" "websocket" {
+  statement_id  = "AllowExecutionFromWebSocketAPI"
+  action        = "lambda:InvokeFunction"
+  function_name = var.lambda_function_name
+  principal     = "apigateway.amazonaws.com"
+  # Covers the routes and the authorizer
+  source_arn    = "${aws_apigatewayv2_api.websocket.execution_arn}/*"
+}
+
+output "websocket_url" {
+  value = aws_apigatewayv2_stage.websocket_stage.invoke_url
+}
+
+output "websocket_execution_arn" {
+  value = aws_apigatewayv2_api.websocket.execution_arn
+}
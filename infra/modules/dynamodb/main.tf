@@ -52,4 +52,41 @@ resource "aws_dynamodb_table" "messages" {
     Name        = "${var.project_name}-messages"
     Environment = var.environment
   }
-} 
\ No newline at end of file
+} 
+resource "aws_dynamodb_table" "retrieval_cache" {
+  name           = "${var.project_name}-retrieval-cache"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "cacheKey"
+
+  attribute {
+    name = "cacheKey"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiresAt"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "${var.project_name}-retrieval-cache"
+    Environment = var.environment
+  }
+}
+
+# One item per distinct uploaded file, keyed on the SHA-256 of its content
+resource "aws_dynamodb_table" "documents" {
+  name           = "${var.project_name}-documents"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "contentHash"
+
+  attribute {
+    name = "contentHash"
+    type = "S"
+  }
+
+  tags = {
+    Name        = "${var.project_name}-documents"
+    Environment = var.environment
+  }
+}
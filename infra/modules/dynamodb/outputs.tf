@@ -4,4 +4,11 @@ output "chats_table_name" {
 
 output "messages_table_name" {
   value = aws_dynamodb_table.messages.name
-} 
\ No newline at end of file
+} 
+output "retrieval_cache_table_name" {
+  value = aws_dynamodb_table.retrieval_cache.name
+}
+
+output "documents_table_name" {
+  value = aws_dynamodb_table.documents.name
+}
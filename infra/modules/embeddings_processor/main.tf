@@ -12,6 +12,7 @@ resource "aws_lambda_function" "embeddings_processor" {
   runtime         = "python3.9"
   timeout         = 300
   memory_size     = 1024
+  layers          = [var.dependencies_layer_arn]
   source_code_hash = data.archive_file.lambda_zip.output_base64sha256
 
   environment {
@@ -20,6 +21,10 @@ resource "aws_lambda_function" "embeddings_processor" {
       SNS_TOPIC_ARN   = var.notification_topic_arn
       KENDRA_INDEX_ID = var.kendra_index_id
       S3_BUCKET_NAME  = var.s3_bucket_name
+      RETRIEVAL_CACHE_TABLE = var.retrieval_cache_table_name
+      DOCUMENTS_TABLE = var.documents_table_name
+      TEXTRACT_SNS_TOPIC_ARN = aws_sns_topic.textract_completion.arn
+      TEXTRACT_ROLE_ARN      = aws_iam_role.textract_publish.arn
     }
   }
 }
@@ -28,8 +33,11 @@ resource "aws_lambda_function" "embeddings_processor" {
 resource "aws_lambda_event_source_mapping" "sqs_trigger" {
   event_source_arn = var.queue_arn
   function_name    = aws_lambda_function.embeddings_processor.function_name
-  batch_size       = 1
+  batch_size       = var.batch_size
   enabled          = true
+
+  maximum_batching_window_in_seconds = 5
+  function_response_types            = ["ReportBatchItemFailures"]
 }
 
 # Allow SQS to invoke the Lambda function
@@ -39,4 +47,112 @@ resource "aws_lambda_permission" "sqs_invoke" {
   function_name = aws_lambda_function.embeddings_processor.function_name
   principal     = "sqs.amazonaws.com"
   source_arn    = var.queue_arn
-} 
\ No newline at end of file
+} 
+# Textract announces job completion on this topic, so the Lambda does not
+# have to poll get_document_analysis while the job runs
+resource "aws_sns_topic" "textract_completion" {
+  name = "${var.lambda_name}-textract-completion"
+}
+
+resource "aws_iam_role" "textract_publish" {
+  name = "${var.lambda_name}-textract-publish"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "textract.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "textract_publish" {
+  name = "textract-publish"
+  role = aws_iam_role.textract_publish.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["sns:Publish"]
+        Resource = aws_sns_topic.textract_completion.arn
+      }
+    ]
+  })
+}
+
+# The Lambda passes the publish role to Textract when starting a job
+resource "aws_iam_role_policy" "lambda_pass_textract_role" {
+  name = "${var.lambda_name}-pass-textract-role"
+  role = element(split("/", var.lambda_role_arn), length(split("/", var.lambda_role_arn)) - 1)
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["iam:PassRole"]
+        Resource = aws_iam_role.textract_publish.arn
+      }
+    ]
+  })
+}
+
+resource "aws_sns_topic_subscription" "textract_completion" {
+  topic_arn = aws_sns_topic.textract_completion.arn
+  protocol  = "lambda"
+  endpoint  = aws_lambda_function.embeddings_processor.arn
+}
+
+resource "aws_lambda_permission" "sns_invoke" {
+  statement_id  = "AllowTextractCompletionSNS"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.embeddings_processor.function_name
+  principal     = "sns.amazonaws.com"
+  source_arn    = aws_sns_topic.textract_completion.arn
+}
+
+# Retrain the IVF centroids regularly, so lists stay balanced as documents
+# are added. A rebuild step that runs out of time invokes the function again
+# to carry on.
+resource "aws_cloudwatch_event_rule" "rebuild_ivf" {
+  name                = "${var.lambda_name}-rebuild-ivf"
+  description         = "Retrain and repartition the vector index"
+  schedule_expression = var.ivf_rebuild_schedule
+}
+
+resource "aws_cloudwatch_event_target" "rebuild_ivf" {
+  rule  = aws_cloudwatch_event_rule.rebuild_ivf.name
+  arn   = aws_lambda_function.embeddings_processor.arn
+  input = jsonencode({ action = "rebuild_ivf" })
+}
+
+resource "aws_lambda_permission" "events_invoke" {
+  statement_id  = "AllowIVFRebuildSchedule"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.embeddings_processor.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.rebuild_ivf.arn
+}
+
+resource "aws_iam_role_policy" "lambda_invoke_self" {
+  name = "${var.lambda_name}-invoke-self"
+  role = element(split("/", var.lambda_role_arn), length(split("/", var.lambda_role_arn)) - 1)
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["lambda:InvokeFunction"]
+        Resource = aws_lambda_function.embeddings_processor.arn
+      }
+    ]
+  })
+}
@@ -41,4 +41,31 @@ variable "kendra_index_id" {
 variable "s3_bucket_name" {
   description = "Name of the S3 bucket"
   type        = string
-}
\ No newline at end of file
+}
+
+variable "retrieval_cache_table_name" {
+  description = "Name of the DynamoDB table caching retrieval results"
+  type        = string
+}
+
+variable "documents_table_name" {
+  description = "Name of the DynamoDB table deduplicating uploads by content hash"
+  type        = string
+}
+
+variable "batch_size" {
+  description = "Maximum number of SQS messages handed to one invocation"
+  type        = number
+  default     = 10
+}
+
+variable "dependencies_layer_arn" {
+  description = "ARN of the layer holding the packages in requirements.txt"
+  type        = string
+}
+
+variable "ivf_rebuild_schedule" {
+  description = "EventBridge schedule expression for retraining the vector index IVF centroids"
+  type        = string
+  default     = "rate(7 days)"
+}
@@ -32,6 +32,34 @@ resource "aws_s3_bucket_public_access_block" "knowledge_base" {
   restrict_public_buckets = true
 }
 
+# Browsers upload straight to the bucket with presigned POSTs and part URLs
+resource "aws_s3_bucket_cors_configuration" "knowledge_base" {
+  bucket = aws_s3_bucket.knowledge_base.id
+
+  cors_rule {
+    allowed_origins = var.upload_allowed_origins
+    allowed_methods = ["POST", "PUT"]
+    allowed_headers = ["*"]
+    expose_headers  = ["ETag"]
+    max_age_seconds = 300
+  }
+}
+
+resource "aws_s3_bucket_lifecycle_configuration" "knowledge_base" {
+  bucket = aws_s3_bucket.knowledge_base.id
+
+  rule {
+    id     = "abort-incomplete-uploads"
+    status = "Enabled"
+
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
+
 output "bucket_name" {
   value = aws_s3_bucket.knowledge_base.id
 }
@@ -2,4 +2,10 @@ variable "environment" {
   description = "Environment name (e.g., dev, prod)"
   type        = string
   default     = "dev"
-} 
\ No newline at end of file
+} 
+
+variable "upload_allowed_origins" {
+  description = "Origins allowed to upload directly to the bucket"
+  type        = list(string)
+  default     = ["*"]  # In production, restrict this to your Amplify domain
+}
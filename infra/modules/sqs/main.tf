@@ -1,9 +1,20 @@
+resource "aws_sqs_queue" "file_processing_dlq" {
+  name                      = "${var.queue_name}-dlq"
+  message_retention_seconds = 1209600  # 14 days
+}
+
 resource "aws_sqs_queue" "file_processing_queue" {
   name                      = var.queue_name
   message_retention_seconds = 86400  # 1 day
   visibility_timeout_seconds = 900   # 15 minutes
   delay_seconds             = 0
   receive_wait_time_seconds = 20     # Enable long polling
+
+  # Files that keep failing are parked instead of being retried forever
+  redrive_policy = jsonencode({
+    deadLetterTargetArn = aws_sqs_queue.file_processing_dlq.arn
+    maxReceiveCount     = 3
+  })
 }
 
 # IAM role for Lambda to access SQS
@@ -0,0 +1,109 @@
+"""Create the title marker items of chats that were created before markers existed.
+
+create_chat claims a title with a marker item (userId, 'title#<title>'), so
+a title that has no marker can be reused. Run this once per environment
+after deploying the marker change:
+
+    python scripts/backfill_title_markers.py --project-name <project> [--dry-run]
+
+A marker is only written where no other chat holds the title, the check
+create_chat relies on, so the backfill can run while users create chats
+and can be re-run safely. When
+a user already has several chats with one title, the first one scanned
+gets the marker and the others are reported.
+"""
+import os
+import sys
+import argparse
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'apps', 'api'))
+
+from services.chat_service import TITLE_MARKER_PREFIX  # noqa: E402
+from utils.throttle import CapacityLimiter  # noqa: E402
+
+logger = logging.getLogger('backfill_title_markers')
+
+
+def backfill_title_markers(table, limiter: Optional[CapacityLimiter] = None,
+                           dry_run: bool = False) -> Dict[str, int]:
+    """Write a marker for every chat whose title has none.
+
+    Returns counts of the chats scanned, the markers created, the chats that
+    already had theirs and the chats whose title another chat holds.
+    """
+    counts = {'chats': 0, 'created': 0, 'existing': 0, 'duplicates': 0}
+    # What a dry run would have written so far: marker key -> chatId
+    planned: Dict[Tuple[str, str], str] = {}
+    scan_kwargs = {
+        # Marker items share the table but are not chats
+        'FilterExpression': 'attribute_not_exists(titleOf)',
+        'ProjectionExpression': 'userId, chatId, title, created_at',
+        'ReturnConsumedCapacity': 'TOTAL'
+    }
+    while True:
+        if limiter:
+            limiter.wait()
+        response = table.scan(**scan_kwargs)
+        if limiter:
+            limiter.charge(response.get('ConsumedCapacity', {}).get('CapacityUnits', 0))
+
+        for chat in response.get('Items', []):
+            if chat['chatId'].startswith(TITLE_MARKER_PREFIX) or 'title' not in chat:
+                continue
+            counts['chats'] += 1
+            outcome = _claim_title(table, chat, planned if dry_run else None)
+            counts[outcome] += 1
+
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def _claim_title(table, chat: Dict[str, Any], planned: Optional[Dict[Tuple[str, str], str]]) -> str:
+    marker_key = {'userId': chat['userId'], 'chatId': f"{TITLE_MARKER_PREFIX}{chat['title']}"}
+    if planned is not None:
+        existing = table.get_item(Key=marker_key, ConsistentRead=True).get('Item')
+        holder = existing['titleOf'] if existing else planned.setdefault(tuple(marker_key.values()), chat['chatId'])
+        if holder != chat['chatId']:
+            return 'duplicates'
+        return 'existing' if existing else 'created'
+
+    try:
+        # A marker this chat already holds is rewritten as is, so re-runs succeed
+        previous = table.put_item(
+            Item={**marker_key, 'titleOf': chat['chatId'], 'created_at': chat.get('created_at')},
+            ConditionExpression='attribute_not_exists(chatId) OR titleOf = :chatId',
+            ExpressionAttributeValues={':chatId': chat['chatId']},
+            ReturnValues='ALL_OLD'
+        ).get('Attributes')
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        logger.warning("Chat %s of %s duplicates the title %r, left without a marker",
+                       chat['chatId'], chat['userId'], chat['title'])
+        return 'duplicates'
+    return 'existing' if previous else 'created'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--project-name', default=os.environ.get('PROJECT_NAME'),
+                        required='PROJECT_NAME' not in os.environ)
+    parser.add_argument('--rcu-per-second', type=float, default=50,
+                        help='read capacity the scan may use per second')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be written')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    table = boto3.resource('dynamodb').Table(f"{args.project_name}-chats")
+    counts = backfill_title_markers(table, CapacityLimiter(args.rcu_per_second), args.dry_run)
+    logger.info("Backfilled %s: %s", table.name, counts)
+
+
+if __name__ == '__main__':
+    main()
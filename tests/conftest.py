@@ -0,0 +1,142 @@
+"""Shared fixtures for the Lambda tests and benchmarks.
+
+Both Lambdas are imported straight from their source folders, the way they
+are packaged, and every boto3 client they create is wrapped in a botocore
+Stubber, so nothing here talks to AWS.
+"""
+import os
+import sys
+import time
+import statistics
+from typing import Dict, Any, List
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'apps', 'api'))
+sys.path.insert(0, os.path.join(ROOT, 'apps', 'embeddings_processor'))
+# Shipped to both Lambdas in their dependency layers
+sys.path.insert(0, os.path.join(ROOT, 'apps', 'shared'))
+
+os.environ.update({
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_XRAY_SDK_ENABLED': 'false',
+    'AWS_XRAY_CONTEXT_MISSING': 'IGNORE_ERROR',
+    'PROJECT_NAME': 'rag-test',
+    'KENDRA_INDEX_ID': 'test-index',
+    'S3_BUCKET_NAME': 'rag-test-documents',
+})
+
+_benchmarks: List[Any] = []
+
+
+class StubbedAWS:
+    """Hands out one stubbed boto3 client per service.
+
+    Every client or resource the code under test creates shares that
+    service's client, so responses queued on ``stubber(name)`` are served
+    whichever way the code reached it. ``created`` lists each factory call.
+    """
+
+    def __init__(self):
+        self.clients: Dict[str, Any] = {}
+        self.stubbers: Dict[str, Stubber] = {}
+        self.created: List[str] = []
+        self._client = boto3.client
+        self._resource = boto3.resource
+
+    def client(self, service_name, *args, **kwargs):
+        self.created.append(service_name)
+        if service_name not in self.clients:
+            client = self._client(service_name, *args, **kwargs)
+            self.clients[service_name] = client
+            self.stubbers[service_name] = Stubber(client)
+            self.stubbers[service_name].activate()
+        return self.clients[service_name]
+
+    def resource(self, service_name, *args, **kwargs):
+        client = self.client(service_name, *args, **kwargs)
+        resource = self._resource(service_name, *args, **kwargs)
+        resource.meta.client = client
+        return resource
+
+    def stubber(self, service_name: str) -> Stubber:
+        """The Stubber of a service, creating its client if nothing has yet"""
+        if service_name not in self.stubbers:
+            self.client(service_name)
+        return self.stubbers[service_name]
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    """Stub every boto3 client and resource created during the test"""
+    from services.registry import reset_services
+
+    reset_services()
+    stubbed = StubbedAWS()
+    monkeypatch.setattr(boto3, 'client', stubbed.client)
+    monkeypatch.setattr(boto3, 'resource', stubbed.resource)
+    yield stubbed
+    reset_services()
+
+
+@pytest.fixture
+def processor(aws, monkeypatch):
+    """The embeddings processor module wired to fakes, with a stubbed Textract client"""
+    import embeddings_processor
+    from fakes import FakeDocumentsClient, FakeKendra, FakeS3, FakeSNS
+
+    monkeypatch.setenv('DOCUMENTS_TABLE', 'rag-test-documents')
+    monkeypatch.setenv('SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:notifications')
+    monkeypatch.delenv('TEXTRACT_SNS_TOPIC_ARN', raising=False)
+    monkeypatch.delenv('TEXTRACT_ROLE_ARN', raising=False)
+    fakes = {
+        's3': FakeS3(),
+        'dynamodb': FakeDocumentsClient(),
+        'kendra': FakeKendra(),
+        'sns': FakeSNS(),
+        'textract': aws.client('textract'),
+    }
+    for name, client in fakes.items():
+        monkeypatch.setattr(embeddings_processor, name, client)
+    embeddings_processor.textract_stub = aws.stubber('textract')
+    return embeddings_processor
+
+
+@pytest.fixture
+def bench(request):
+    """Record named metrics; they are printed after the test run"""
+    def record(**metrics):
+        _benchmarks.append((request.node.nodeid, metrics))
+    return record
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def timed_ms(func, *args, **kwargs):
+    """Run func and return (result, elapsed milliseconds)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    return {
+        'p50_ms': round(statistics.median(samples), 2),
+        'p99_ms': round(percentile(samples, 0.99), 2),
+    }
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _benchmarks:
+        return
+    terminalreporter.section('benchmarks')
+    for nodeid, metrics in _benchmarks:
+        terminalreporter.write_line(f"{nodeid}: " + ', '.join(f"{k}={v}" for k, v in metrics.items()))
@@ -0,0 +1,514 @@
+"""In-memory stand-ins for the backends a chat turn talks to concurrently.
+
+Stubber queues responses in order, which suits sequential calls; a turn
+writes, retrieves and reads history on a thread pool at the same time, so
+those backends are faked here instead, with optional injected latency.
+"""
+import io
+import re
+import json
+import random
+import time
+import hashlib
+import threading
+from typing import Dict, Any, List, Optional
+
+import botocore.session
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from services.retrieval import Passage, RetrievalBackend
+from utils.errors import APIError
+
+_deserializer = TypeDeserializer()
+
+
+def client_error(code: str, operation: str = 'InvokeModel') -> ClientError:
+    return ClientError({'Error': {'Code': code, 'Message': code}}, operation)
+
+
+def fake_event_stream(texts: List[str], input_tokens: int = 10) -> List[Dict[str, Any]]:
+    """The events of a Bedrock invoke_model_with_response_stream body for a reply"""
+    payloads = [{'type': 'message_start', 'message': {'usage': {'input_tokens': input_tokens}}}]
+    payloads += [{'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': text}} for text in texts]
+    payloads.append({'type': 'message_delta', 'usage': {'output_tokens': len(texts)}})
+    payloads.append({'type': 'message_stop'})
+    return [{'chunk': {'bytes': json.dumps(payload).encode('utf-8')}} for payload in payloads]
+
+
+class FakeBedrock:
+    """bedrock-runtime client returning a canned reply after ``latency`` seconds.
+
+    ``errors`` is a list of error codes raised by the next calls, in order.
+    """
+
+    def __init__(self, reply: str = 'The answer.', latency: float = 0.0,
+                 errors: Optional[List[str]] = None):
+        self.reply = reply
+        self.latency = latency
+        self.errors = list(errors or [])
+        self.calls: List[str] = []
+        self._lock = threading.Lock()
+
+    def _begin(self, model_id: str) -> None:
+        with self._lock:
+            self.calls.append(model_id)
+            error = self.errors.pop(0) if self.errors else None
+        time.sleep(self.latency)
+        if error:
+            raise client_error(error)
+
+    def invoke_model(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        self._begin(modelId)
+        response = {
+            'content': [{'type': 'text', 'text': self.reply}],
+            'usage': {'input_tokens': len(body) // 4, 'output_tokens': len(self.reply) // 4}
+        }
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        self._begin(modelId)
+        words = self.reply.split(' ')
+        return {'body': fake_event_stream([word + ' ' for word in words[:-1]] + words[-1:])}
+
+
+class FakeRetriever(RetrievalBackend):
+    name = 'fake'
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.queries: List[str] = []
+        self._lock = threading.Lock()
+
+    def retrieve(self, query: str, top_k: int = 3) -> List[Passage]:
+        with self._lock:
+            self.queries.append(query)
+        time.sleep(self.latency)
+        return [Passage(title='handbook.pdf', text=f'About {query}', document_id='doc-1')]
+
+
+class FakeChatStore:
+    """Chats and messages behind the TurnStore interface, plus history reads"""
+
+    def __init__(self, owners: Dict[str, str], write_latency: float = 0.0, read_latency: float = 0.0):
+        self.owners = owners
+        self.write_latency = write_latency
+        self.read_latency = read_latency
+        self.messages: Dict[str, List[Dict[str, Any]]] = {}
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def _write(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        time.sleep(self.write_latency)
+        with self._lock:
+            self.writes += 1
+            if self.owners.get(message['chatId']) != message['userId']:
+                raise APIError('Chat not found', 404)
+            self.messages.setdefault(message['chatId'], []).append(message)
+        return message
+
+    def save_user_message(self, chat_id: str, user_id: str, content: str, now: int) -> Dict[str, Any]:
+        return self._write({'chatId': chat_id, 'messageId': f"msg_{now}_user", 'userId': user_id,
+                            'author': 'user', 'message': content, 'timestamp': now})
+
+    def save_assistant_message(self, chat_id: str, user_id: str, content: str, now: int,
+                               usage: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        message = {'chatId': chat_id, 'messageId': f"msg_{now + 1}_assistant", 'userId': user_id,
+                   'author': 'assistant', 'message': content, 'timestamp': now + 1000}
+        if usage:
+            message['usage'] = usage
+        return self._write(message)
+
+    def get_recent(self, chat_id: str, exclude_message_id: str = None) -> List[Dict[str, Any]]:
+        time.sleep(self.read_latency)
+        with self._lock:
+            return [item for item in self.messages.get(chat_id, []) if item['messageId'] != exclude_message_id]
+
+
+def fake_chat_service(service, owners: Dict[str, str], bedrock: FakeBedrock = None,
+                      retriever: FakeRetriever = None, store: FakeChatStore = None):
+    """Point a ChatService at fakes; returns (store, retriever, bedrock)"""
+    store = store or FakeChatStore(owners)
+    retriever = retriever or FakeRetriever()
+    bedrock = bedrock or FakeBedrock()
+    service.turns = store
+    service.history.get_recent = store.get_recent
+    service.retriever = retriever
+    service.generator.bedrock = bedrock
+    return store, retriever, bedrock
+
+
+class FakeMessagesTable:
+    """The messages table queries ChatHistoryManager makes, over a list of items"""
+
+    def __init__(self):
+        self.items: List[Dict[str, Any]] = []
+        self.queries = 0
+
+    def add(self, chat_id: str, author: str, message: str, timestamp: int) -> Dict[str, Any]:
+        item = {'chatId': chat_id, 'messageId': f"msg_{timestamp}_{author}", 'author': author,
+                'message': message, 'timestamp': timestamp}
+        self.items.append(item)
+        return item
+
+    def query(self, KeyConditionExpression: str, ExpressionAttributeValues: Dict[str, Any],
+              ScanIndexForward: bool = True, Limit: int = None, ExclusiveStartKey=None, **kwargs):
+        self.queries += 1
+        values = ExpressionAttributeValues
+        if 'BETWEEN' in KeyConditionExpression and values[':from'] > values[':to']:
+            raise client_error('ValidationException', 'Query')
+        items = sorted((item for item in self.items if item['chatId'] == values[':chatId']),
+                       key=lambda item: item['messageId'], reverse=not ScanIndexForward)
+        if 'BETWEEN' in KeyConditionExpression:
+            items = [item for item in items if values[':from'] <= item['messageId'] <= values[':to']]
+        elif '<=' in KeyConditionExpression:
+            items = [item for item in items if item['messageId'] <= values[':to']]
+        elif ':to' in values:
+            items = [item for item in items if item['messageId'] < values[':to']]
+        if ExclusiveStartKey:
+            position = [item['messageId'] for item in items].index(ExclusiveStartKey['messageId'])
+            items = items[position + 1:]
+        page = items[:Limit] if Limit else items
+        response = {'Items': page}
+        if Limit and len(items) > Limit:
+            response['LastEvaluatedKey'] = {'chatId': values[':chatId'], 'messageId': page[-1]['messageId']}
+        return response
+
+
+class FakeChatsTable:
+    """The conditional anchor and summary updates ChatHistoryManager makes on chat items"""
+
+    def __init__(self, chats: List[Dict[str, Any]]):
+        self.chats = {chat['chatId']: dict(chat) for chat in chats}
+        self._lock = threading.Lock()
+
+    def update_item(self, Key: Dict[str, Any], UpdateExpression: str, ExpressionAttributeValues: Dict[str, Any],
+                    ConditionExpression: str = None, **kwargs):
+        values = ExpressionAttributeValues
+        with self._lock:
+            chat = self.chats[Key['chatId']]
+            if ConditionExpression == 'attribute_not_exists(summarizedThrough)':
+                passed = 'summarizedThrough' not in chat
+            elif ConditionExpression == 'summarizedThrough = :previous':
+                passed = chat.get('summarizedThrough') == values[':previous']
+            else:
+                passed = ConditionExpression is None
+            if not passed:
+                raise client_error('ConditionalCheckFailedException', 'UpdateItem')
+            if ':summary' in values:
+                chat['historySummary'] = values[':summary']
+            chat['summarizedThrough'] = values[':through']
+        return {}
+
+
+class FakeChatItems:
+    """The chats table with its title markers, for create_chat and the marker backfill.
+
+    Serves the resource-level scan/put_item/get_item the backfill makes and,
+    as ``meta.client``, the TransactWriteItems create_chat makes; both see
+    the same items under one lock, so transactions are all-or-nothing.
+    """
+
+    name = 'rag-test-chats'
+
+    def __init__(self, chats: List[Dict[str, Any]] = ()):
+        self.items = {(chat['userId'], chat['chatId']): dict(chat) for chat in chats}
+        self.meta = self
+        self.client = self
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _deserialize(item: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+    def scan(self, ExclusiveStartKey: Dict[str, Any] = None, Limit: int = 2, **kwargs):
+        with self._lock:
+            keys = sorted(self.items)
+        if ExclusiveStartKey:
+            keys = keys[keys.index((ExclusiveStartKey['userId'], ExclusiveStartKey['chatId'])) + 1:]
+        page = keys[:Limit]
+        response = {'Items': [dict(self.items[key]) for key in page if 'titleOf' not in self.items[key]]}
+        if len(keys) > Limit:
+            response['LastEvaluatedKey'] = {'userId': page[-1][0], 'chatId': page[-1][1]}
+        return response
+
+    def get_item(self, Key: Dict[str, Any], **kwargs):
+        with self._lock:
+            item = self.items.get((Key['userId'], Key['chatId']))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item: Dict[str, Any], ConditionExpression: str,
+                 ExpressionAttributeValues: Dict[str, Any], ReturnValues: str = None, **kwargs):
+        key = (Item['userId'], Item['chatId'])
+        with self._lock:
+            previous = self.items.get(key)
+            if previous and previous.get('titleOf') != ExpressionAttributeValues[':chatId']:
+                raise client_error('ConditionalCheckFailedException', 'PutItem')
+            self.items[key] = dict(Item)
+        return {'Attributes': previous} if previous and ReturnValues == 'ALL_OLD' else {}
+
+    def transact_write_items(self, TransactItems: List[Dict[str, Any]]):
+        puts = [self._deserialize(entry['Put']['Item']) for entry in TransactItems]
+        with self._lock:
+            reasons = [{'Code': 'ConditionalCheckFailed' if (item['userId'], item['chatId']) in self.items
+                        else 'None'} for item in puts]
+            if any(reason['Code'] != 'None' for reason in reasons):
+                error = client_error('TransactionCanceledException', 'TransactWriteItems')
+                error.response['CancellationReasons'] = reasons
+                raise error
+            for item in puts:
+                self.items[(item['userId'], item['chatId'])] = item
+        return {}
+
+    def chats(self, user_id: str) -> List[Dict[str, Any]]:
+        return [item for (user, _), item in self.items.items() if user == user_id and 'titleOf' not in item]
+
+
+class FakeS3:
+    """An in-memory bucket behind the S3 client calls the index code makes"""
+
+    def __init__(self):
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self.gets = 0
+        self.bytes_read = 0
+        # Real modeled exceptions, so ``except s3.exceptions.NoSuchKey`` works
+        self.exceptions = botocore.session.get_session().create_client(
+            's3', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'
+        ).exceptions
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', Metadata: Dict[str, str] = None,
+                   ContentType: str = 'binary/octet-stream', ChecksumSHA256: str = None, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self.objects[Key] = {'Body': data, 'Metadata': dict(Metadata or {}), 'ETag': etag,
+                             'ContentType': ContentType, 'ChecksumSHA256': ChecksumSHA256}
+        return {'ETag': etag}
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, ExtraArgs: Dict[str, Any] = None, **kwargs):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read(), **(ExtraArgs or {}))
+
+    def _object(self, key: str, operation: str) -> Dict[str, Any]:
+        if key not in self.objects:
+            raise self.exceptions.NoSuchKey({'Error': {'Code': 'NoSuchKey', 'Message': key}}, operation)
+        return self.objects[key]
+
+    def get_object(self, Bucket: str, Key: str, Range: str = None, **kwargs):
+        self.gets += 1
+        stored = self._object(Key, 'GetObject')
+        data = stored['Body']
+        if Range:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1 if end else None]
+        self.bytes_read += len(data)
+        return {'Body': StreamingBody(io.BytesIO(data), len(data)), 'ContentLength': len(data),
+                'Metadata': dict(stored['Metadata']), 'ETag': stored['ETag']}
+
+    def head_object(self, Bucket: str, Key: str, ChecksumMode: str = None, **kwargs):
+        stored = self._object(Key, 'HeadObject')
+        response = {'ContentLength': len(stored['Body']), 'Metadata': dict(stored['Metadata']),
+                    'ETag': stored['ETag'], 'ContentType': stored['ContentType']}
+        if ChecksumMode == 'ENABLED' and stored['ChecksumSHA256']:
+            response['ChecksumSHA256'] = stored['ChecksumSHA256']
+        return response
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        self.objects.pop(Key, None)
+        return {}
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **kwargs):
+        with open(Filename, 'wb') as f:
+            f.write(self._object(Key, 'GetObject')['Body'])
+
+    def get_paginator(self, operation: str):
+        assert operation == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket: str, Prefix: str = ''):
+        yield {'Contents': [{'Key': key, 'ETag': stored['ETag'], 'Size': len(stored['Body'])}
+                            for key, stored in sorted(self.objects.items()) if key.startswith(Prefix)]}
+
+
+class FakeDocumentsClient:
+    """Low-level DynamoDB client over the documents (dedup and checkpoint) table.
+
+    Evaluates the SET/REMOVE/ADD updates and the OR-of-ANDs conditions the
+    embeddings processor writes; other tables (e.g. the retrieval cache)
+    are accepted and ignored.
+    """
+
+    def __init__(self):
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.history: List[str] = []
+        self._lock = threading.Lock()
+        self.exceptions = botocore.session.get_session().create_client(
+            'dynamodb', region_name='us-east-1', aws_access_key_id='testing', aws_secret_access_key='testing'
+        ).exceptions
+
+    def get_item(self, TableName: str, Key: Dict[str, Any], ProjectionExpression: str = None,
+                 ExpressionAttributeNames: Dict[str, str] = None, **kwargs):
+        with self._lock:
+            item = self.items.get(Key['contentHash']['S'])
+            if not item:
+                return {}
+            if ProjectionExpression:
+                names = ExpressionAttributeNames or {}
+                wanted = {names.get(name, name) for name in ProjectionExpression.split(', ')}
+                item = {name: value for name, value in item.items() if name in wanted}
+            return {'Item': json.loads(json.dumps(item))}
+
+    @staticmethod
+    def _scalar(value: Dict[str, Any]):
+        (kind, raw), = value.items()
+        return float(raw) if kind == 'N' else raw
+
+    def _holds(self, item: Optional[Dict[str, Any]], condition: str, names, values) -> bool:
+        def term(text: str) -> bool:
+            text = text.strip().lstrip('(').rstrip(')') if text.count('(') != text.count(')') else text.strip()
+            if text.startswith('attribute_not_exists('):
+                return item is None or text[len('attribute_not_exists('):-1] not in item
+            name, operator, value = text.split(' ')
+            current = (item or {}).get(names.get(name, name))
+            if current is None:
+                return operator == '<>'
+            left, right = self._scalar(current), self._scalar(values[value])
+            return {'=': left == right, '<>': left != right, '<': left < right}[operator]
+
+        return any(all(term(part) for part in group.split(' AND ')) for group in condition.split(' OR '))
+
+    def update_item(self, TableName: str, Key: Dict[str, Any], UpdateExpression: str,
+                    ExpressionAttributeValues: Dict[str, Any], ExpressionAttributeNames: Dict[str, str] = None,
+                    ConditionExpression: str = None, ReturnValues: str = None, **kwargs):
+        if 'contentHash' not in Key:
+            return {'Attributes': {'version': {'N': '1'}}}
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues
+        content_hash = Key['contentHash']['S']
+        with self._lock:
+            existing = self.items.get(content_hash)
+            if ConditionExpression and not self._holds(existing, ConditionExpression, names, values):
+                raise self.exceptions.ConditionalCheckFailedException(
+                    {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': 'The conditional request failed'}},
+                    'UpdateItem'
+                )
+            item = self.items.setdefault(content_hash, {'contentHash': Key['contentHash']})
+            clauses = re.split(r'\b(SET|REMOVE|ADD) ', UpdateExpression)[1:]
+            for action, body in zip(clauses[::2], clauses[1::2]):
+                for part in (p.strip() for p in re.split(r',\s*(?![^()]*\))', body)):
+                    if action == 'REMOVE':
+                        item.pop(part, None)
+                    elif action == 'ADD':
+                        name, value = part.split(' ')
+                        if 'N' in values[value]:
+                            total = float(item.get(name, {'N': '0'})['N']) + float(values[value]['N'])
+                            item[name] = {'N': str(int(total))}
+                        else:
+                            item[name] = {'SS': sorted(set(item.get(name, {'SS': []})['SS']) | set(values[value]['SS']))}
+                    else:
+                        name, value = part.split(' = ')
+                        name = names.get(name, name)
+                        if value.startswith('if_not_exists('):
+                            if name in item:
+                                continue
+                            value = value[:-1].split(', ')[1]
+                        item[name] = values[value]
+                        if name == 'status':
+                            self.history.append(values[value]['S'])
+            return {'Attributes': json.loads(json.dumps(item))} if ReturnValues == 'ALL_NEW' else {}
+
+    def status(self, content_hash: str) -> Optional[str]:
+        return self.items.get(content_hash, {}).get('status', {}).get('S')
+
+
+class FakeKendra:
+    """Documents put are reported PROCESSING for indexing_delay seconds, then INDEXED"""
+
+    def __init__(self, latency: float = 0.0, indexing_delay: float = 0.0):
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self.batches = 0
+        self.latency = latency
+        self.indexing_delay = indexing_delay
+        self._put_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def batch_put_document(self, IndexId: str, Documents: List[Dict[str, Any]]):
+        time.sleep(self.latency)
+        with self._lock:
+            self.batches += 1
+            for document in Documents:
+                self.documents[document['Id']] = document
+                self._put_at[document['Id']] = time.monotonic()
+        return {'FailedDocuments': []}
+
+    def indexed(self, document_id: str) -> bool:
+        put_at = self._put_at.get(document_id)
+        return put_at is not None and time.monotonic() - put_at >= self.indexing_delay
+
+    def batch_get_document_status(self, IndexId: str, DocumentInfoList: List[Dict[str, Any]]):
+        assert len(DocumentInfoList) <= 10
+        statuses = []
+        for info in DocumentInfoList:
+            doc_id = info['DocumentId']
+            status = 'INDEXED' if self.indexed(doc_id) else 'PROCESSING' if doc_id in self._put_at else 'NOT_FOUND'
+            statuses.append({'DocumentId': doc_id, 'DocumentStatus': status})
+        return {'Errors': [], 'DocumentStatusList': statuses}
+
+
+class FakeSNS:
+    def __init__(self):
+        self.messages: List[Dict[str, str]] = []
+
+    def publish(self, TopicArn: str, Subject: str, Message: str, **kwargs):
+        # list.append is atomic, so concurrent files can publish without a lock
+        self.messages.append({'Subject': Subject, 'Message': Message})
+        return {'MessageId': str(len(self.messages))}
+
+    def subjects(self) -> List[str]:
+        return [message['Subject'] for message in self.messages]
+
+
+def make_pdf(pages: List[str], image_bytes: int = 50_000) -> bytes:
+    """Build a PDF whose pages are either 'text' (a text layer) or 'scan' (one grey image, no text)"""
+    from pypdf import PdfWriter
+    from pypdf.generic import ArrayObject, DecodedStreamObject, DictionaryObject, NameObject, NumberObject
+
+    writer = PdfWriter()
+    font = None
+    for position, kind in enumerate(pages, start=1):
+        page = writer.add_blank_page(612, 792)
+        content = DecodedStreamObject()
+        if kind == 'text':
+            if font is None:
+                font = writer._add_object(DictionaryObject({
+                    NameObject('/Type'): NameObject('/Font'),
+                    NameObject('/Subtype'): NameObject('/Type1'),
+                    NameObject('/BaseFont'): NameObject('/Helvetica'),
+                }))
+            sentences = ' '.join(
+                f"(Page {position} sentence {i} about quarterly revenue and costs.) Tj 0 -14 Td" for i in range(8)
+            )
+            content.set_data(f"BT /F1 11 Tf 72 720 Td {sentences} ET".encode('latin-1'))
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/Font'): DictionaryObject({NameObject('/F1'): font})
+            })
+        else:
+            width = 250
+            image = DecodedStreamObject()
+            image.set_data(random.Random(position).randbytes(width * (image_bytes // width)))
+            image.update({
+                NameObject('/Type'): NameObject('/XObject'),
+                NameObject('/Subtype'): NameObject('/Image'),
+                NameObject('/Width'): NumberObject(width),
+                NameObject('/Height'): NumberObject(image_bytes // width),
+                NameObject('/ColorSpace'): NameObject('/DeviceGray'),
+                NameObject('/BitsPerComponent'): NumberObject(8),
+            })
+            content.set_data(b"q 612 0 0 792 0 0 cm /Im0 Do Q")
+            page[NameObject('/Resources')] = DictionaryObject({
+                NameObject('/XObject'): DictionaryObject({NameObject('/Im0'): writer._add_object(image)}),
+                NameObject('/ProcSet'): ArrayObject([NameObject('/PDF'), NameObject('/ImageB')]),
+            })
+        page[NameObject('/Contents')] = writer._add_object(content)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
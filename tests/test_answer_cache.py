@@ -0,0 +1,36 @@
+"""Semantic answer cache: questions are only embedded for turns without history"""
+import numpy as np
+
+from fakes import fake_chat_service
+
+
+class CountingEmbedder:
+    name = 'counting'
+    dimension = 8
+
+    def __init__(self):
+        self.texts = []
+
+    def embed(self, texts):
+        self.texts.extend(texts)
+        return np.ones((len(texts), self.dimension), dtype=np.float32) / np.sqrt(self.dimension)
+
+
+def test_question_is_embedded_only_when_the_history_is_empty(aws):
+    from services.answer_cache import AnswerCache
+    from services.registry import get_chat_service
+
+    service = get_chat_service()
+    embedder = CountingEmbedder()
+    service.answer_cache = AnswerCache(embedder)
+    owners = {'new-chat': 'user-1', 'old-chat': 'user-1'}
+    store, _, bedrock = fake_chat_service(service, owners)
+    store.messages['old-chat'] = [{'chatId': 'old-chat', 'messageId': 'msg_1_user', 'userId': 'user-1',
+                                   'author': 'user', 'message': 'Earlier question?', 'timestamp': 1}]
+
+    service.send_message('old-chat', 'What is the leave policy?', 'user-1')
+    assert embedder.texts == []
+
+    service.send_message('new-chat', 'What is the leave policy?', 'user-1')
+    assert embedder.texts == ['what is the leave policy']
+    assert len(bedrock.calls) == 2
@@ -0,0 +1,164 @@
+"""Generation against a simulated Bedrock that enforces an account-wide token quota"""
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fakes import FakeBedrock, client_error
+from utils.errors import APIError
+
+PRIMARY, FALLBACK = 'primary-model', 'fallback-model'
+# Account quotas, in tokens per minute; small enough that a test run spends them
+QUOTAS = {PRIMARY: 12_000, FALLBACK: 24_000}
+CONTAINERS, REQUESTS = 8, 12
+LATENCY_S = 0.05
+MAX_TOKENS = 100
+
+
+class SimulatedBedrock:
+    """bedrock-runtime shared by every container, throttling calls over each model's quota.
+
+    Each model has a token bucket holding a minute of its quota; a call
+    that finds the bucket short of its tokens is rejected with a
+    ThrottlingException and consumes nothing.
+    """
+
+    def __init__(self, quotas):
+        self.quotas = dict(quotas)
+        self.rates = {model: quota / 60 for model, quota in quotas.items()}
+        self.buckets = dict(self.quotas)
+        self.updated = time.monotonic()
+        self.served = {model: 0 for model in quotas}
+        self.throttled = {model: 0 for model in quotas}
+        self._lock = threading.Lock()
+
+    def invoke_model(self, modelId, body, **kwargs):
+        usage = {'input_tokens': len(body) // 4, 'output_tokens': json.loads(body)['max_tokens']}
+        with self._lock:
+            now = time.monotonic()
+            for model, rate in self.rates.items():
+                self.buckets[model] = min(self.quotas[model], self.buckets[model] + (now - self.updated) * rate)
+            self.updated = now
+            cost = usage['input_tokens'] + usage['output_tokens']
+            if self.buckets[modelId] < cost:
+                self.throttled[modelId] += 1
+                raise client_error('ThrottlingException')
+            self.buckets[modelId] -= cost
+            self.served[modelId] += 1
+        time.sleep(LATENCY_S)
+        response = {'content': [{'type': 'text', 'text': 'The answer.'}], 'usage': usage}
+        return {'body': io.BytesIO(json.dumps(response).encode('utf-8'))}
+
+
+def _body(n):
+    return {'max_tokens': MAX_TOKENS, 'messages': [{'role': 'user', 'content': f'Question {n}? ' * 40}]}
+
+
+def run_containers(monkeypatch, bedrock, share_quota):
+    """Every container sends REQUESTS requests one after another, as a Lambda container does"""
+    from services.generation import GenerationClient
+
+    monkeypatch.setenv('BEDROCK_MODEL_ID', PRIMARY)
+    monkeypatch.setenv('BEDROCK_FALLBACK_MODEL_ID', FALLBACK)
+    monkeypatch.setenv('BEDROCK_BACKOFF_BASE_MS', '20')
+    monkeypatch.setenv('BEDROCK_QUEUE_TIMEOUT_MS', '1000')
+    if share_quota:
+        monkeypatch.setenv('BEDROCK_TOKENS_PER_MINUTE', str(QUOTAS[PRIMARY]))
+        monkeypatch.setenv('BEDROCK_FALLBACK_TOKENS_PER_MINUTE', str(QUOTAS[FALLBACK]))
+        monkeypatch.setenv('BEDROCK_EXPECTED_CONCURRENCY', str(CONTAINERS))
+    else:
+        # Limits far above the quota: only Bedrock's throttling pushes back
+        monkeypatch.setenv('BEDROCK_TOKENS_PER_MINUTE', '100000000')
+        monkeypatch.setenv('BEDROCK_FALLBACK_TOKENS_PER_MINUTE', '100000000')
+    clients = [GenerationClient(bedrock) for _ in range(CONTAINERS)]
+
+    def container(client):
+        failed = 0
+        for n in range(REQUESTS):
+            try:
+                client.invoke(_body(n))
+            except APIError:
+                failed += 1
+        return failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=CONTAINERS) as pool:
+        failed = sum(pool.map(container, clients))
+    elapsed = time.perf_counter() - start
+
+    metrics = {name: sum(client.metrics[name] for client in clients)
+               for name in ('requests', 'succeeded', 'attempts', 'throttled', 'fallbacks', 'shed')}
+    assert metrics['requests'] - metrics['succeeded'] == failed
+    return metrics, elapsed
+
+
+def test_quota_share_keeps_containers_under_the_account_quota(monkeypatch, bench):
+    results = {}
+    for share_quota in (False, True):
+        bedrock = SimulatedBedrock(QUOTAS)
+        metrics, elapsed = run_containers(monkeypatch, bedrock, share_quota)
+        results[share_quota] = metrics
+        bench(containers=CONTAINERS, quota_share=share_quota, **metrics,
+              goodput=round(metrics['succeeded'] / metrics['requests'], 3),
+              attempt_success=round(1 - metrics['throttled'] / metrics['attempts'], 3),
+              primary_served=bedrock.served[PRIMARY], fallback_served=bedrock.served[FALLBACK],
+              elapsed_s=round(elapsed, 2))
+
+    shared, unshared = results[True], results[False]
+    assert shared['throttled'] < unshared['throttled']
+    assert shared['succeeded'] >= unshared['succeeded']
+    assert shared['succeeded'] == CONTAINERS * REQUESTS
+
+
+def test_tokens_per_minute_are_split_between_containers(monkeypatch):
+    from services.generation import GenerationClient
+
+    monkeypatch.setenv('BEDROCK_TOKENS_PER_MINUTE', '120000')
+    monkeypatch.setenv('BEDROCK_EXPECTED_CONCURRENCY', '4')
+
+    bucket = GenerationClient(FakeBedrock()).models[0].tokens
+    assert bucket.burst == 30000
+    assert bucket.rate == 500
+
+
+@pytest.mark.parametrize('code', ['AccessDeniedException', 'ResourceNotFoundException'])
+def test_unavailable_model_falls_back(monkeypatch, code):
+    from services.generation import GenerationClient
+
+    monkeypatch.setenv('BEDROCK_MODEL_ID', PRIMARY)
+    monkeypatch.setenv('BEDROCK_FALLBACK_MODEL_ID', FALLBACK)
+    bedrock = FakeBedrock(errors=[code])
+    client = GenerationClient(bedrock)
+
+    assert client.invoke(_body(0))['content'][0]['text'] == 'The answer.'
+    # Not retried on the model it was denied
+    assert bedrock.calls == [PRIMARY, FALLBACK]
+    assert client.metrics['unavailable'] == 1
+
+
+def test_no_available_model_is_a_503(monkeypatch):
+    from services.generation import GenerationClient
+
+    monkeypatch.setenv('BEDROCK_MODEL_ID', PRIMARY)
+    monkeypatch.setenv('BEDROCK_FALLBACK_MODEL_ID', FALLBACK)
+    client = GenerationClient(FakeBedrock(errors=['AccessDeniedException', 'ResourceNotFoundException']))
+
+    with pytest.raises(APIError) as error:
+        client.invoke(_body(0))
+    assert error.value.status_code == 503
+
+
+def test_generation_client_makes_a_single_attempt_per_call():
+    from utils.clients import get_client, reset_clients
+
+    try:
+        shared = get_client('bedrock-runtime', region_name='us-east-1')
+        generation = get_client('bedrock-runtime', region_name='us-east-1', max_attempts=1)
+        assert generation is not shared
+        assert generation.meta.config.retries['total_max_attempts'] == 1
+        assert shared.meta.config.retries['total_max_attempts'] == 4
+    finally:
+        reset_clients()
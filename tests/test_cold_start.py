@@ -0,0 +1,43 @@
+"""Cold versus warm invocations of the API Lambda: clients and services are built once and reused"""
+import json
+
+from conftest import summarize, timed_ms
+
+WARM_INVOCATIONS = 50
+
+
+def list_chats_event():
+    return {
+        'httpMethod': 'GET',
+        'path': '/chats',
+        'requestContext': {'authorizer': {'claims': {'sub': 'user-1', 'email': 'user@example.com'}}},
+    }
+
+
+def test_warm_invocations_reuse_clients_and_services(aws, bench):
+    import api
+
+    dynamodb = aws.stubber('dynamodb')
+    for _ in range(WARM_INVOCATIONS + 1):
+        dynamodb.add_response('query', {'Items': [{'userId': {'S': 'user-1'}, 'chatId': {'S': 'c1'}}]})
+    aws.created.clear()
+
+    response, cold_ms = timed_ms(api.lambda_handler, list_chats_event(), None)
+    assert response['statusCode'] == 200
+    assert json.loads(response['body'])['items'] == [{'userId': 'user-1', 'chatId': 'c1'}]
+    created_cold = len(aws.created)
+
+    warm = []
+    for _ in range(WARM_INVOCATIONS):
+        response, elapsed = timed_ms(api.lambda_handler, list_chats_event(), None)
+        assert response['statusCode'] == 200
+        warm.append(elapsed)
+
+    # Only the cold start builds clients; warm invocations reuse them
+    assert created_cold > 0
+    assert len(aws.created) == created_cold
+    dynamodb.assert_no_pending_responses()
+
+    warm_stats = summarize(warm)
+    assert warm_stats['p50_ms'] < cold_ms
+    bench(cold_ms=round(cold_ms, 2), clients_created=created_cold, **warm_stats)
@@ -0,0 +1,116 @@
+"""Direct uploads: the client's contentHash is verified before anything is deduplicated on it"""
+import base64
+import hashlib
+import json
+import uuid
+
+import pytest
+
+from fakes import make_pdf
+from utils.errors import APIError
+
+BUCKET = 'rag-test-documents'
+PDF = make_pdf(['text'] * 2)
+CONTENT_HASH = hashlib.sha256(PDF).hexdigest()
+
+
+def _direct_upload(processor, key, claimed_hash=CONTENT_HASH, checksum=True, user_email='user@example.com'):
+    """Store the object as S3 would after a presigned POST (with its checksum) or a multipart upload"""
+    processor.s3.put_object(
+        Bucket=BUCKET, Key=key, Body=PDF, ContentType='application/pdf',
+        Metadata={'claimed_content_hash': claimed_hash, 'original_filename': 'report.pdf', 'user_email': user_email},
+        ChecksumSHA256=base64.b64encode(hashlib.sha256(PDF).digest()).decode('ascii') if checksum else None
+    )
+
+
+def test_create_upload_binds_the_claimed_hash_as_a_checksum(aws):
+    from services.knowledge_base_service import KnowledgeBaseService
+
+    upload = KnowledgeBaseService().create_upload(
+        'report.pdf', 'application/pdf', len(PDF), 'user@example.com', CONTENT_HASH.upper()
+    )
+
+    # Not content-addressed until the processor has verified the hash
+    assert uuid.UUID(upload['s3_key'].split('/')[-1][:-len('.pdf')])
+    fields = upload['fields']
+    assert fields['x-amz-meta-claimed_content_hash'] == CONTENT_HASH
+    assert 'x-amz-meta-content_hash' not in fields
+    assert base64.b64decode(fields['x-amz-checksum-sha256']).hex() == CONTENT_HASH
+    policy = json.loads(base64.b64decode(fields['policy']))
+    assert {'x-amz-checksum-sha256': fields['x-amz-checksum-sha256']} in policy['conditions']
+
+
+def test_only_the_uploader_can_complete_a_multipart_upload(aws, monkeypatch):
+    from services.knowledge_base_service import KnowledgeBaseService
+
+    monkeypatch.setenv('MULTIPART_THRESHOLD_BYTES', '1')
+    service = KnowledgeBaseService()
+    aws.stubber('s3').add_response('create_multipart_upload', {'UploadId': 'upload-1'})
+    upload = service.create_upload('report.pdf', 'application/pdf', len(PDF), 'owner@example.com')
+    parts = [{'partNumber': 1, 'etag': '"etag-1"'}]
+
+    for email in ('other@example.com', None):
+        with pytest.raises(APIError) as error:
+            service.complete_upload(upload['s3_key'], 'upload-1', parts, email)
+        assert error.value.status_code == 404
+
+    aws.stubber('s3').add_response(
+        'complete_multipart_upload', {'ETag': '"done"'},
+        {'Bucket': BUCKET, 'Key': upload['s3_key'], 'UploadId': 'upload-1',
+         'MultipartUpload': {'Parts': [{'PartNumber': 1, 'ETag': '"etag-1"'}]}}
+    )
+    assert service.complete_upload(upload['s3_key'], 'upload-1', parts, 'Owner@example.com')['etag'] == '"done"'
+    aws.stubber('s3').assert_no_pending_responses()
+
+
+def test_post_upload_is_verified_from_its_s3_checksum(processor):
+    _direct_upload(processor, 'uploads/first.pdf')
+
+    result = processor.process_file(BUCKET, 'uploads/first.pdf')
+
+    assert result['statusCode'] == 200
+    item = processor.dynamodb.items[CONTENT_HASH]
+    assert item['s3Key'] == {'S': 'uploads/first.pdf'}
+    assert item['owners'] == {'SS': ['user@example.com']}
+    assert item['status'] == {'S': 'indexed'}
+
+
+def test_multipart_upload_is_rehashed_and_a_false_claim_is_ignored(processor):
+    _direct_upload(processor, 'uploads/first.pdf', claimed_hash='0' * 64, checksum=False)
+
+    result = processor.process_file(BUCKET, 'uploads/first.pdf')
+
+    assert result['statusCode'] == 200
+    # Deduplicated on what was actually uploaded, not on the claim
+    assert set(processor.dynamodb.items) == {CONTENT_HASH, f"doc-{CONTENT_HASH}"}
+
+
+def test_duplicate_is_removed_and_its_uploader_recorded(processor):
+    _direct_upload(processor, 'uploads/first.pdf', user_email='first@example.com')
+    processor.process_file(BUCKET, 'uploads/first.pdf')
+    documents = dict(processor.kendra.documents)
+    _direct_upload(processor, 'uploads/second.pdf')
+
+    result = processor.process_file(BUCKET, 'uploads/second.pdf')
+
+    body = json.loads(result['body'])
+    assert body['duplicate'] is True
+    assert body['document_id'] == f"doc-{CONTENT_HASH}"
+    assert 'uploads/second.pdf' not in processor.s3.objects
+    assert processor.kendra.documents == documents
+    item = processor.dynamodb.items[CONTENT_HASH]
+    assert item['s3Key'] == {'S': 'uploads/first.pdf'}
+    assert item['owners'] == {'SS': ['first@example.com', 'user@example.com']}
+    assert item['uploadCount'] == {'N': '2'}
+
+
+def test_retry_of_the_same_upload_is_not_a_duplicate(processor):
+    _direct_upload(processor, 'uploads/first.pdf')
+    processor.claim_direct_upload(CONTENT_HASH, processor.get_s3_object(BUCKET, 'uploads/first.pdf'))
+    processor.set_ingestion_state(f"doc-{CONTENT_HASH}", 'started')
+
+    result = processor.process_file(BUCKET, 'uploads/first.pdf')
+
+    assert result['statusCode'] == 200
+    assert 'duplicate' not in json.loads(result['body'])
+    assert processor.dynamodb.items[CONTENT_HASH]['uploadCount'] == {'N': '1'}
@@ -0,0 +1,107 @@
+"""Extraction tiering: every page is checked for a text layer and only scanned pages are OCRed"""
+import json
+import time
+
+from botocore.stub import ANY
+
+from fakes import make_pdf
+
+BUCKET = 'rag-test-documents'
+TEXTRACT_TOPIC = 'arn:aws:sns:us-east-1:123456789012:textract'
+TEXTRACT_ROLE = 'arn:aws:iam::123456789012:role/textract'
+
+
+def _upload(processor, key, data):
+    processor.s3.put_object(
+        Bucket=BUCKET, Key=key, Body=data, ContentType='application/pdf',
+        Metadata={'content_hash': key.split('/')[-1][:-len('.pdf')], 'user_email': 'user@example.com'}
+    )
+
+
+def _expect_ocr(processor, pages):
+    for page in pages:
+        processor.textract_stub.add_response('detect_document_text', {'Blocks': [{
+            'BlockType': 'LINE', 'Text': f"Scanned page {page} reads the same as its text layer would.", 'Page': 1,
+            'Geometry': {'BoundingBox': {'Top': 0.1, 'Height': 0.02, 'Left': 0.1, 'Width': 0.5}}
+        }]}, {'Document': {'Bytes': ANY}})
+
+
+def _enable_notifications(monkeypatch):
+    monkeypatch.setenv('TEXTRACT_SNS_TOPIC_ARN', TEXTRACT_TOPIC)
+    monkeypatch.setenv('TEXTRACT_ROLE_ARN', TEXTRACT_ROLE)
+
+
+def test_scanned_pages_of_a_text_pdf_are_ocred(processor):
+    kinds = ['text'] * 10
+    kinds[2] = kinds[6] = 'scan'
+    _upload(processor, 'uploads/mixed.pdf', make_pdf(kinds))
+    _expect_ocr(processor, [3, 7])
+
+    tier, lines = processor.choose_extraction_tier(processor.get_s3_object(BUCKET, 'uploads/mixed.pdf'))
+    lines = list(lines)
+
+    assert tier == 'sync'
+    processor.textract_stub.assert_no_pending_responses()
+    # Scanned pages beyond the first few used to be indexed as empty
+    assert {line.page for line in lines if line.text.startswith('Scanned page')} == {3, 7}
+    assert {line.page for line in lines} == set(range(1, 11))
+    assert [line.page for line in lines] == sorted(line.page for line in lines)
+
+
+def test_too_many_scanned_pages_go_to_an_async_job(processor, monkeypatch):
+    _enable_notifications(monkeypatch)
+    monkeypatch.setenv('SYNC_TEXTRACT_MAX_PAGES', '2')
+    _upload(processor, 'uploads/scans.pdf', make_pdf(['text', 'scan', 'scan', 'scan'], image_bytes=5_000))
+    processor.textract_stub.add_response('start_document_text_detection', {'JobId': 'job-1'}, {
+        'DocumentLocation': {'S3Object': {'Bucket': BUCKET, 'Name': 'uploads/scans.pdf'}},
+        'NotificationChannel': {'SNSTopicArn': TEXTRACT_TOPIC, 'RoleArn': TEXTRACT_ROLE},
+        'JobTag': 'scans'
+    })
+
+    result = processor.process_file(BUCKET, 'uploads/scans.pdf')
+
+    assert result['statusCode'] == 202
+    processor.textract_stub.assert_no_pending_responses()
+
+
+def test_tier_benchmark(processor, monkeypatch, bench):
+    """Bytes read from S3 and pages sent to synchronous Textract for each kind of PDF"""
+    _enable_notifications(monkeypatch)
+    probe = 256 * 1024
+    monkeypatch.setenv('PDF_PROBE_BYTES', str(probe))
+    documents = {
+        'text': ['text'] * 40,
+        'mixed': ['text'] * 36 + ['scan'] * 4,
+        'scan': ['scan'] * 40,
+    }
+    for name, kinds in documents.items():
+        key = f"uploads/{name}.pdf"
+        data = make_pdf(kinds, image_bytes=100_000)
+        _upload(processor, key, data)
+        scanned = [page for page, kind in enumerate(kinds, start=1) if kind == 'scan']
+        if name == 'scan':
+            processor.textract_stub.add_response('start_document_text_detection', {'JobId': 'job-1'}, {
+                'DocumentLocation': {'S3Object': {'Bucket': BUCKET, 'Name': key}},
+                'NotificationChannel': {'SNSTopicArn': TEXTRACT_TOPIC, 'RoleArn': TEXTRACT_ROLE},
+                'JobTag': name
+            })
+        else:
+            _expect_ocr(processor, scanned)
+        processor.s3.bytes_read = 0
+
+        started = time.perf_counter()
+        result = processor.process_file(BUCKET, key)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        processor.textract_stub.assert_no_pending_responses()
+        tier = 'async' if result['statusCode'] == 202 else ('sync' if scanned else 'local')
+        bench(document=name, tier=tier, size_bytes=len(data), s3_bytes_read=processor.s3.bytes_read,
+              sync_ocr_pages=0 if tier == 'async' else len(scanned), ms=round(elapsed_ms, 1))
+        if name == 'scan':
+            # Only the ranged probe is read before the file goes to Textract
+            assert processor.s3.bytes_read == probe
+            assert json.loads(result['body'])['job_id'] == 'job-1'
+        else:
+            assert result['statusCode'] == 200
+            # The probe is reused, not read twice
+            assert processor.s3.bytes_read == len(data)
@@ -0,0 +1,156 @@
+"""Rolling chat summaries and the block-aligned history window"""
+import pytest
+
+from fakes import FakeChatsTable, FakeMessagesTable
+
+TURNS = 150
+
+
+class CountingSummarizer:
+    def __init__(self):
+        self.calls = 0
+        self.folded = 0
+
+    def __call__(self, previous, messages):
+        self.calls += 1
+        self.folded += len(messages)
+        return f"{previous} +{len(messages)}".strip()
+
+
+def make_history(monkeypatch, block, summarize=True):
+    from services.history_manager import ChatHistoryManager
+
+    monkeypatch.setenv('CHAT_HISTORY_MAX_MESSAGES', '20')
+    monkeypatch.setenv('CHAT_HISTORY_BLOCK_MESSAGES', str(block))
+    summarizer = CountingSummarizer()
+    messages = FakeMessagesTable()
+    chats = FakeChatsTable([{'userId': 'user-1', 'chatId': 'chat-1'}])
+    history = ChatHistoryManager(chats, messages, summarizer if summarize else None)
+    return history, messages, chats, summarizer
+
+
+def next_window(history, chats):
+    chat = dict(chats.chats['chat-1'])
+    return history.select_window(history.get_recent('chat-1'), chat.get('summarizedThrough', '')), chat
+
+
+def run_chat(history, messages, chats):
+    """Play TURNS turns; returns the first replayed messageId of each"""
+    starts = []
+    for turn in range(TURNS):
+        (window, slide_through), chat = next_window(history, chats)
+        if slide_through:
+            history.refresh_summary(chat, slide_through)
+        starts.append(window[0]['messageId'] if window else None)
+        messages.add('chat-1', 'user', f'question {turn}', 1_700_000_000_000 + turn * 2000)
+        messages.add('chat-1', 'assistant', f'answer {turn}', 1_700_000_000_000 + turn * 2000 + 1000)
+    return starts
+
+
+@pytest.mark.parametrize('block', [2, 10])
+def test_summaries_fold_every_dropped_message_once(monkeypatch, block):
+    history, messages, chats, summarizer = make_history(monkeypatch, block)
+    run_chat(history, messages, chats)
+
+    chat = chats.chats['chat-1']
+    summarized = [item for item in messages.items if item['messageId'] <= chat['summarizedThrough']]
+    assert summarizer.folded == len(summarized)
+    # The next window starts right where the summary ends, or where its next slide will end it
+    (window, slide_through), _ = next_window(history, chats)
+    before = messages.items[messages.items.index(window[0]) - 1]
+    assert before['messageId'] == (slide_through or chat['summarizedThrough'])
+    assert len(window) <= history.max_messages
+
+
+def test_prompt_prefix_only_changes_when_the_window_slides_a_block(monkeypatch, bench):
+    slides, calls = {}, {}
+    for block in (2, 10):
+        history, messages, chats, summarizer = make_history(monkeypatch, block)
+        starts = run_chat(history, messages, chats)[1:]
+        slides[block] = sum(1 for before, after in zip(starts, starts[1:]) if before != after)
+        calls[block] = summarizer.calls
+
+    # Once the window is full, every turn adds two messages: a block of ten lasts five turns
+    assert slides[10] <= TURNS // 5
+    assert slides[2] >= TURNS - 15
+    # The summary is refreshed at the slides only
+    assert calls[10] <= slides[10] + 1
+    bench(turns=TURNS, window_slides_block_2=slides[2], window_slides_block_10=slides[10],
+          summary_calls_block_2=calls[2], summary_calls_block_10=calls[10])
+
+
+def test_window_slides_in_blocks_without_summaries(monkeypatch):
+    history, messages, chats, summarizer = make_history(monkeypatch, 10, summarize=False)
+    starts = run_chat(history, messages, chats)[1:]
+
+    assert summarizer.calls == 0
+    assert 'historySummary' not in chats.chats['chat-1']
+    assert chats.chats['chat-1']['summarizedThrough'] < starts[-1]
+    assert sum(1 for before, after in zip(starts, starts[1:]) if before != after) <= TURNS // 5
+
+
+def test_window_reaching_into_the_summary_does_not_query(monkeypatch):
+    history, messages, chats, summarizer = make_history(monkeypatch, 10)
+    chat = chats.chats['chat-1']
+    chat['summarizedThrough'] = 'msg_1700000009000_assistant'
+
+    history.refresh_summary(chat, 'msg_1700000004000_user')
+
+    assert messages.queries == 0
+    assert summarizer.calls == 0
+
+
+def test_concurrent_turns_cannot_move_the_summary_backwards(monkeypatch):
+    history, messages, chats, summarizer = make_history(monkeypatch, 10)
+    for turn in range(30):
+        messages.add('chat-1', 'user', f'question {turn}', 1_700_000_000_000 + turn * 1000)
+    ids = [item['messageId'] for item in messages.items]
+
+    # Two turns read the chat before either has written its fold
+    stale = dict(chats.chats['chat-1'])
+    history.refresh_summary(chats.chats['chat-1'], ids[19])
+    history.refresh_summary(stale, ids[9])
+
+    assert chats.chats['chat-1']['summarizedThrough'] == ids[19]
+    assert summarizer.calls == 2
+
+
+def test_retrieved_context_gets_no_cache_breakpoint(aws):
+    from services.registry import get_chat_service
+
+    system, messages = get_chat_service()._cacheable_prompt('Earlier turns.', 'Handbook excerpt', [
+        {'role': 'user', 'content': 'First question?'},
+        {'role': 'assistant', 'content': 'First answer.'},
+        {'role': 'user', 'content': 'Second question?'},
+    ])
+
+    blocks = system + [block for message in messages for block in message['content']]
+    # One breakpoint after the summary and one after the replayed history
+    assert [block for block in blocks if 'cache_control' in block] == [system[0], messages[1]['content'][-1]]
+    assert 'cache_control' not in messages[-1]['content'][0]
+
+
+@pytest.mark.parametrize('wait_ms', [0, 100])
+def test_reply_does_not_wait_for_a_slow_summary_refresh(aws, monkeypatch, wait_ms):
+    import threading
+    import time
+
+    from fakes import fake_chat_service
+    from services.chat_service import ChatService, _io_executor
+    from utils.timing import StageTimer
+
+    monkeypatch.setenv('CHAT_SUMMARY_WAIT_MS', str(wait_ms))
+    service = ChatService()
+    store, _, _ = fake_chat_service(service, {'chat-1': 'user-1'})
+    summarized = threading.Event()
+    refresh = _io_executor.submit(summarized.wait, 5)
+
+    started = time.perf_counter()
+    reply = service._finish_turn('chat-1', 'The answer.', 'user-1', 1_700_000_000_000, [refresh], StageTimer(), {})
+    elapsed = time.perf_counter() - started
+
+    assert reply['message'] == 'The answer.'
+    assert not refresh.done()
+    assert wait_ms / 1000 <= elapsed < wait_ms / 1000 + 0.5
+    summarized.set()
+    assert refresh.result(timeout=1)
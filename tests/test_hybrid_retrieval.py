@@ -0,0 +1,156 @@
+"""Hybrid retrieval on a synthetic corpus: recall and per-stage latency, degraded results"""
+import json
+import logging
+import time
+import zlib
+
+import numpy as np
+import pytest
+
+from conftest import summarize
+from fakes import FakeS3
+
+DIMENSION = 64
+DOCUMENTS, CHUNKS, TOPICS, WORDS = 200, 20, 40, 30
+QUERIES, TOP_K = 200, 3
+
+
+class SynonymEmbedder:
+    """Bag-of-words embeddings in which a word and its synonym share a vector.
+
+    Topic words are 't<topic>w<n>' and their synonyms 's<topic>w<n>': BM25
+    treats them as different terms, the embedding as the same meaning.
+    """
+    name = 'fake'
+    dimension = DIMENSION
+
+    def _word(self, token):
+        meaning = 't' + token[1:] if token[0] in 'st' and token[1:2].isdigit() else token
+        return np.random.default_rng(zlib.crc32(meaning.encode('utf-8'))).standard_normal(DIMENSION)
+
+    def embed(self, texts):
+        from embedders import normalize_rows
+        from services.lexical_index import tokenize
+
+        return normalize_rows(np.stack([sum(self._word(token) for token in tokenize(text)) for text in texts]))
+
+
+def _chunk_words(rng, topic):
+    return [f"t{topic}w{n}" for n in rng.choice(WORDS, 12, replace=False)]
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    """Chunks of topic words plus a unique part number; half the queries paraphrase, half quote the number"""
+    from vector_store import write_segment
+
+    rng = np.random.default_rng(11)
+    embedder = SynonymEmbedder()
+    s3 = FakeS3()
+    chunks = {}
+    for document in range(DOCUMENTS):
+        topic = document % TOPICS
+        texts = [' '.join(_chunk_words(rng, topic) + [f"part{document}x{row}"]) for row in range(CHUNKS)]
+        write_segment(s3, 'bucket', f"doc{document}", f"Document {document}", texts, embedder.embed(texts), 'fake')
+        chunks.update({text: (f"doc{document}", row) for row, text in enumerate(texts)})
+
+    queries = []
+    for i, (text, target) in enumerate(list(chunks.items())[::len(chunks) // QUERIES][:QUERIES]):
+        words = text.split()
+        if i % 2:
+            # A paraphrase: synonyms of the chunk's words, which only the embedding matches
+            query = ' '.join('s' + word[1:] for word in words[:6])
+        else:
+            # An exact part number with a couple of words that many chunks share
+            query = f"{words[-1]} {words[0]} {words[1]}"
+        queries.append((query, target))
+    return s3, embedder, queries, tmp_path_factory.mktemp('hybrid-index')
+
+
+def _retriever(corpus, monkeypatch):
+    from services.lexical_index import BM25Index
+    from services.reranker import TermOverlapReranker
+    from services.retrieval import HybridRetriever
+    from services.vector_index import VectorIndex
+
+    s3, embedder, _, cache_dir = corpus
+    monkeypatch.setenv('VECTOR_INDEX_CACHE_DIR', str(cache_dir))
+    index = VectorIndex(s3, 'bucket', 'fake', DIMENSION)
+    return HybridRetriever(index, embedder, BM25Index(), TermOverlapReranker())
+
+
+def _hybrid_timings(caplog):
+    return [json.loads(record.getMessage().split('timings ')[1].split('; over budget')[0])
+            for record in caplog.records if record.getMessage().startswith('Hybrid retrieval:')]
+
+
+def _recall(results, queries):
+    return round(float(np.mean([target in found for found, (_, target) in zip(results, queries)])), 3)
+
+
+def test_hybrid_recall_and_stage_latency(corpus, monkeypatch, caplog, bench):
+    retriever = _retriever(corpus, monkeypatch)
+    queries = corpus[2]
+    retriever.refresh()
+
+    lexical = [{(doc, row) for _, doc, row in retriever.lexical.search(query, TOP_K)} for query, _ in queries]
+    vector = [set(retriever._vector_search(query)[:TOP_K]) for query, _ in queries]
+
+    caplog.set_level(logging.INFO, logger='services.retrieval')
+    hybrid = []
+    for query, _ in queries:
+        passages = retriever.retrieve(query, TOP_K)
+        assert not passages.degraded
+        hybrid.append({(passage.document_id, passage.text) for passage in passages})
+    segments = retriever.index.segments
+    hybrid = [{(doc, segments[f"vector-index/{doc}"].chunks.index(text)) for doc, text in found} for found in hybrid]
+
+    recall = {name: _recall(results, queries) for name, results in
+              (('lexical', lexical), ('vector', vector), ('hybrid', hybrid))}
+    timings = _hybrid_timings(caplog)
+    stages = {f"{stage}_p50_ms": summarize([t[stage] for t in timings])['p50_ms']
+              for stage in ('refresh', 'lexical', 'vector', 'fuse', 'rerank')}
+    bench(chunks=DOCUMENTS * CHUNKS, queries=QUERIES, **{f"recall_at_{TOP_K}_{name}": value
+                                                         for name, value in recall.items()},
+          **stages, **summarize([t['total'] for t in timings]))
+
+    # Part numbers need the lexical stage and paraphrases the vector stage; fusion keeps both
+    assert recall['hybrid'] > max(recall['lexical'], recall['vector'])
+
+
+def test_postings_are_synced_in_refresh_only_when_segments_change(corpus, monkeypatch):
+    retriever = _retriever(corpus, monkeypatch)
+    synced = []
+    sync = retriever.lexical.sync
+    monkeypatch.setattr(retriever.lexical, 'sync', lambda segments: synced.append(sync(segments)))
+
+    retriever.retrieve('part1x1', TOP_K)
+    retriever.retrieve('part2x2', TOP_K)
+    assert len(synced) == 1
+
+    retriever.index.refresh(force=True)
+    retriever.retrieve('part3x3', TOP_K)
+    assert len(synced) == 2
+
+
+def test_result_missing_a_stage_is_degraded_and_not_cached(corpus, monkeypatch, aws):
+    from services.registry import get_chat_service
+
+    retriever = _retriever(corpus, monkeypatch)
+    service = get_chat_service()
+    service.retriever = retriever
+    service._query_kendra('part5x5')
+    assert service.retrieval_cache.get(service.retrieval_namespace, 'part5x5') is not None
+
+    # The vector stage misses its budget
+    monkeypatch.setitem(retriever.budgets_ms, 'vector', 1)
+    search = retriever.index.search
+    monkeypatch.setattr(retriever.index, 'search', lambda *args: time.sleep(0.05) or search(*args))
+    assert retriever.retrieve('part4x4', TOP_K).degraded
+    service._query_kendra('part4x4')
+    assert service.retrieval_cache.get(service.retrieval_namespace, 'part4x4') is None
+
+    # The lexical stage fails
+    monkeypatch.setitem(retriever.budgets_ms, 'vector', 5000)
+    monkeypatch.setattr(retriever.lexical, 'search', lambda *args: 1 / 0)
+    assert retriever.retrieve('part4x4', TOP_K).degraded
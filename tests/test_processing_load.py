@@ -0,0 +1,85 @@
+"""A batch of SQS records through the embeddings processor, with some files failing"""
+import json
+import time
+
+from fakes import FakeKendra, make_pdf
+
+BUCKET = 'rag-test-documents'
+
+
+def _record(message_id, key):
+    return {
+        'messageId': message_id,
+        'messageAttributes': {'eventType': {'stringValue': 'S3Event'}},
+        'body': json.dumps({'Records': [{'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}}]})
+    }
+
+
+def test_every_failed_file_is_reported_for_redelivery(processor, monkeypatch, bench):
+    monkeypatch.setenv('PROCESSING_WORKERS', '4')
+    monkeypatch.setattr(processor, 'kendra', FakeKendra(latency=0.02))
+    pdf = make_pdf(['text'] * 3)
+    records, expected_failures = [], set()
+    for i in range(40):
+        key = f"uploads/file-{i:02d}.pdf"
+        metadata = {'content_hash': f"{i:064x}"}
+        # A quarter of the uploads have no email to notify
+        if i % 4:
+            metadata['user_email'] = 'user@example.com'
+        if i % 5 == 0:
+            # Not a PDF, so processing fails
+            processor.s3.put_object(Bucket=BUCKET, Key=key, Body=b'plain text', Metadata=metadata,
+                                    ContentType='text/plain')
+            expected_failures.add(f"message-{i}")
+        else:
+            processor.s3.put_object(Bucket=BUCKET, Key=key, Body=pdf, Metadata=metadata,
+                                    ContentType='application/pdf')
+        records.append(_record(f"message-{i}", key))
+
+    started = time.perf_counter()
+    result = processor.lambda_handler({'Records': records}, None)
+    elapsed = time.perf_counter() - started
+
+    failed = {item['itemIdentifier'] for item in result['batchItemFailures']}
+    # Failures without an email used to come back as a 500 dict and count as processed
+    assert failed == expected_failures
+    assert {f"{i:064x}" for i in range(0, 40, 5)} == {
+        content_hash for content_hash, item in processor.dynamodb.items.items()
+        if item['status']['S'] == 'failed' and not content_hash.startswith('doc-')
+    }
+    bench(files=len(records), failed=len(failed), files_per_second=round(len(records) / elapsed, 1),
+          kendra_batches=processor.kendra.batches)
+
+
+def _chunks(count):
+    from chunking import Chunk
+
+    return [Chunk(text=f"Paragraph {i} of the report.", page=1, index=i) for i in range(count)]
+
+
+def test_index_version_is_bumped_once_kendra_has_indexed_the_chunks(processor, monkeypatch):
+    monkeypatch.setenv('KENDRA_STATUS_POLL_SECONDS', '0.05')
+    kendra = FakeKendra(indexing_delay=0.2)
+    monkeypatch.setattr(processor, 'kendra', kendra)
+    bumps = []
+    monkeypatch.setattr(processor, 'bump_index_version',
+                        lambda: bumps.append(all(kendra.indexed(doc_id) for doc_id in kendra.documents)))
+
+    count = processor.store_in_kendra(_chunks(25), {'title': 'Report'}, 'doc-1', f"s3://{BUCKET}/report.pdf")
+
+    # BatchPutDocument returns before Kendra has indexed anything
+    assert count == 25 and bumps == [True]
+
+
+def test_index_version_is_still_bumped_when_kendra_is_slow(processor, monkeypatch):
+    monkeypatch.setenv('KENDRA_STATUS_POLL_SECONDS', '0.05')
+    monkeypatch.setenv('KENDRA_INDEX_WAIT_SECONDS', '0.2')
+    kendra = FakeKendra(indexing_delay=60)
+    monkeypatch.setattr(processor, 'kendra', kendra)
+    bumps = []
+    monkeypatch.setattr(processor, 'bump_index_version', lambda: bumps.append(time.perf_counter()))
+
+    started = time.perf_counter()
+    processor.store_in_kendra(_chunks(3), {'title': 'Report'}, 'doc-1', f"s3://{BUCKET}/report.pdf")
+
+    assert len(bumps) == 1 and bumps[0] - started < 1
@@ -0,0 +1,97 @@
+"""Identical questions arriving on several containers at once share one retrieval"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import summarize
+from fakes import FakeRetriever, client_error, fake_chat_service
+
+CONTAINERS = 8
+BURSTS = 5
+RETRIEVAL_S = 0.3
+
+
+class FakeCacheTable:
+    """The retrieval cache table shared by all containers: entries and leases"""
+
+    def __init__(self):
+        self.items = {}
+        self._lock = threading.Lock()
+
+    def get_item(self, Key):
+        with self._lock:
+            item = self.items.get(Key['cacheKey'])
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        with self._lock:
+            current = self.items.get(Item['cacheKey'])
+            if ConditionExpression and current and current['expiresAt'] >= ExpressionAttributeValues[':now']:
+                raise client_error('ConditionalCheckFailedException', 'PutItem')
+            self.items[Item['cacheKey']] = dict(Item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        with self._lock:
+            current = self.items.get(Key['cacheKey'])
+            if not current or current['owner'] != ExpressionAttributeValues[':owner']:
+                raise client_error('ConditionalCheckFailedException', 'DeleteItem')
+            del self.items[Key['cacheKey']]
+        return {}
+
+
+def make_containers(table, lease):
+    """One ChatService per Lambda container, each with its own retriever and local cache"""
+    from services.chat_service import ChatService
+    from services.retrieval_cache import RetrievalCache
+    from services.single_flight import DynamoLease
+
+    containers = []
+    for _ in range(CONTAINERS):
+        service = ChatService()
+        fake_chat_service(service, {'chat-1': 'user-1'}, retriever=FakeRetriever(latency=RETRIEVAL_S))
+        service.retrieval_cache = RetrievalCache(table)
+        service.retrieval_lease = DynamoLease(table) if lease else None
+        containers.append(service)
+    return containers
+
+
+def run_bursts(containers):
+    """Each burst sends one new question to every container at once"""
+    samples = []
+
+    def turn(service, question):
+        start = time.perf_counter()
+        service.send_message('chat-1', question, 'user-1')
+        samples.append((time.perf_counter() - start) * 1000)
+
+    with ThreadPoolExecutor(max_workers=CONTAINERS) as pool:
+        for burst in range(BURSTS):
+            question = f'What is policy {burst}?'
+            list(pool.map(lambda service: turn(service, question), containers))
+    return sum(len(service.retriever.queries) for service in containers), samples
+
+
+@pytest.mark.parametrize('lease', [False, True])
+def test_lease_shares_one_retrieval_across_containers(aws, bench, lease):
+    containers = make_containers(FakeCacheTable(), lease)
+
+    retrievals, samples = run_bursts(containers)
+
+    bench(containers=CONTAINERS, questions=BURSTS, lease=lease, retrievals=retrievals,
+          retrievals_per_question=retrievals / BURSTS, **summarize(samples))
+    if lease:
+        assert retrievals == BURSTS
+    else:
+        assert retrievals == CONTAINERS * BURSTS
+
+
+def test_every_turn_runs_its_own_generation(aws):
+    containers = make_containers(FakeCacheTable(), lease=True)
+
+    run_bursts(containers)
+
+    # Each container serves one invocation at a time, so replies are never shared
+    assert sum(len(service.generator.bedrock.calls) for service in containers) == CONTAINERS * BURSTS
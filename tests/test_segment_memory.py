@@ -0,0 +1,116 @@
+"""SegmentWriter spools chunks and vectors to /tmp instead of holding a document in memory"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import tracemalloc
+import zlib
+
+import numpy as np
+
+from fakes import FakeS3
+
+DIMENSION = 512
+
+
+class SeededEmbedder:
+    """Unit vectors derived from each text's checksum, so any row can be checked against its chunk"""
+    name = 'seeded'
+    dimension = DIMENSION
+
+    def embed(self, texts):
+        vectors = np.stack([
+            np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(DIMENSION) for text in texts
+        ]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class DiskS3(FakeS3):
+    """Keeps uploaded files on disk, so the upload itself adds nothing to the measured heap"""
+
+    def __init__(self):
+        super().__init__()
+        self.directory = tempfile.mkdtemp()
+        self.uploaded = {}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        path = os.path.join(self.directory, Key.replace('/', '_'))
+        shutil.copyfile(Filename, path)
+        self.uploaded[Key] = (path, dict((ExtraArgs or {}).get('Metadata', {})))
+
+
+def _chunks(count):
+    return (f"Chunk {i}: " + 'quarterly revenue and operating costs ' * 25 for i in range(count))
+
+
+def _spooled_peak(count):
+    from vector_store import SegmentWriter
+
+    s3 = DiskS3()
+    tracemalloc.start()
+    writer = SegmentWriter(s3, 'bucket', SeededEmbedder(), 'doc', 'Doc')
+    for chunk in _chunks(count):
+        writer.add(chunk)
+    writer.finish()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    shutil.rmtree(s3.directory)
+    return peak
+
+
+def _buffered_peak(count):
+    """What the writer did before: keep every chunk and vector until finish, then serialise in memory"""
+    embedder = SeededEmbedder()
+    tracemalloc.start()
+    chunks, vectors, pending = [], [], []
+    for chunk in _chunks(count):
+        pending.append(chunk)
+        if len(pending) == 32:
+            vectors.append(embedder.embed(pending))
+            chunks.extend(pending)
+            pending = []
+    matrix = np.vstack(vectors)
+    body = json.dumps({'document_id': 'doc', 'chunks': chunks}).encode('utf-8')
+    buffer = io.BytesIO()
+    np.save(buffer, matrix)
+    npy = buffer.getvalue()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del body, npy
+    return peak
+
+
+def test_spooled_segment_round_trips_with_ivf(monkeypatch):
+    from ivf import train_centroids
+    from vector_store import SegmentWriter, _load_segment_files
+
+    monkeypatch.setenv('EMBEDDING_BATCH_SIZE', '7')
+    s3 = FakeS3()
+    embedder = SeededEmbedder()
+    texts = list(_chunks(100))
+    centroids = train_centroids(embedder.embed(texts), 8)
+    monkeypatch.setattr('vector_store.load_ivf', lambda s3, bucket: ('v1', centroids))
+
+    writer = SegmentWriter(s3, 'bucket', embedder, 'doc', 'Doc')
+    spool = writer._spool
+    for text in texts:
+        writer.add(text)
+    assert writer.finish() == 100
+
+    metadata, vectors = _load_segment_files(s3, 'bucket', 'vector-index/doc')
+    assert sorted(metadata['chunks']) == sorted(texts)
+    # Rows were reordered by list, and each chunk still sits next to its own vector
+    np.testing.assert_allclose(vectors, embedder.embed(metadata['chunks']), atol=1e-6)
+    assert metadata['list_offsets'][-1] == 100
+    assert not os.path.exists(spool)
+
+
+def test_spooling_bounds_writer_memory(bench):
+    count = 20_000
+    buffered = _buffered_peak(count)
+    spooled = _spooled_peak(count)
+    bench(chunks=count, dimension=DIMENSION, buffered_peak_mb=round(buffered / 2 ** 20, 1),
+          spooled_peak_mb=round(spooled / 2 ** 20, 1))
+    # 20k chunks are ~40 MB of vectors and ~20 MB of text; the spooled writer holds a batch and a copy block
+    assert spooled * 5 < buffered
@@ -0,0 +1,237 @@
+"""Asynchronous Textract paths of the embeddings processor, against a stubbed Textract client"""
+import json
+import time
+
+import pytest
+
+BUCKET = 'rag-test-documents'
+KEY = 'uploads/report.pdf'
+CONTENT_HASH = 'a' * 64
+DOCUMENT_ID = f"doc-{CONTENT_HASH}"
+JOB_ID = 'job-1'
+
+
+def _line(text, page):
+    return {
+        'BlockType': 'LINE', 'Text': text, 'Page': page,
+        'Geometry': {'BoundingBox': {'Top': 0.1, 'Height': 0.02, 'Left': 0.1, 'Width': 0.5}}
+    }
+
+
+def _upload(processor, user_email='user@example.com'):
+    metadata = {'content_hash': CONTENT_HASH, 'original_filename': 'report.pdf'}
+    if user_email:
+        metadata['user_email'] = user_email
+    processor.s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'%PDF-1.4', Metadata=metadata,
+                            ContentType='application/pdf')
+
+
+def _expect_result_pages(processor, job_id=JOB_ID):
+    """Two result pages, linked by NextToken"""
+    processor.textract_stub.add_response(
+        'get_document_text_detection',
+        {'JobStatus': 'SUCCEEDED', 'NextToken': 'page-2',
+         'Blocks': [_line('Quarterly revenue grew by twelve percent.', 1)]},
+        {'JobId': job_id}
+    )
+    processor.textract_stub.add_response(
+        'get_document_text_detection',
+        {'JobStatus': 'SUCCEEDED', 'Blocks': [_line('Operating costs stayed flat.', 2)]},
+        {'JobId': job_id, 'NextToken': 'page-2'}
+    )
+
+
+def _completion(status='SUCCEEDED'):
+    return {
+        'JobId': JOB_ID, 'Status': status, 'API': 'StartDocumentTextDetection',
+        'DocumentLocation': {'S3Bucket': BUCKET, 'S3ObjectName': KEY}
+    }
+
+
+def _indexed_text(processor):
+    return ' '.join(doc['Blob'].decode('utf-8') for doc in processor.kendra.documents.values())
+
+
+def test_completion_indexes_every_result_page(processor):
+    _upload(processor)
+    _expect_result_pages(processor)
+
+    result = processor.handle_textract_completion(_completion())
+
+    assert result['statusCode'] == 200
+    processor.textract_stub.assert_no_pending_responses()
+    text = _indexed_text(processor)
+    assert 'Quarterly revenue' in text and 'Operating costs' in text
+    assert processor.dynamodb.status(CONTENT_HASH) == 'indexed'
+    # The text is cached, so a retry never goes back to Textract
+    assert f"extracted-text/{DOCUMENT_ID}.jsonl.gz" in processor.s3.objects
+    assert processor.sns.subjects() == ['File Processing Completed']
+
+
+def test_failed_job_notifies_and_marks_content_failed(processor):
+    _upload(processor)
+
+    with pytest.raises(Exception):
+        processor.handle_textract_completion(_completion('FAILED'))
+
+    assert processor.dynamodb.status(CONTENT_HASH) == 'failed'
+    assert processor.sns.subjects() == ['File Processing Failed']
+    assert not processor.kendra.documents
+
+
+def test_retry_resumes_the_earlier_job(processor):
+    _upload(processor)
+    processor.set_ingestion_state(DOCUMENT_ID, 'started', textractJobId=JOB_ID)
+    processor.textract_stub.add_response(
+        'get_document_text_detection', {'JobStatus': 'SUCCEEDED', 'Blocks': []},
+        {'JobId': JOB_ID, 'MaxResults': 1}
+    )
+    _expect_result_pages(processor)
+
+    result = processor.process_file(BUCKET, KEY)
+
+    # No start_document_text_detection was stubbed, so a second OCR run would fail here
+    assert result['statusCode'] == 200
+    processor.textract_stub.assert_no_pending_responses()
+    assert 'Operating costs' in _indexed_text(processor)
+    assert processor.dynamodb.status(DOCUMENT_ID) == 'indexed'
+    assert processor.dynamodb.history == ['started', 'extracted', 'indexed', 'indexed']
+
+
+def test_retry_waits_for_a_running_job_notification(processor, monkeypatch):
+    monkeypatch.setenv('TEXTRACT_SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:textract')
+    monkeypatch.setenv('TEXTRACT_ROLE_ARN', 'arn:aws:iam::123456789012:role/textract')
+    _upload(processor)
+    processor.set_ingestion_state(DOCUMENT_ID, 'started', textractJobId=JOB_ID)
+    processor.textract_stub.add_response(
+        'get_document_text_detection', {'JobStatus': 'IN_PROGRESS', 'Blocks': []},
+        {'JobId': JOB_ID, 'MaxResults': 1}
+    )
+
+    result = processor.process_file(BUCKET, KEY)
+
+    assert result['statusCode'] == 202
+    assert json.loads(result['body'])['job_id'] == JOB_ID
+    processor.textract_stub.assert_no_pending_responses()
+    assert not processor.kendra.documents
+
+
+def test_expired_job_is_not_resumed(processor, monkeypatch):
+    monkeypatch.setenv('TEXTRACT_SNS_TOPIC_ARN', 'arn:aws:sns:us-east-1:123456789012:textract')
+    monkeypatch.setenv('TEXTRACT_ROLE_ARN', 'arn:aws:iam::123456789012:role/textract')
+    monkeypatch.setattr(processor.pdf_text, 'PdfReader', None)
+    _upload(processor)
+    processor.set_ingestion_state(DOCUMENT_ID, 'started', textractJobId='expired-job')
+    processor.textract_stub.add_client_error('get_document_text_detection', 'InvalidJobIdException')
+    processor.textract_stub.add_response(
+        'start_document_text_detection', {'JobId': 'job-2'},
+        {
+            'DocumentLocation': {'S3Object': {'Bucket': BUCKET, 'Name': KEY}},
+            'NotificationChannel': {
+                'SNSTopicArn': 'arn:aws:sns:us-east-1:123456789012:textract',
+                'RoleArn': 'arn:aws:iam::123456789012:role/textract'
+            },
+            'JobTag': CONTENT_HASH
+        }
+    )
+
+    result = processor.process_file(BUCKET, KEY)
+
+    assert result['statusCode'] == 202
+    assert processor.dynamodb.items[DOCUMENT_ID]['textractJobId'] == {'S': 'job-2'}
+    processor.textract_stub.assert_no_pending_responses()
+
+
+def test_failed_job_without_an_email_still_raises(processor):
+    # SNS only retries the notification when the handler raises
+    _upload(processor, user_email=None)
+
+    with pytest.raises(Exception):
+        processor.handle_textract_completion(_completion('FAILED'))
+
+    assert processor.dynamodb.status(CONTENT_HASH) == 'failed'
+    assert not processor.sns.messages
+
+
+def test_text_is_checkpointed_before_indexing(processor, monkeypatch):
+    _upload(processor)
+    _expect_result_pages(processor)
+    put_documents = processor.kendra.batch_put_document
+    monkeypatch.setattr(processor.kendra, 'batch_put_document', lambda **kwargs: 1 / 0)
+
+    with pytest.raises(Exception):
+        processor.handle_textract_completion(_completion())
+
+    assert processor.dynamodb.history == ['extracted', 'failed', 'failed']
+    monkeypatch.setattr(processor.kendra, 'batch_put_document', put_documents)
+
+    # Nothing is stubbed on Textract, so the retry can only index the cached text
+    result = processor.process_file(BUCKET, KEY)
+
+    assert result['statusCode'] == 200
+    assert 'Operating costs' in _indexed_text(processor)
+    assert processor.dynamodb.status(DOCUMENT_ID) == 'indexed'
+
+
+def test_upload_without_a_content_hash_is_checkpointed(processor):
+    processor.s3.put_object(Bucket=BUCKET, Key=KEY, Body=b'%PDF-1.4', ContentType='application/pdf',
+                            Metadata={'original_filename': 'report.pdf', 'user_email': 'user@example.com'})
+    _expect_result_pages(processor)
+
+    processor.handle_textract_completion(_completion())
+
+    document_id = processor.document_id_for(BUCKET, KEY, None)
+    assert processor.dynamodb.status(document_id) == 'indexed'
+    assert f"extracted-text/{document_id}.jsonl.gz" in processor.s3.objects
+
+
+def test_indexing_overlaps_extraction(processor, monkeypatch, bench):
+    from chunking import TextLine
+
+    _upload(processor)
+    events = []
+    put_documents = processor.kendra.batch_put_document
+
+    def recorded_put(**kwargs):
+        events.append(('batch', time.perf_counter()))
+        return put_documents(**kwargs)
+
+    def slow_pages(pages=30, per_page=10):
+        """Lines arriving a Textract result page at a time"""
+        for page in range(1, pages + 1):
+            time.sleep(0.005)
+            for row in range(per_page):
+                yield TextLine(f"Page {page} line {row} of the annual report. " * 3, page, row / per_page, 0.02)
+        events.append(('extracted', time.perf_counter()))
+
+    monkeypatch.setattr(processor.kendra, 'batch_put_document', recorded_put)
+    started = time.perf_counter()
+    processor.index_new_text(BUCKET, KEY, slow_pages(), CONTENT_HASH)
+
+    first_batch = next(at for name, at in events if name == 'batch')
+    extracted = next(at for name, at in events if name == 'extracted')
+    bench(first_batch_ms=round((first_batch - started) * 1000, 1),
+          extraction_done_ms=round((extracted - started) * 1000, 1),
+          batches=sum(1 for name, _ in events if name == 'batch'))
+    # Kendra gets its first batch while later pages are still being extracted
+    assert first_batch < extracted
+    assert processor.dynamodb.status(DOCUMENT_ID) == 'indexed'
+    assert f"extracted-text/{DOCUMENT_ID}.jsonl.gz" in processor.s3.objects
+
+
+def test_vector_segment_is_named_after_the_document(processor, monkeypatch):
+    from chunking import TextLine
+
+    monkeypatch.setattr(processor, 'vector_index_enabled', True)
+    monkeypatch.setenv('EMBEDDER', 'hashing')
+    lines = [TextLine('Quarterly revenue grew by twelve percent.')]
+    uploads = [('uploads/a/report.pdf', CONTENT_HASH), ('uploads/b/report.pdf', CONTENT_HASH),
+               ('uploads/c/report.pdf', 'b' * 64)]
+    for key, content_hash in uploads:
+        processor.s3.put_object(Bucket=BUCKET, Key=key, Body=b'%PDF-1.4', ContentType='application/pdf',
+                                Metadata={'content_hash': content_hash, 'user_email': 'user@example.com'})
+        processor.index_extracted_text(BUCKET, key, lines, content_hash)
+
+    # The same content under a new key replaces its segment; another file with the same name gets its own
+    segments = sorted(key for key in processor.s3.objects if key.startswith('vector-index/') and key.endswith('.json'))
+    assert segments == [f"vector-index/{DOCUMENT_ID}.json", f"vector-index/doc-{'b' * 64}.json"]
@@ -0,0 +1,91 @@
+"""Chat titles are unique per user: concurrent creates and the marker backfill for older chats"""
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import ROOT
+from fakes import FakeChatItems
+from utils.errors import APIError
+
+sys.path.insert(0, os.path.join(ROOT, 'scripts'))
+
+CREATORS = 16
+
+# Chats from before title markers: two share a title, one belongs to someone else
+OLD_CHATS = [
+    {'userId': 'user-1', 'chatId': 'chat-a', 'title': 'Budget', 'created_at': '2024-01-01T00:00:00'},
+    {'userId': 'user-1', 'chatId': 'chat-b', 'title': 'Budget', 'created_at': '2024-01-02T00:00:00'},
+    {'userId': 'user-1', 'chatId': 'chat-c', 'title': 'Hiring', 'created_at': '2024-01-03T00:00:00'},
+    {'userId': 'user-2', 'chatId': 'chat-d', 'title': 'Budget', 'created_at': '2024-01-04T00:00:00'},
+]
+
+
+@pytest.fixture
+def chats(aws):
+    from services.registry import get_chat_service
+
+    service = get_chat_service()
+    items = FakeChatItems(OLD_CHATS)
+    service.table = items
+    service.dynamodb = items
+    return service, items
+
+
+def _create_concurrently(service, title, user_id='user-1'):
+    start = threading.Barrier(CREATORS)
+
+    def create(_):
+        start.wait()
+        try:
+            return service.create_chat(title, user_id)
+        except APIError as e:
+            return e.status_code
+
+    with ThreadPoolExecutor(max_workers=CREATORS) as pool:
+        return list(pool.map(create, range(CREATORS)))
+
+
+def test_concurrent_creates_of_one_title_make_one_chat(chats):
+    service, items = chats
+
+    results = _create_concurrently(service, 'Roadmap')
+
+    created = [result for result in results if isinstance(result, dict)]
+    assert len(created) == 1
+    assert results.count(409) == CREATORS - 1
+    assert [chat['title'] for chat in items.chats('user-1')].count('Roadmap') == 1
+
+
+def test_backfill_claims_the_titles_of_older_chats(chats):
+    from backfill_title_markers import backfill_title_markers
+
+    service, items = chats
+
+    assert backfill_title_markers(items, dry_run=True) == {'chats': 4, 'created': 3, 'existing': 0, 'duplicates': 1}
+    counts = backfill_title_markers(items)
+
+    assert counts == {'chats': 4, 'created': 3, 'existing': 0, 'duplicates': 1}
+    assert items.get_item(Key={'userId': 'user-1', 'chatId': 'title#Budget'})['Item']['titleOf'] == 'chat-a'
+    # Titles that predate the markers can no longer be reused, by racing creates either
+    assert _create_concurrently(service, 'Hiring') == [409] * CREATORS
+    assert service.create_chat('Budget', 'user-3')['title'] == 'Budget'
+
+
+def test_backfill_can_be_rerun_while_chats_are_created(chats):
+    from backfill_title_markers import backfill_title_markers
+
+    service, items = chats
+    backfill_title_markers(items)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        rerun = pool.submit(backfill_title_markers, items)
+        results = _create_concurrently(service, 'Roadmap', 'user-2')
+
+    assert rerun.result()['created'] == 0
+    assert len([result for result in results if isinstance(result, dict)]) == 1
+    assert items.get_item(Key={'userId': 'user-2', 'chatId': 'title#Roadmap'})['Item']['titleOf'] in {
+        chat['chatId'] for chat in items.chats('user-2')
+    }
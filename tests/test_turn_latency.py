@@ -0,0 +1,47 @@
+"""Stage timings of a chat turn with injected backend latency"""
+import json
+import logging
+
+from conftest import summarize
+from fakes import FakeBedrock, FakeChatStore, FakeRetriever, fake_chat_service
+
+TURNS = 20
+WRITE_S, READ_S, RETRIEVE_S, GENERATE_S = 0.03, 0.06, 0.05, 0.02
+
+
+def stage_timings(caplog):
+    prefix = 'Stage timings for chat chat-1: '
+    return [json.loads(record.getMessage()[len(prefix):])
+            for record in caplog.records if record.getMessage().startswith(prefix)]
+
+
+def test_history_read_overlaps_the_rest_of_the_turn(aws, caplog, bench):
+    from services.registry import get_chat_service
+
+    service = get_chat_service()
+    fake_chat_service(
+        service, {'chat-1': 'user-1'},
+        bedrock=FakeBedrock(latency=GENERATE_S),
+        retriever=FakeRetriever(latency=RETRIEVE_S),
+        store=FakeChatStore({'chat-1': 'user-1'}, write_latency=WRITE_S, read_latency=READ_S)
+    )
+
+    caplog.set_level(logging.INFO, logger='services.chat_service')
+    for turn in range(TURNS):
+        service.send_message('chat-1', f'Question {turn}?', 'user-1')
+
+    timings = stage_timings(caplog)
+    assert len(timings) == TURNS
+    for stages in timings:
+        assert {'save_user_message', 'query_kendra', 'get_chat_history',
+                'generate', 'save_assistant_message', 'total'} <= set(stages)
+        # Each injected delay shows up in its own stage
+        assert stages['save_user_message'] >= WRITE_S * 1000
+        assert stages['get_chat_history'] >= READ_S * 1000
+        assert stages['generate'] >= GENERATE_S * 1000
+
+    serial_ms = (2 * WRITE_S + READ_S + RETRIEVE_S + GENERATE_S) * 1000
+    totals = summarize([stages['total'] for stages in timings])
+    # The history read runs alongside the write and retrieval rather than after them
+    assert totals['p50_ms'] < serial_ms - READ_S * 1000 / 2
+    bench(serial_ms=round(serial_ms, 2), **totals)
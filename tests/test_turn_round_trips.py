@@ -0,0 +1,102 @@
+"""DynamoDB round trips of a chat turn through TurnStore, with injected per-call latency"""
+import threading
+import time
+
+import pytest
+from boto3.dynamodb.types import TypeDeserializer
+
+from conftest import summarize
+from fakes import FakeBedrock, FakeRetriever, client_error, fake_chat_service
+from services.turn_store import TurnStore
+from utils.errors import APIError
+
+TURNS = 20
+RTT_S = 0.02
+# What a turn cost before TurnStore: get_item for ownership, then a put_item and
+# a counter update_item for each of the two messages
+SEPARATE_CALLS = 5
+
+_deserializer = TypeDeserializer()
+
+
+class FakeTransactClient:
+    """TransactWriteItems over chats and messages tables, ``rtt`` seconds per call"""
+
+    def __init__(self, owners, rtt=0.0):
+        self.owners = owners
+        self.rtt = rtt
+        self.calls = 0
+        self.message_ids = set()
+        self._lock = threading.Lock()
+
+    def transact_write_items(self, TransactItems):
+        time.sleep(self.rtt)
+        update, put = TransactItems[0]['Update'], TransactItems[1]['Put']
+        key = {name: _deserializer.deserialize(value) for name, value in update['Key'].items()}
+        message_id = _deserializer.deserialize(put['Item']['messageId'])
+        with self._lock:
+            self.calls += 1
+            reasons = [
+                'None' if self.owners.get(key['chatId']) == key['userId'] else 'ConditionalCheckFailed',
+                'ConditionalCheckFailed' if message_id in self.message_ids else 'None',
+            ]
+            if reasons != ['None', 'None']:
+                error = client_error('TransactionCanceledException', 'TransactWriteItems')
+                error.response['CancellationReasons'] = [{'Code': code} for code in reasons]
+                raise error
+            self.message_ids.add(message_id)
+        return {}
+
+
+@pytest.fixture
+def service(aws):
+    from services.registry import get_chat_service
+
+    service = get_chat_service()
+    fake_chat_service(service, {'chat-1': 'user-1'})
+    service.history.get_recent = lambda chat_id, exclude_message_id=None: []
+    return service
+
+
+def _use_client(service, client):
+    service.turns = TurnStore(client, 'rag-test-chats', 'rag-test-messages')
+
+
+def test_turn_writes_in_two_round_trips(service, bench):
+    client = FakeTransactClient({'chat-1': 'user-1'}, rtt=RTT_S)
+    _use_client(service, client)
+
+    samples = []
+    for turn in range(TURNS):
+        start = time.perf_counter()
+        service.send_message('chat-1', f'Question {turn}?', 'user-1')
+        samples.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.002)  # a new millisecond, so every turn gets its own message ids
+
+    assert client.calls == 2 * TURNS
+    totals = summarize(samples)
+    bench(rtt_ms=RTT_S * 1000, round_trips=2, separate_calls_ms=SEPARATE_CALLS * RTT_S * 1000, **totals)
+    # Ownership check, message and counter share a round trip, for both messages
+    assert totals['p50_ms'] < (SEPARATE_CALLS - 1) * RTT_S * 1000
+
+
+def test_nothing_is_retrieved_for_a_chat_the_caller_does_not_own(service):
+    _use_client(service, FakeTransactClient({'chat-1': 'user-1'}))
+
+    with pytest.raises(APIError) as error:
+        service.send_message('chat-1', 'Question?', 'user-2')
+
+    assert error.value.status_code == 404
+    assert service.retriever.queries == []
+    assert service.generator.bedrock.calls == []
+
+
+def test_message_id_collision_is_a_conflict():
+    client = FakeTransactClient({'chat-1': 'user-1'})
+    store = TurnStore(client, 'rag-test-chats', 'rag-test-messages')
+    store.save_user_message('chat-1', 'user-1', 'Question?', 1000)
+
+    with pytest.raises(APIError) as error:
+        store.save_user_message('chat-1', 'user-1', 'Question again?', 1000)
+
+    assert error.value.status_code == 409
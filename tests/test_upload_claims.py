@@ -0,0 +1,104 @@
+"""Content claims made by uploads through the API, against stubbed DynamoDB and S3"""
+import hashlib
+import json
+
+import pytest
+from botocore.stub import ANY
+
+DATA = b'%PDF-1.4 quarterly report'
+CONTENT_HASH = hashlib.sha256(DATA).hexdigest()
+KEY = f"{CONTENT_HASH}.pdf"
+
+
+class UploadedFile:
+    filename = 'report.pdf'
+    type = 'application/pdf'
+
+    def chunks(self):
+        yield memoryview(DATA)
+
+
+@pytest.fixture
+def kb(aws, monkeypatch):
+    monkeypatch.setenv('DOCUMENTS_TABLE', 'rag-test-documents')
+    from services.knowledge_base_service import KnowledgeBaseService
+    return KnowledgeBaseService()
+
+
+def _expect_claim(aws, claimed=True):
+    dynamodb = aws.stubber('dynamodb')
+    params = {
+        'TableName': 'rag-test-documents',
+        'Key': {'contentHash': CONTENT_HASH},
+        # SET/ADD in place: a takeover keeps the owners already recorded
+        'UpdateExpression': (
+            'SET s3Key = :key, originalFilename = :filename, #status = :pending, pendingUntil = :until, '
+            'createdAt = if_not_exists(createdAt, :now), lastUploadedAt = :now ADD uploadCount :one, owners :owner'
+        ),
+        'ConditionExpression': ANY,
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': ANY,
+    }
+    if claimed:
+        dynamodb.add_response('update_item', {}, params)
+    else:
+        dynamodb.add_client_error('update_item', 'ConditionalCheckFailedException', expected_params=params)
+
+
+def _expect_put(aws):
+    aws.stubber('s3').add_response('put_object', {'ETag': '"etag"'}, {
+        'Bucket': 'rag-test-documents', 'Key': KEY, 'Body': DATA,
+        'ContentType': 'application/pdf', 'Metadata': ANY
+    })
+
+
+def test_claim_is_a_lease_confirmed_after_the_upload(aws, kb):
+    _expect_claim(aws)
+    _expect_put(aws)
+    aws.stubber('dynamodb').add_response('update_item', {}, {
+        'TableName': 'rag-test-documents',
+        'Key': {'contentHash': CONTENT_HASH},
+        'UpdateExpression': 'SET #status = :uploaded REMOVE pendingUntil',
+        'ConditionExpression': '#status = :pending AND s3Key = :key',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {':uploaded': 'uploaded', ':pending': 'pending', ':key': KEY},
+    })
+
+    result = kb.add_to_knowledge_base(UploadedFile(), 'user@example.com')
+
+    assert result['statusCode'] == 200
+    assert json.loads(result['body'])['duplicate'] is False
+    aws.stubber('dynamodb').assert_no_pending_responses()
+    aws.stubber('s3').assert_no_pending_responses()
+
+
+def test_confirmation_leaves_a_later_status_alone(aws, kb):
+    # The processor got to the file first and marked it started
+    _expect_claim(aws)
+    _expect_put(aws)
+    aws.stubber('dynamodb').add_client_error('update_item', 'ConditionalCheckFailedException')
+
+    result = kb.add_to_knowledge_base(UploadedFile(), 'user@example.com')
+
+    assert result['statusCode'] == 200
+    aws.stubber('dynamodb').assert_no_pending_responses()
+
+
+def test_duplicate_records_the_owner_without_uploading(aws, kb):
+    _expect_claim(aws, claimed=False)
+    aws.stubber('dynamodb').add_response('update_item', {'Attributes': {
+        'contentHash': {'S': CONTENT_HASH}, 's3Key': {'S': KEY}, 'status': {'S': 'indexed'},
+        'owners': {'SS': ['first@example.com', 'user@example.com']}
+    }}, {
+        'TableName': 'rag-test-documents',
+        'Key': {'contentHash': CONTENT_HASH},
+        'UpdateExpression': 'SET lastUploadedAt = :now ADD uploadCount :one, owners :owner',
+        'ExpressionAttributeValues': ANY,
+        'ReturnValues': 'ALL_NEW',
+    })
+
+    result = kb.add_to_knowledge_base(UploadedFile(), 'user@example.com')
+
+    body = json.loads(result['body'])
+    assert body['duplicate'] is True and body['status'] == 'indexed'
+    aws.stubber('dynamodb').assert_no_pending_responses()
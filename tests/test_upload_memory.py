@@ -0,0 +1,88 @@
+"""Proxied uploads are streamed to S3 through one part buffer: peak memory and failed uploads"""
+import tracemalloc
+
+import pytest
+
+from fakes import FakeS3
+
+BOUNDARY = 'benchmark-boundary'
+MB = 2 ** 20
+
+
+class SinkS3(FakeS3):
+    """Accepts multipart uploads and keeps only the part sizes"""
+
+    def __init__(self):
+        super().__init__()
+        self.part_sizes = []
+
+    def create_multipart_upload(self, **kwargs):
+        return {'UploadId': 'upload'}
+
+    def upload_part(self, Body, PartNumber, **kwargs):
+        self.part_sizes.append(len(Body))
+        return {'ETag': f'"{PartNumber}"'}
+
+    def complete_multipart_upload(self, **kwargs):
+        return {}
+
+
+def _peak_allocated(fn, *args):
+    """Run fn and return the most memory Python had allocated meanwhile, in bytes"""
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _event_body(size):
+    """A multipart/form-data body with one text file, the way API Gateway hands it over"""
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="big.txt"\r\n'
+            'Content-Type: text/plain\r\n\r\n')
+    return ''.join([head, 'x' * size, f'\r\n--{BOUNDARY}--\r\n'])
+
+
+@pytest.mark.parametrize('size_mb', [16, 64])
+def test_streamed_upload_peak_memory_does_not_grow_with_the_file(aws, bench, size_mb):
+    from services.knowledge_base_service import KnowledgeBaseService
+    from utils.multipart import get_file_field
+
+    kb = KnowledgeBaseService()
+    kb.s3 = SinkS3()
+    body = _event_body(size_mb * MB)
+    field = get_file_field(body, False, f'multipart/form-data; boundary={BOUNDARY}')
+
+    streamed = _peak_allocated(kb._stream_to_s3, field, 'big.txt', 'text/plain', {})
+    # What the handler did before streaming: read the whole file, then upload it
+    buffered = _peak_allocated(lambda: b''.join(field.chunks()))
+
+    assert sum(kb.s3.part_sizes) == size_mb * MB
+    bench(file_mb=size_mb, part_mb=kb.upload_part_size // MB,
+          streamed_peak_mb=round(streamed / MB, 1), buffered_peak_mb=round(buffered / MB, 1))
+    # One part buffer plus a parser chunk, however large the file
+    assert streamed < kb.upload_part_size * 2
+    assert buffered >= size_mb * MB
+    assert buffered - streamed > size_mb * MB - kb.upload_part_size * 2
+
+
+def test_failed_abort_does_not_hide_the_upload_error(aws):
+    from services.knowledge_base_service import KnowledgeBaseService
+    from utils.multipart import get_file_field
+
+    class FailingS3(SinkS3):
+        def upload_part(self, PartNumber, **kwargs):
+            if PartNumber == 2:
+                raise ConnectionError('connection reset')
+            return super().upload_part(PartNumber=PartNumber, **kwargs)
+
+        def abort_multipart_upload(self, **kwargs):
+            raise PermissionError('AccessDenied')
+
+    kb = KnowledgeBaseService()
+    kb.s3 = FailingS3()
+    field = get_file_field(_event_body(3 * kb.upload_part_size), False, f'multipart/form-data; boundary={BOUNDARY}')
+
+    with pytest.raises(ConnectionError):
+        kb._stream_to_s3(field, 'big.txt', 'text/plain', {})
@@ -0,0 +1,170 @@
+"""IVF search over merged lists: recall@k and latency against exact search"""
+import os
+import json
+
+import numpy as np
+import pytest
+
+from conftest import summarize, timed_ms
+from fakes import FakeS3
+
+DIMENSION = 64
+SEGMENTS, ROWS = 400, 100
+QUERIES, TOP_K = 200, 10
+
+
+def clustered(rng, centers, count):
+    from embedders import normalize_rows
+
+    noise = rng.normal(scale=1.5 / np.sqrt(DIMENSION), size=(count, DIMENSION))
+    return normalize_rows(centers[rng.integers(0, len(centers), count)] + noise)
+
+
+@pytest.fixture(scope='module')
+def corpus(tmp_path_factory):
+    """40k clustered vectors in 400 segments, IVF-partitioned like production"""
+    from embedders import normalize_rows
+    from vector_store import rebuild_ivf, write_segment
+
+    rng = np.random.default_rng(7)
+    centers = normalize_rows(rng.normal(size=(200, DIMENSION)))
+    vectors = clustered(rng, centers, SEGMENTS * ROWS)
+    s3 = FakeS3()
+    originals = {}
+    for i in range(SEGMENTS):
+        chunks = [f"doc{i}-chunk{j}" for j in range(ROWS)]
+        write_segment(s3, 'bucket', f"doc{i}", f"Document {i}", chunks, vectors[i * ROWS:(i + 1) * ROWS], 'fake')
+        originals.update(zip(chunks, vectors[i * ROWS:(i + 1) * ROWS]))
+    rebuild_ivf(s3, 'bucket')
+    return s3, originals, clustered(rng, centers, QUERIES), tmp_path_factory.mktemp('vector-index')
+
+
+def open_index(s3, cache_dir, monkeypatch):
+    from services.vector_index import VectorIndex
+
+    monkeypatch.setenv('VECTOR_INDEX_CACHE_DIR', str(cache_dir))
+    index = VectorIndex(s3, 'bucket', 'fake', DIMENSION)
+    index.refresh(force=True)
+    return index
+
+
+def run_queries(index, queries, nprobe):
+    results, latencies = [], []
+    for query in queries:
+        hits, elapsed = timed_ms(index.search, query, TOP_K, nprobe)
+        results.append(hits[0])
+        latencies.append(elapsed)
+    return results, latencies
+
+
+def test_ivf_recall_and_latency_against_exact_search(corpus, monkeypatch, bench):
+    s3, originals, queries, cache_dir = corpus
+    index = open_index(s3, cache_dir, monkeypatch)
+    assert len(index._lists) == 1 and len(index._lists[0].segments) == SEGMENTS
+
+    exact, exact_ms = run_queries(index, queries, nprobe=len(index.centroids))
+    truth = [{hit.text for hit in hits} for hits in exact]
+    exact_stats = summarize(exact_ms)
+    bench(nprobe='exact', recall_at_10=1.0, qps=round(1000 / exact_stats['p50_ms']), **exact_stats)
+
+    for nprobe in (4, index.nprobe, 64):
+        approximate, ivf_ms = run_queries(index, queries, nprobe)
+        recall = np.mean([len({hit.text for hit in hits} & expected) / TOP_K
+                          for hits, expected in zip(approximate, truth)])
+        stats = summarize(ivf_ms)
+        bench(nprobe=nprobe, recall_at_10=round(float(recall), 3),
+              qps=round(1000 / stats['p50_ms']), **stats)
+
+        # Merged rows map back to the right chunk of the right segment
+        for query, hits in zip(queries[:20], approximate[:20]):
+            for hit in hits:
+                assert hit.score == pytest.approx(float(originals[hit.text] @ query), abs=1e-5)
+        if nprobe == index.nprobe:
+            assert recall >= 0.8
+            assert stats['p50_ms'] * 4 < exact_stats['p50_ms']
+
+
+def test_half_rewritten_segment_keeps_serving_the_previous_copy(corpus, monkeypatch, tmp_path):
+    from vector_store import write_segment
+
+    s3 = FakeS3()
+    vectors = np.eye(DIMENSION, dtype=np.float32)[:4]
+    write_segment(s3, 'bucket', 'doc', 'Doc', ['a', 'b', 'c', 'd'], vectors, 'fake')
+    index = open_index(s3, tmp_path, monkeypatch)
+
+    # A rewrite that has put its .npy but not yet its .json
+    stale_json = s3.objects['vector-index/doc.json']
+    write_segment(s3, 'bucket', 'doc', 'Doc', ['d', 'c', 'b', 'a'], vectors[::-1], 'fake')
+    s3.objects['vector-index/doc.json'] = stale_json
+    index.refresh(force=True)
+    assert index.search(vectors[0], 1)[0][0].text == 'a'
+
+    write_segment(s3, 'bucket', 'doc', 'Doc', ['d', 'c', 'b', 'a'], vectors[::-1], 'fake')
+    index.refresh(force=True)
+    hit = index.search(vectors[0], 1)[0][0]
+    assert (hit.text, hit.row) == ('a', 3)
+
+
+def test_new_segments_go_to_a_delta_until_compaction(monkeypatch, tmp_path):
+    from vector_store import rebuild_ivf, write_segment, load_ivf
+
+    rng = np.random.default_rng(3)
+    s3 = FakeS3()
+    vectors = clustered(rng, rng.normal(size=(8, DIMENSION)), 40 * 10)
+    for i in range(40):
+        write_segment(s3, 'bucket', f"doc{i}", f"Document {i}", [f"doc{i}-{j}" for j in range(10)],
+                      vectors[i * 10:(i + 1) * 10], 'fake')
+    monkeypatch.setenv('IVF_NLIST', '4')
+    rebuild_ivf(s3, 'bucket')
+    monkeypatch.setenv('VECTOR_INDEX_COMPACT_RATIO', '0.05')
+    index = open_index(s3, tmp_path, monkeypatch)
+    base = index._lists[0]
+
+    extra = clustered(rng, rng.normal(size=(1, DIMENSION)), 30)
+    for i in range(3):
+        write_segment(s3, 'bucket', f"new{i}", f"New {i}", [f"new{i}-{j}" for j in range(10)],
+                      extra[i * 10:(i + 1) * 10], 'fake', load_ivf(s3, 'bucket'))
+        index.refresh(force=True)
+        if i < 2:
+            # Only the new rows are copied; the base file is kept
+            assert index._lists[0] is not base and index._lists[0].path == base.path
+            assert len(index._lists[1].vectors) == 10 * (i + 1)
+            assert index.search(extra[i * 10], 1, nprobe=2)[0][0].text == f"new{i}-0"
+    # 30 new rows outgrew a twentieth of the 400 merged ones
+    assert len(index._lists) == 1 and len(index._lists[0].vectors) == 430
+    assert not os.path.exists(base.path)
+
+    # A deleted segment's rows are skipped, not rewritten
+    compacted = index._lists[0]
+    del s3.objects['vector-index/doc0.npy']
+    index.refresh(force=True)
+    layout = index._lists[0]
+    assert layout.path == compacted.path
+    assert not layout.live[[seg.document_id for seg in layout.segments].index('doc0')]
+    hits = index.search(vectors[0], TOP_K, nprobe=4)[0]
+    assert all(not hit.text.startswith('doc0-') for hit in hits)
+
+
+def test_rebuild_resumes_where_the_previous_step_stopped(monkeypatch):
+    import vector_store
+    from vector_store import rebuild_ivf, write_segment
+
+    rng = np.random.default_rng(5)
+    s3 = FakeS3()
+    vectors = clustered(rng, rng.normal(size=(8, DIMENSION)), 5 * 20)
+    for i in range(5):
+        write_segment(s3, 'bucket', f"doc{i}", f"Document {i}", [str(j) for j in range(20)],
+                      vectors[i * 20:(i + 1) * 20], 'fake')
+
+    # A deadline already passed: each step repartitions one segment
+    steps = [rebuild_ivf(s3, 'bucket', deadline=0)]
+    while not steps[-1]['done']:
+        assert 'vector-index/_ivf/centroids.json' not in s3.objects
+        steps.append(rebuild_ivf(s3, 'bucket', steps[-1]['version'], steps[-1]['start_after'], deadline=0))
+
+    assert [step['segments'] for step in steps] == [1, 1, 1, 1, 1]
+    version = steps[0]['version']
+    assert vector_store.load_ivf(s3, 'bucket')[0] == version
+    for i in range(5):
+        metadata = json.loads(s3.objects[f'vector-index/doc{i}.json']['Body'])
+        assert metadata['ivf_version'] == version
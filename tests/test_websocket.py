@@ -0,0 +1,110 @@
+"""WebSocket authorizer and streamed replies over a fake Bedrock event stream"""
+import json
+
+from botocore.stub import ANY
+
+from fakes import FakeBedrock, fake_chat_service
+
+METHOD_ARN = 'arn:aws:execute-api:us-east-1:123456789012:abc123/dev/$connect'
+
+
+def authorizer_event(token=None):
+    return {
+        'type': 'REQUEST',
+        'methodArn': METHOD_ARN,
+        'queryStringParameters': {'token': token} if token else None,
+        'requestContext': {'connectionId': 'conn-1', 'routeKey': '$connect'},
+    }
+
+
+def send_message_event(chat_id, content):
+    return {
+        'body': json.dumps({'action': 'sendMessage', 'chatId': chat_id, 'content': content}),
+        'requestContext': {
+            'routeKey': 'sendMessage',
+            'connectionId': 'conn-1',
+            'domainName': 'abc123.execute-api.us-east-1.amazonaws.com',
+            'stage': 'dev',
+            'authorizer': {'principalId': 'user-1'},
+        },
+    }
+
+
+def policy_effect(response):
+    return response['policyDocument']['Statement'][0]['Effect']
+
+
+def test_authorizer_allows_a_valid_access_token(aws):
+    import api
+
+    aws.stubber('cognito-idp').add_response(
+        'get_user',
+        {'Username': 'user', 'UserAttributes': [
+            {'Name': 'sub', 'Value': 'user-1'}, {'Name': 'email', 'Value': 'user@example.com'}
+        ]},
+        {'AccessToken': 'good-token'}
+    )
+    response = api.lambda_handler(authorizer_event('good-token'), None)
+    assert policy_effect(response) == 'Allow'
+    assert response['principalId'] == 'user-1'
+    assert response['context'] == {'email': 'user@example.com'}
+
+
+def test_authorizer_denies_invalid_or_missing_tokens(aws):
+    import api
+
+    aws.stubber('cognito-idp').add_client_error('get_user', 'NotAuthorizedException')
+    assert policy_effect(api.lambda_handler(authorizer_event('forged'), None)) == 'Deny'
+    assert policy_effect(api.lambda_handler(authorizer_event(), None)) == 'Deny'
+    aws.stubber('cognito-idp').assert_no_pending_responses()
+
+
+def posted(aws, count):
+    stubber = aws.stubber('apigatewaymanagementapi')
+    for _ in range(count):
+        stubber.add_response('post_to_connection', {}, {'ConnectionId': 'conn-1', 'Data': ANY})
+    return stubber
+
+
+def test_send_message_streams_each_chunk_then_the_stored_reply(aws, monkeypatch):
+    import api
+    from services.registry import get_chat_service
+
+    bedrock = FakeBedrock(reply='Streaming works fine')
+    store, _, _ = fake_chat_service(get_chat_service(), {'chat-1': 'user-1'}, bedrock=bedrock)
+    sent = []
+    stubber = posted(aws, 4)
+    stubber.client.meta.events.register(
+        'before-parameter-build.apigatewaymanagementapi.PostToConnection',
+        lambda params, **kwargs: sent.append(json.loads(params['Data']))
+    )
+
+    response = api.lambda_handler(send_message_event('chat-1', 'Does streaming work?'), None)
+
+    assert response == {'statusCode': 200}
+    stubber.assert_no_pending_responses()
+    assert [part['text'] for part in sent[:3]] == ['Streaming ', 'works ', 'fine']
+    assert sent[3]['type'] == 'done'
+    assert sent[3]['message']['message'] == 'Streaming works fine'
+    assert [item['author'] for item in store.messages['chat-1']] == ['user', 'assistant']
+    assert store.messages['chat-1'][1]['usage']['output_tokens'] == 3
+
+
+def test_send_message_to_a_chat_the_caller_does_not_own_never_reaches_bedrock(aws):
+    import api
+    from services.registry import get_chat_service
+
+    bedrock = FakeBedrock()
+    fake_chat_service(get_chat_service(), {'chat-1': 'someone-else'}, bedrock=bedrock)
+    sent = []
+    stubber = posted(aws, 1)
+    stubber.client.meta.events.register(
+        'before-parameter-build.apigatewaymanagementapi.PostToConnection',
+        lambda params, **kwargs: sent.append(json.loads(params['Data']))
+    )
+
+    response = api.lambda_handler(send_message_event('chat-1', 'Hello?'), None)
+
+    assert response == {'statusCode': 404}
+    assert sent == [{'type': 'error', 'error': 'Chat not found'}]
+    assert bedrock.calls == []